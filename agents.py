@@ -1,4 +1,13 @@
-from deepseek_api import query_esg_score
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import numpy as np
+
+import metrics
+from disclosure import compact_disclosure
+from deepseek_api import estimate_request_tokens, request_esg_score, query_esg_scores_batch
+from score_table import EXCLUDED, POSITIVE, INTEGRATED, IMPACT
 from tools import (
     yahoo_finance, alpha_vantage_price,
     openaq_pm25, wiki_summary,
@@ -9,53 +18,130 @@ class ESGDimensionAgent:
     """
     ESG维度评分通用Agent基类:根据指定维度对披露内容打分。
     """
+    __slots__ = ("model", "dimension", "score_key")
+
     def __init__(self, model, dimension: str, score_key: str):
         self.model = model
         self.dimension = dimension       # 评分维度名称，例如 "environment", "society"
         self.score_key = score_key       # 在模型评分字典中的键，例如 "env", "soc", "gov"
 
     def step(self):
-        # 遍历所有企业披露内容，调用评分接口
-        for firm, disclosure in self.model.current_disclosures.items():
-            try:
-                score = query_esg_score(disclosure, self.dimension)
-            except Exception as e:
-                print(f"[警告] ESG评分接口异常(维度: {self.dimension}):{e}")
+        # 所有企业披露内容交给评分调度器并发评分，结果按完成顺序写回模型
+        jobs = [
+            (firm_id, request_esg_score, (disclosure, self.dimension), estimate_request_tokens(disclosure))
+            for firm_id, disclosure in self.model.pending_disclosures.items()
+        ]
+        for firm_id, score, error in self.model.scoring_engine.map(jobs):
+            if error is not None:
+                print(f"[警告] ESG评分接口异常(维度: {self.dimension}):{error}")
+                metrics.inc("esg_score_fallbacks_total", dimension=self.dimension)
                 score = 50.0  # 出现异常时给一个中等默认分
-            self.model.assign_score(firm, self.score_key, score)
+            self.model.assign_score(firm_id, self.score_key, score, fallback=error is not None)
 
 class EnvironmentAgent(ESGDimensionAgent):
     """环境维度评分Agent"""
+    __slots__ = ()
+
     def __init__(self, model):
         super().__init__(model, "environment", "env")
 
 class SocialAgent(ESGDimensionAgent):
     """社会维度评分Agent"""
+    __slots__ = ()
+
     def __init__(self, model):
         super().__init__(model, "society", "soc")
 
 class GovernanceAgent(ESGDimensionAgent):
     """公司治理维度评分Agent"""
+    __slots__ = ()
+
     def __init__(self, model):
         super().__init__(model, "governance", "gov")
 
+class BatchESGAgent:
+    """
+    批量评分Agent:对每个企业只发起一次请求，同时获取环境、社会、治理三个维度的评分。
+    回复无法解析时回退到逐维度调用 request_esg_score。
+    """
+    __slots__ = ("model", "dimensions")
+
+    def __init__(self, model, dimensions=None):
+        self.model = model
+        # 维度名称 -> 模型评分字典中的键
+        self.dimensions = dimensions or {"environment": "env", "society": "soc", "governance": "gov"}
+
+    def step(self):
+        engine = self.model.scoring_engine
+        dimensions = tuple(self.dimensions)
+        disclosures = self.model.pending_disclosures
+        jobs = [
+            (firm_id, query_esg_scores_batch, (disclosure, dimensions), estimate_request_tokens(disclosure))
+            for firm_id, disclosure in disclosures.items()
+        ]
+        failed = []
+        for firm_id, scores, error in engine.map(jobs):
+            if error is not None:
+                print(f"[警告] 批量ESG评分失败，回退到逐维度评分：{error}")
+                metrics.inc("esg_batch_fallbacks_total")
+                failed.append(firm_id)
+                continue
+            for dimension, score_key in self.dimensions.items():
+                self.model.assign_score(firm_id, score_key, scores[dimension])
+
+        # 回退：对批量失败的企业逐维度评分
+        fallback_jobs = [
+            ((firm_id, dimension), request_esg_score, (disclosures[firm_id], dimension),
+             estimate_request_tokens(disclosures[firm_id]))
+            for firm_id in failed for dimension in self.dimensions
+        ]
+        for (firm_id, dimension), score, error in engine.map(fallback_jobs):
+            if error is not None:
+                print(f"[警告] ESG评分接口异常(维度: {dimension}):{error}")
+                metrics.inc("esg_score_fallbacks_total", dimension=dimension)
+                score = 50.0
+            self.model.assign_score(firm_id, self.dimensions[dimension], score, fallback=error is not None)
+
 class FirmAgent:
     """
     企业Agent:负责检索企业披露信息,并将其提交给ESG评分Agents。
     """
+    # 单个数据源的最长等待时间（秒），Yahoo→Alpha Vantage 串行回退，因此预算更长
+    SOURCE_TIMEOUTS = {"stock": 15.0, "air_quality": 6.0, "wiki": 8.0, "sec": 12.0, "world_bank": 6.0}
+    DEFAULT_SOURCE_TIMEOUT = 10.0
+    # 单个企业全部数据源的总截止时间（秒）
+    FIRM_DEADLINE = 15.0
+    # 披露中包含的世界银行国家背景指标（例如人均GDP）
+    WORLD_BANK_INDICATORS = ("NY.GDP.PCAP.CD",)
+    # 大规模模拟时企业数可达数十万，使用 __slots__ 去掉每个实例的 __dict__
+    __slots__ = ("unique_id", "model", "firm_name", "ticker", "cik", "city", "country_code",
+                 "_row", "_cached_disclosure", "sections")
+
     def __init__(self, unique_id, model, firm_name=None, ticker=None, cik=None, city=None, country_code=None):
         self.unique_id = unique_id
         self.model = model
         # 公司名称和股票代码，如未提供股票代码则使用名称作为查询依据
         self.firm_name = firm_name or f"Firm-{unique_id}"
-        self.ticker = ticker if ticker else (firm_name or f"Firm-{unique_id}")
+        self.ticker = ticker if ticker else self.firm_name
         # 其他可选属性：CIK代码、城市、国家
         self.cik = cik
         self.city = city
         # 默认为中国，如提供了国家代码则使用提供值
         self.country_code = country_code or "CN"
-        self.investment_received = 0.0
+        # 在模型评分存储中的行号，由 ESGModel 分配
+        self._row = None
         self._cached_disclosure = None
+        # 最近一次生成披露时各部分的文本 {部分名称: 文本}，用于按部分计算指纹；未生成时为 None
+        self.sections = None
+
+    @property
+    def investment_received(self) -> float:
+        """本轮获得的投资总额（存于模型的列式评分存储）。"""
+        return float(self.model.score_store.received[self._row])
+
+    @investment_received.setter
+    def investment_received(self, amount: float):
+        self.model.score_store.received[self._row] = amount
 
     def fetch_base_disclosure(self) -> str:
         """
@@ -63,6 +149,72 @@ class FirmAgent:
         """
         return f"{self.firm_name} 的最新ESG披露概况:环境管理、社会责任与公司治理情况摘要。"
 
+    def _yahoo_or_alpha(self) -> str:
+        """获取财经数据（Yahoo优先，失败则尝试Alpha Vantage），两者需按顺序执行。"""
+        stock_line = yahoo_finance(self.ticker)
+        if not stock_line:  # 若Yahoo未获得数据，则用Alpha Vantage
+            stock_line = alpha_vantage_price(self.ticker)
+        return stock_line
+
+    def _disclosure_sources(self) -> list:
+        """
+        列出本企业可用的数据源，返回 [(名称, 可调用对象), ...]，顺序即披露文本中的顺序。
+        """
+        sources = [("stock", self._yahoo_or_alpha)]
+        # 空气质量数据（需要城市名）
+        if self.city:
+            sources.append(("air_quality", lambda: self._shared(("air_quality", self.city),
+                                                                lambda: openaq_pm25(self.city))))
+        # 维基百科公司简介
+        sources.append(("wiki", lambda: wiki_summary(self.firm_name)))
+        # 美国SEC年报数据（需要CIK）
+        if self.cik:
+            sources.append(("sec", lambda: sec_edgar_10k(self.cik)))
+        # 世界银行指标（例如人均GDP，用于提供国家背景信息，需要国家代码）
+        if self.country_code:
+            sources.append(("world_bank", lambda: "\n".join(
+                self._shared(("world_bank", self.country_code, indicator),
+                             lambda: world_bank_indicator(self.country_code, indicator))
+                for indicator in self.WORLD_BANK_INDICATORS)))
+        return sources
+
+    def _shared(self, key: tuple, fetch):
+        """模型预取的共享背景数据（按国家/城市去重，见 ESGModel.prefetch_context）存在时直接使用，否则单独请求。"""
+        text = self.model.context.get(key)
+        return text if text is not None else fetch()
+
+    def fetch_sources(self) -> dict:
+        """
+        并发调用各数据源，返回 {数据源名称: 文本}。
+        每个数据源受 SOURCE_TIMEOUTS 限制，整体受 FIRM_DEADLINE 限制，超时的数据源直接丢弃。
+        """
+        sources = self._disclosure_sources()
+        start = time.monotonic()
+        firm_deadline = start + self.FIRM_DEADLINE
+        # 不使用 with 语句：超时的线程不需要等待，直接在后台结束
+        executor = ThreadPoolExecutor(max_workers=len(sources), thread_name_prefix=f"firm-{self.unique_id}")
+        futures = [(name, executor.submit(fn)) for name, fn in sources]
+        executor.shutdown(wait=False)
+
+        results = {}
+        for name, future in futures:
+            source_deadline = start + self.SOURCE_TIMEOUTS.get(name, self.DEFAULT_SOURCE_TIMEOUT)
+            remaining = min(source_deadline, firm_deadline) - time.monotonic()
+            try:
+                line = future.result(timeout=max(0.0, remaining))
+            except FutureTimeout:
+                future.cancel()
+                print(f"[警告] 数据源超时已丢弃（{self.firm_name}）：{name}")
+                metrics.inc("esg_source_timeouts_total", source=name)
+                continue
+            except Exception as e:
+                print(f"[警告] 数据源异常（{self.firm_name}）：{name}：{e}")
+                metrics.inc("esg_source_failures_total", source=name)
+                continue
+            if line:
+                results[name] = line
+        return results
+
     def generate_disclosure(self) -> str:
         """
         生成完整的企业披露文本，包括基本披露和来自各数据源的补充信息。
@@ -73,42 +225,39 @@ class FirmAgent:
 
         # 基础披露内容
         base_text = self.fetch_base_disclosure()
-        extra_info = []
-
-        # 获取财经数据（Yahoo优先，失败则尝试Alpha Vantage）
-        stock_line = yahoo_finance(self.ticker)
-        if not stock_line:  # 若Yahoo未获得数据，则用Alpha Vantage
-            stock_line = alpha_vantage_price(self.ticker)
-        if stock_line:
-            extra_info.append(stock_line)
-
-        # 空气质量数据（需要城市名）
-        if self.city:
-            aq_line = openaq_pm25(self.city)
-            if aq_line:
-                extra_info.append(aq_line)
+        # 各数据源并发获取，按数据源声明顺序拼接
+        sources = self.fetch_sources()
+        return self.restore_disclosure({"base": base_text, **sources})
 
-        # 维基百科公司简介
-        wiki_line = wiki_summary(self.firm_name)
-        if wiki_line:
-            extra_info.append(wiki_line)
+    def restore_disclosure(self, sections: dict, disclosure: str = None) -> str:
+        """
+        由各部分文本（base 在前，其余按数据源顺序）组合披露并缓存，也用于恢复其他进程生成的披露。
+        sections 保留原始文本（用于指纹）；提交评分的披露去掉占位句与重复内容，并截断到提示词预算以内。
+        disclosure 为已精简的披露文本（如工作进程返回的结果）时直接使用，不再重复精简。
+        """
+        self.sections = dict(sections)
+        if disclosure is None:
+            disclosure, _ = compact_disclosure(self.sections)
+        self._cached_disclosure = disclosure
+        return self._cached_disclosure
 
-        # 美国SEC年报数据（需要CIK）
-        if self.cik:
-            sec_line = sec_edgar_10k(self.cik)
-            if sec_line:
-                extra_info.append(sec_line)
+    def screening_text(self, disclosure: str = "") -> str:
+        """
+        关键词筛选使用的原始披露全文：各部分未经精简与截断，避免低优先级部分被截掉后漏掉负面筛选词；
+        没有各部分文本时（如直接提交的披露）使用 disclosure。
+        """
+        if not self.sections:
+            return disclosure
+        return "\n".join(text for text in self.sections.values() if text)
 
-        # 世界银行指标（例如人均GDP，用于提供国家背景信息，需要国家代码）
-        if self.country_code:
-            wb_line = world_bank_indicator(self.country_code, "NY.GDP.PCAP.CD")
-            if wb_line:
-                extra_info.append(wb_line)
+    def invalidate_disclosure(self):
+        """清除披露缓存，下次生成时重新抓取各数据源（用于每日刷新）。"""
+        self._cached_disclosure = None
 
-        # 将所有部分组合成完整披露文本
-        full_disclosure = base_text + ("\n" + "\n".join(extra_info) if extra_info else "")
-        self._cached_disclosure = full_disclosure
-        return full_disclosure
+    def disclosure_fingerprint(self) -> dict:
+        """返回各披露部分的哈希 {部分名称: sha256}。"""
+        return {name: hashlib.sha256(text.encode("utf-8")).hexdigest()
+                for name, text in (self.sections or {}).items()}
 
     def step(self):
         """
@@ -118,51 +267,53 @@ class FirmAgent:
         # 提交披露内容给模型（模型会转发给各ESG评分Agent）
         self.model.submit_disclosure(self, disclosure)
 
+# 默认的筛选关键词：exclusion 用于负面筛选，impact 用于影响力投资
+DEFAULT_SCREENING_POLICIES = {
+    "exclusion": ["环境污染", "强迫劳动", "贿赂", "高碳排放", "道德风险"],
+    "impact": ["可再生能源", "碳中和", "乡村振兴", "教育普惠", "可持续发展"],
+}
+
 class InvestorAgent:
     """
     投资者 Agent：根据 ESG 分析结果，结合四种策略（负面筛选、正面筛选、ESG整合、影响力投资）判断是否投资。
+    各策略的判定在模型的列式评分表中一次性完成，所有投资者共享。
     """
+    __slots__ = ("unique_id", "model")
 
     def __init__(self, unique_id, model):
         self.unique_id = unique_id
         self.model = model
 
     def step(self):
-        firm_scores = self.model.get_firm_scores()
-        for firm, score_data in firm_scores.items():
-            esg_score = score_data["esg_score"]
-            rating = score_data["esg_rating"]
-            disclosure = self.model.current_disclosures.get(firm, "")
-
-            # 策略 1：负面筛选（Negative Screening）
-            exclusion_keywords = ["环境污染", "强迫劳动", "贿赂", "高碳排放", "道德风险"]
-            if any(keyword in disclosure for keyword in exclusion_keywords):
-                print(f"[拒绝投资] {firm.firm_name or firm.ticker}：触发负面筛选。")
-                continue
-
-            # 策略 2：正面筛选（Positive Screening）
-            if esg_score > 75:
-                firm.investment_received += 100.0
-                print(f"[优先投资] {firm.firm_name or firm.ticker}：高ESG得分（{esg_score:.2f}），正面筛选通过。")
-                continue
+        table = self.model.get_score_table()
+        firms = table.firms
+        # 对全部企业的累计投资做一次向量化加法（原地写入评分存储）
+        np.add(table.store.received, table.investment, out=table.store.received)
+        if not self.model.verbose:
+            return
+        for i in np.flatnonzero(table.strategy):
+            self.report(firms[i], table.strategy[i], table.composite[i], table.integrated[i],
+                        table.screening_hits.get(i, {}))
 
-            # 策略 3：ESG整合（ESG Integration）
-            weight_env = 0.4
-            weight_soc = 0.3
-            weight_gov = 0.3
-            integrated_score = (
-                score_data.get("environment", 50.0) * weight_env +
-                score_data.get("social", 50.0) * weight_soc +
-                score_data.get("governance", 50.0) * weight_gov
-            )
-
-            if integrated_score >= 65:
-                firm.investment_received += 50.0
-                print(f"[整合投资] {firm.firm_name or firm.ticker}：ESG综合得分良好（{integrated_score:.2f}）。")
-                continue
+    def invest(self, firm, strategy: int, hits: dict):
+        """流水线模式：对单个刚完成评分的企业执行投资决策（判定结果已由 score_table.decide_row 写入评分存储）。"""
+        store = self.model.score_store
+        store.received[firm._row] += store.investment[firm._row]
+        if self.model.verbose and strategy:
+            self.report(firm, strategy, store.composite[firm._row], store.integrated[firm._row], hits)
 
-            # 策略 4：影响力投资（Impact Investing）
-            impact_keywords = ["可再生能源", "碳中和", "乡村振兴", "教育普惠", "可持续发展"]
-            if any(keyword in disclosure for keyword in impact_keywords):
-                firm.investment_received += 30.0
-                print(f"[影响力投资] {firm.firm_name or firm.ticker}：业务涉及正面影响议题。")
\ No newline at end of file
+    def report(self, firm, strategy: int, composite: float, integrated: float, hits: dict):
+        # 策略 1：负面筛选（Negative Screening）
+        if strategy == EXCLUDED:
+            terms = "、".join(hits["exclusion"])
+            print(f"[拒绝投资] {firm.firm_name or firm.ticker}：触发负面筛选（{terms}）。")
+        # 策略 2：正面筛选（Positive Screening）
+        elif strategy == POSITIVE:
+            print(f"[优先投资] {firm.firm_name or firm.ticker}：高ESG得分（{composite:.2f}），正面筛选通过。")
+        # 策略 3：ESG整合（ESG Integration）
+        elif strategy == INTEGRATED:
+            print(f"[整合投资] {firm.firm_name or firm.ticker}：ESG综合得分良好（{integrated:.2f}）。")
+        # 策略 4：影响力投资（Impact Investing）
+        elif strategy == IMPACT:
+            terms = "、".join(hits["impact"])
+            print(f"[影响力投资] {firm.firm_name or firm.ticker}：业务涉及正面影响议题（{terms}）。")
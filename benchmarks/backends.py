@@ -0,0 +1,72 @@
+"""
+基准测试用的合成数据源：在回放模式下为缺失夹具的请求生成确定性的模拟响应，
+覆盖 Yahoo、Alpha Vantage、HTTP 接口（世界银行/OpenAQ/SEC/维基百科）与 DeepSeek。
+其他后端模块只需提供同样签名的 install(replay, seed) 即可通过 --backend 替换。
+"""
+import json
+import hashlib
+from urllib.parse import parse_qs, urlsplit
+
+# 部分企业的百科摘要带上筛选关键词，使负面筛选与影响力投资路径也被覆盖
+_TOPICS = ["可再生能源", "碳中和", "环境污染", "贿赂", "教育普惠", "", "", "", "", ""]
+
+
+def _unit(seed: int, *parts) -> float:
+    """由种子与若干部分确定的 [0, 1) 伪随机数。"""
+    digest = hashlib.sha256(json.dumps([seed, *parts], ensure_ascii=False, default=str).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2 ** 64
+
+
+def install(replay, seed: int = 0):
+    def yahoo(ticker):
+        u = _unit(seed, "yahoo", ticker)
+        return {"longName": f"{ticker} Inc", "regularMarketPrice": round(10 + 490 * u, 2),
+                "trailingPE": round(5 + 40 * u, 2), "city": None, "country": None}
+
+    def alpha_vantage(ticker):
+        return [{"2025-01-02": {"4. close": f"{10 + 490 * _unit(seed, 'alpha', ticker):.2f}"}}, {}]
+
+    def wiki_extract(term):
+        topic = _TOPICS[int(_unit(seed, "wiki", term) * len(_TOPICS))]
+        return f"{term} 是一家从事制造与服务业务的公司。" + (f"公司近年涉及{topic}相关议题。" if topic else "")
+
+    def wikipedia(url):
+        # MediaWiki API：每个标题都视为存在的词条，搜索返回原词
+        query = {k: v[0] for k, v in parse_qs(urlsplit(url).query).items()}
+        if query.get("list") == "search":
+            return {"status": 200, "json": {"query": {"search": [{"title": query["srsearch"]}]}}}
+        pages = [{"title": title, "extract": wiki_extract(title)} for title in query["titles"].split("|")]
+        return {"status": 200, "json": {"query": {"pages": pages}}}
+
+    def http(url):
+        host = urlsplit(url).hostname
+        if host == "api.worldbank.org":
+            # 支持批量请求：country/A;B/indicator/X;Y，数值只由国家、指标与年份决定
+            path = urlsplit(url).path
+            countries = path.split("/country/")[1].split("/")[0].split(";")
+            indicators = path.split("/indicator/")[1].split("/")[0].split(";")
+            return {"status": 200, "json": [{"page": 1}, [
+                {"date": str(2023 - i), "value": round(5000 + 20000 * _unit(seed, "worldbank", c, ind, i), 1),
+                 "country": {"id": c.upper()}, "countryiso3code": "", "indicator": {"id": ind}}
+                for c in countries for ind in indicators for i in range(5)]]}
+        if host.endswith(".wikipedia.org"):
+            return wikipedia(url)
+        if host == "api.openaq.org":
+            return {"status": 200, "json": {"results": [{"measurements": [{"value": round(80 * _unit(seed, url), 1)}]}]}}
+        return {"status": 404, "json": {}}
+
+    def llm(key):
+        _, _, prompt = key
+        tokens = len(prompt) // 2
+        if "JSON" in prompt:
+            scores = {d: round(30 + 65 * _unit(seed, prompt, d), 2) for d in ("environment", "society", "governance")}
+            return {"content": json.dumps(scores), "prompt_tokens": tokens, "completion_tokens": 30}
+        if "投资顾问" in prompt:
+            return {"content": "【ESG评价】：整体表现平稳。\n【投资建议】：可适度配置。",
+                    "prompt_tokens": tokens, "completion_tokens": 40}
+        return {"content": f"{30 + 65 * _unit(seed, prompt):.2f}", "prompt_tokens": tokens, "completion_tokens": 5}
+
+    replay.register_synthesizer("yahoo", yahoo)
+    replay.register_synthesizer("alpha_vantage", alpha_vantage)
+    replay.register_synthesizer("http", http)
+    replay.register_synthesizer("llm", llm)
@@ -0,0 +1,66 @@
+"""
+内存基准：构造 N 家虚拟企业的 ESGModel，提交合成披露、写入三个维度评分并执行投资者阶段，
+用 tracemalloc 统计模型常驻状态（企业/投资者Agent、评分存储、评分表）的每企业内存，
+并单独统计 get_firm_scores 结果字典的每企业内存。不访问网络，也不调用评分接口。
+
+用法：
+    python benchmarks/memory.py --firms 100000 --investors 10
+"""
+import os
+import sys
+import json
+import argparse
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(firms: int, investors: int) -> dict:
+    sys.path.insert(0, ROOT)
+    from model import ESGModel
+
+    # 披露文本本身与企业数线性相关且无法压缩，预先生成以便只统计模型自身的开销
+    disclosures = [f"Firm-{i} 的最新ESG披露概况:环境管理、社会责任与公司治理情况摘要。" for i in range(firms)]
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    model = ESGModel(N_firms=firms, N_investors=investors, verbose=False)
+    agents = tracemalloc.get_traced_memory()[0]
+    for firm, text in zip(model.firms, disclosures):
+        model.submit_disclosure(firm, text)
+    for i, firm in enumerate(model.firms):
+        for j, key in enumerate(("env", "soc", "gov")):
+            model.assign_score(firm.unique_id, key, float((i * 7 + j * 13) % 100))
+    for investor in model.investors:
+        investor.step()
+    state = tracemalloc.get_traced_memory()[0]
+    scores = model.get_firm_scores()
+    records = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del scores
+    return {
+        "firms": firms,
+        "investors": investors,
+        "agents_bytes_per_firm": (agents - base) / firms,
+        "state_bytes_per_firm": (state - base) / firms,
+        "get_firm_scores_bytes_per_firm": (records - state) / firms,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ESGModel 每企业内存基准")
+    parser.add_argument("--firms", type=int, default=100000)
+    parser.add_argument("--investors", type=int, default=10)
+    parser.add_argument("--json", action="store_true", help="以JSON输出结果")
+    args = parser.parse_args()
+    result = measure(args.firms, args.investors)
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        print(f"{result['firms']} 家企业，{result['investors']} 个投资者")
+        print(f"Agent 构造          {result['agents_bytes_per_firm']:8.1f} 字节/企业")
+        print(f"模型常驻状态（合计）{result['state_bytes_per_firm']:8.1f} 字节/企业")
+        print(f"get_firm_scores     {result['get_firm_scores_bytes_per_firm']:8.1f} 字节/企业")
+
+
+if __name__ == "__main__":
+    main()
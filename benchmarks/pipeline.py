@@ -0,0 +1,220 @@
+"""
+端到端基准：用合成企业（ESGModel 的 N_firms 虚拟企业路径）与合成数据源驱动 ESGModel.step，
+分别统计披露收集、各维度评分、评分表构建、get_firm_scores 与投资者决策的耗时，
+以及吞吐量、单企业评分延迟的 p50/p95/p99 和峰值内存（RSS），结果保存为JSON以便跨提交比较。
+
+全程使用回放模式（replay.py），不访问网络；每个规模组合在独立子进程中运行，以便单独测量峰值内存。
+
+用法：
+    python benchmarks/pipeline.py --firms 10,100,1000 --investors 1,100 --output bench.json
+    python benchmarks/pipeline.py --compare bench.json              # 与之前的结果比较
+    python benchmarks/pipeline.py --latency llm=0.5,http=0.05 --rate-limit 0.05
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_FIRMS = "10,100,1000,10000"
+DEFAULT_INVESTORS = "1,10,100,500"
+
+
+def percentiles(values) -> dict:
+    """最近秩法计算 p50/p95/p99（毫秒）。"""
+    if not values:
+        return {"p50": None, "p95": None, "p99": None}
+    ordered = sorted(values)
+    pick = lambda q: ordered[min(len(ordered) - 1, max(0, int(round(q * len(ordered) + 0.5)) - 1))] * 1000
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99)}
+
+
+def peak_rss_mb() -> float:
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以KB为单位，macOS 以字节为单位
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def run_worker(args) -> dict:
+    """在当前进程中运行一个规模组合（由主进程以 --worker 启动）。"""
+    # 缓存目录与回放模式需在导入项目模块之前设置
+    workdir = tempfile.mkdtemp(prefix="esg_bench_")
+    os.environ["ESG_CACHE_DIR"] = workdir
+    os.environ["ESG_REPLAY_MODE"] = "replay"
+    os.environ["ESG_FIXTURE_PATH"] = args.fixtures or os.path.join(workdir, "fixtures.sqlite3")
+    # 故障注入参数与合成数据源经环境变量传递，分片模式的工作进程（spawn）同样生效
+    os.environ["ESG_REPLAY_LATENCY"] = args.latency
+    os.environ["ESG_REPLAY_ERROR_RATE"] = str(args.error_rate)
+    os.environ["ESG_REPLAY_RATE_LIMIT"] = str(args.rate_limit)
+    os.environ["ESG_REPLAY_SEED"] = str(args.seed)
+    os.environ["ESG_REPLAY_SYNTHESIZERS"] = args.backend
+    if not args.llm_cache:
+        os.environ["ESG_LLM_CACHE"] = "0"
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, HERE)
+    import metrics
+    import replay
+    from http_client import cache_stats
+    from deepseek_api import get_llm_cache_stats
+    from disclosure import get_compaction_stats
+    from model import ESGModel
+
+    step_start = [0.0]
+    firm_latencies = []
+    model = ESGModel(N_firms=args.firms, N_investors=args.investors, scoring_mode=args.scoring_mode,
+                     max_in_flight=args.max_in_flight, verbose=False, processes=args.processes,
+                     pipelined=args.pipelined,
+                     on_firm_scored=lambda firm, record: firm_latencies.append(time.perf_counter() - step_start[0]))
+
+    steps = []
+    for i in range(args.steps):
+        firm_latencies.clear()
+        step_start[0] = time.perf_counter()
+        # 流水线模式下每轮刷新时，本轮披露收集完成后即预取下一轮的数据源
+        model.step(refresh=args.refresh, prefetch_next=args.pipelined and args.refresh and i + 1 < args.steps)
+        start = time.perf_counter()
+        model.get_firm_scores()
+        get_scores = time.perf_counter() - start
+        timings = dict(model.step_timings, get_firm_scores=get_scores)
+        steps.append({
+            "step": i,
+            "timings_ms": {phase: value * 1000 for phase, value in timings.items()},
+            "throughput_firms_per_s": args.firms / timings["total"] if timings["total"] else None,
+            "investor_decisions_per_s": (args.firms * args.investors / timings["investors"]
+                                         if timings.get("investors") else None),
+            "firm_latency_ms": percentiles(firm_latencies),
+            "api": {k: v for k, v in model.scoring_stats.items() if k != "mode"},
+        })
+    model.close()
+    result = {
+        "firms": args.firms,
+        "investors": args.investors,
+        "steps": steps,
+        "peak_rss_mb": peak_rss_mb(),
+        "http_cache": cache_stats(),
+        "llm_cache": get_llm_cache_stats(),
+        "disclosure": get_compaction_stats(),
+        "replay": replay.replay_stats(),
+        "metrics": metrics.snapshot(),
+    }
+    shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+
+def _worker_command(args, firms: int, investors: int) -> list:
+    command = [sys.executable, os.path.abspath(__file__), "--worker", "--firms", str(firms),
+               "--investors", str(investors), "--steps", str(args.steps), "--seed", str(args.seed),
+               "--scoring-mode", args.scoring_mode, "--max-in-flight", str(args.max_in_flight),
+               "--processes", str(args.processes),
+               "--latency", args.latency, "--error-rate", str(args.error_rate),
+               "--rate-limit", str(args.rate_limit), "--backend", args.backend]
+    if args.fixtures:
+        command += ["--fixtures", os.path.abspath(args.fixtures)]
+    if args.llm_cache:
+        command.append("--llm-cache")
+    if args.refresh:
+        command.append("--refresh")
+    if args.pipelined:
+        command.append("--pipelined")
+    return command
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _summary_line(result: dict) -> str:
+    # 第一轮为冷启动（披露尚未缓存），最能反映整条流水线
+    last = result["steps"][0]
+    # 分片模式下披露与评分在工作进程中完成，取各进程的累计耗时（worker_ 前缀）
+    t = {k[len("worker_"):]: v for k, v in last["timings_ms"].items() if k.startswith("worker_")}
+    t.update(last["timings_ms"])
+    scoring = sum(v for k, v in t.items() if k.startswith("score_") and k != "score_table")
+    return (f"{result['firms']:>6} 企业 {result['investors']:>4} 投资者 | 总计 {t['total']:9.1f} ms | "
+            f"披露 {t.get('disclosures', 0):8.1f} | 评分 {scoring:8.1f} | 评分表 {t.get('score_table', 0):6.1f} | "
+            f"get_firm_scores {t['get_firm_scores']:6.1f} | 投资者 {t.get('investors', 0):7.1f} | "
+            f"{last['throughput_firms_per_s'] or 0:8.1f} 企业/秒 | p99 {last['firm_latency_ms']['p99'] or 0:8.1f} ms | "
+            f"RSS {result['peak_rss_mb']:6.1f} MB")
+
+
+def compare(current: dict, baseline: dict):
+    """按规模组合比较第一轮的总耗时与峰值内存。"""
+    old = {(r["firms"], r["investors"]): r for r in baseline["results"]}
+    for result in current["results"]:
+        base = old.get((result["firms"], result["investors"]))
+        if base is None:
+            continue
+        new_total = result["steps"][0]["timings_ms"]["total"]
+        old_total = base["steps"][0]["timings_ms"]["total"]
+        print(f"{result['firms']:>6} 企业 {result['investors']:>4} 投资者 | 总计 {old_total:9.1f} → {new_total:9.1f} ms "
+              f"({new_total / old_total:5.2f}x) | RSS {base['peak_rss_mb']:6.1f} → {result['peak_rss_mb']:6.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ESGModel.step 端到端基准")
+    parser.add_argument("--firms", default=DEFAULT_FIRMS, help="企业数（逗号分隔的多个规模）")
+    parser.add_argument("--investors", default=DEFAULT_INVESTORS, help="投资者数（逗号分隔的多个规模）")
+    parser.add_argument("--steps", type=int, default=2, help="每个组合运行的迭代次数（第二轮起体现缓存效果）")
+    parser.add_argument("--refresh", action="store_true", help="每轮迭代都重新抓取数据源")
+    parser.add_argument("--scoring-mode", default="separate", choices=("separate", "batch"))
+    parser.add_argument("--max-in-flight", type=int, default=8, help="评分请求的最大并发数")
+    parser.add_argument("--pipelined", action="store_true", help="流水线调度（见 scheduler.py）")
+    parser.add_argument("--processes", type=int, default=1, help="分片模式的进程数（1为单进程；峰值内存只统计主进程）")
+    parser.add_argument("--latency", default="", help="模拟延迟，如 0.01 或 llm=0.5,http=0.05（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="注入接口错误的概率")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="注入429限流的概率")
+    parser.add_argument("--seed", type=int, default=0, help="合成数据与故障注入的随机种子")
+    parser.add_argument("--backend", default="backends", help="提供 install(replay, seed) 的合成数据源模块")
+    parser.add_argument("--fixtures", help="录制的夹具库（缺失部分由合成数据源补齐）")
+    parser.add_argument("--llm-cache", action="store_true", help="启用LLM结果缓存（每个组合使用全新的临时目录）")
+    parser.add_argument("--output", help="结果JSON文件")
+    parser.add_argument("--compare", help="与之前保存的结果JSON比较")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        args.firms, args.investors = int(args.firms), int(args.investors)
+        print(json.dumps(run_worker(args), ensure_ascii=False))
+        return
+
+    results = []
+    for firms in (int(n) for n in args.firms.split(",")):
+        for investors in (int(n) for n in args.investors.split(",")):
+            proc = subprocess.run(_worker_command(args, firms, investors), capture_output=True, text=True)
+            if proc.returncode != 0:
+                print(f"[错误] {firms} 企业 {investors} 投资者运行失败：\n{proc.stderr}")
+                sys.exit(1)
+            result = json.loads(proc.stdout.strip().splitlines()[-1])
+            results.append(result)
+            print(_summary_line(result))
+
+    report = {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {k: v for k, v in vars(args).items() if k not in ("worker", "output", "compare")},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入：{args.output}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
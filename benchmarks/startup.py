@@ -0,0 +1,131 @@
+"""
+启动耗时基准：测量 main.py 冷启动（--help）、python -X importtime 统计的导入耗时，
+以及 model.ESGModel 的导入与构造耗时，并检查命令行入口没有提前导入重量级数据源后端。
+
+用法：
+    python benchmarks/startup.py                       # 与默认阈值比较
+    python benchmarks/startup.py --save-baseline b.json
+    python benchmarks/startup.py --baseline b.json --tolerance 1.5
+
+任何指标超出阈值（或基线 × tolerance）、或入口导入了禁止的模块时以非零状态退出。
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 默认阈值（秒），未提供基线时使用
+DEFAULT_LIMITS = {
+    "cli_help": 1.0,
+    "import_main": 0.4,
+    "import_model": 0.8,
+    "construct_model": 0.5,
+}
+# main.py 在解析命令行参数之前不应导入的模块（首次使用时才加载）
+LAZY_MODULES = ("openai", "yfinance", "alpha_vantage", "numpy", "requests")
+
+_CONSTRUCT = """
+import time
+start = time.perf_counter()
+import model
+imported = time.perf_counter()
+model.ESGModel(firms_data=[{{"id": i, "name": f"Firm {{i}}", "ticker": f"F{{i}}"}} for i in range({firms})],
+               N_investors={investors}, verbose=False)
+done = time.perf_counter()
+print(imported - start, done - imported)
+"""
+
+
+def _run(args, env=None) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable] + args, cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+
+
+def _timed(args) -> float:
+    start = time.perf_counter()
+    _run(args)
+    return time.perf_counter() - start
+
+
+def import_profile(module: str):
+    """用 -X importtime 导入模块，返回 (累计耗时秒, 导入过的模块名集合)。"""
+    proc = _run(["-X", "importtime", "-c", f"import {module}"])
+    total, modules = 0.0, set()
+    for line in proc.stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \|( *)(\S+)", line)
+        if not match:
+            continue
+        modules.add(match.group(3).split(".")[0])
+        if match.group(3) == module and len(match.group(2)) == 1:
+            total = int(match.group(1)) / 1e6
+    return total, modules
+
+
+def measure(repeat: int = 5, firms: int = 1000, investors: int = 10) -> dict:
+    """每项指标重复 repeat 次取中位数，减少冷启动抖动。"""
+    results = {"cli_help": [], "import_main": [], "import_model": [], "construct_model": []}
+    leaked = set()
+    for _ in range(repeat):
+        results["cli_help"].append(_timed([os.path.join(ROOT, "main.py"), "--help"]))
+        total, modules = import_profile("main")
+        results["import_main"].append(total)
+        leaked |= modules.intersection(LAZY_MODULES)
+        out = _run(["-c", _CONSTRUCT.format(firms=firms, investors=investors)]).stdout.split()
+        results["import_model"].append(float(out[0]))
+        results["construct_model"].append(float(out[1]))
+    metrics = {name: statistics.median(values) for name, values in results.items()}
+    return {"metrics": metrics, "eager_imports": sorted(leaked),
+            "params": {"repeat": repeat, "firms": firms, "investors": investors}}
+
+
+def check(report: dict, limits: dict) -> list:
+    """返回超出阈值的指标与提前导入的模块说明列表，为空表示通过。"""
+    failures = [f"{name}: {value:.3f}s > {limits[name]:.3f}s"
+                for name, value in report["metrics"].items() if name in limits and value > limits[name]]
+    if report["eager_imports"]:
+        failures.append("main 导入时加载了：" + ", ".join(report["eager_imports"]))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="启动耗时基准")
+    parser.add_argument("--repeat", type=int, default=5, help="每项指标的重复次数（取中位数）")
+    parser.add_argument("--firms", type=int, default=1000, help="构造 ESGModel 时的企业数")
+    parser.add_argument("--investors", type=int, default=10, help="构造 ESGModel 时的投资者数")
+    parser.add_argument("--baseline", help="基线JSON文件，阈值为基线值 × tolerance")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="相对基线允许的倍数")
+    parser.add_argument("--save-baseline", help="把本次结果写入基线JSON文件")
+    parser.add_argument("--json", action="store_true", help="以JSON输出结果")
+    args = parser.parse_args()
+
+    report = measure(args.repeat, args.firms, args.investors)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["metrics"]
+        limits = {name: value * args.tolerance for name, value in baseline.items()}
+    else:
+        limits = DEFAULT_LIMITS
+    report["limits"] = limits
+    failures = check(report, limits)
+    report["failures"] = failures
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        for name, value in report["metrics"].items():
+            print(f"{name:<16} {value * 1000:8.1f} ms  (上限 {limits.get(name, float('nan')) * 1000:.1f} ms)")
+        for failure in failures:
+            print(f"[回归] {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
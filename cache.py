@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+# 缓存文件默认存放目录，可通过环境变量 ESG_CACHE_DIR 修改
+CACHE_DIR = os.getenv("ESG_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".esg_cache"))
+
+
+def make_key(*parts) -> str:
+    """将若干组成部分序列化后取SHA-256，作为内容寻址的缓存键。"""
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class DiskCache:
+    """
+    基于SQLite的持久化键值缓存：支持TTL过期与按条目数的LRU淘汰。
+    使用WAL模式与忙等待超时，可被多个线程、多个进程同时读写；值以JSON存储。
+    """
+    # 每写入多少次检查一次容量，避免每次写入都统计条目数
+    EVICT_EVERY = 64
+
+    def __init__(self, path: str, ttl: float = None, max_entries: int = 10000):
+        self.path = path
+        self.ttl = ttl                  # 过期时间（秒），None表示不过期
+        self.max_entries = max_entries  # 最多保留的条目数，超出按最近访问时间淘汰
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_accessed ON entries(accessed)")
+
+    def _conn(self) -> sqlite3.Connection:
+        """每个线程、每个进程各自持有一个连接（SQLite连接不能跨线程或fork共享）。"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _count(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def get(self, key: str, default=None):
+        """读取缓存，命中时刷新访问时间；过期或不存在返回default。"""
+        now = time.time()
+        try:
+            conn = self._conn()
+            row = conn.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None or (self.ttl is not None and now - row[1] > self.ttl):
+                if row is not None:
+                    conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._count("misses")
+                return default
+            conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+            value = json.loads(row[0])
+        except (sqlite3.Error, ValueError) as e:
+            print(f"[警告] 读取缓存失败（{self.path}）：{e}")
+            self._count("misses")
+            return default
+        self._count("hits")
+        return value
+
+    def set(self, key: str, value):
+        """写入缓存（覆盖同键旧值），并按需执行LRU淘汰。"""
+        now = time.time()
+        try:
+            conn = self._conn()
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now, now),
+            )
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            print(f"[警告] 写入缓存失败（{self.path}）：{e}")
+            return
+        with self._lock:
+            self._writes += 1
+            should_evict = self._writes % self.EVICT_EVERY == 1
+        if should_evict:
+            self.evict()
+
+    def evict(self):
+        """删除过期条目，并只保留最近访问的 max_entries 条。"""
+        try:
+            conn = self._conn()
+            with conn:
+                removed = 0
+                if self.ttl is not None:
+                    removed += conn.execute("DELETE FROM entries WHERE created < ?", (time.time() - self.ttl,)).rowcount
+                if self.max_entries is not None:
+                    removed += conn.execute(
+                        "DELETE FROM entries WHERE key IN "
+                        "(SELECT key FROM entries ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                        (self.max_entries,),
+                    ).rowcount
+        except sqlite3.Error as e:
+            print(f"[警告] 缓存淘汰失败（{self.path}）：{e}")
+            return
+        with self._lock:
+            self.evictions += removed
+
+    def clear(self):
+        """清空全部缓存条目。"""
+        with self._conn() as conn:
+            conn.execute("DELETE FROM entries")
+
+    def stats(self) -> dict:
+        """返回本进程内的命中/未命中/淘汰计数。"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
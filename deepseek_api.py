@@ -1,13 +1,138 @@
-from openai import OpenAI
 import os
-from dotenv import load_dotenv
+import json
+import time
+import threading
 import re
+from cache import CACHE_DIR, DiskCache, make_key
+from utils import estimate_tokens
+import metrics
+import replay
+from scoring import throttle
+from dotenv import load_dotenv
+# .env 中还可能配置下方在导入时读取的缓存参数，因此仍在导入时加载（开销很小）
 load_dotenv()
-client = OpenAI(
-    api_key=os.getenv("DEEPSEEK_API_KEY"),
-    base_url="https://api.deepseek.com"
-)
-def query_esg_score(text: str, dimension: str = "environment") -> float:
+# DeepSeek客户端（openai SDK导入较慢）在首次调用接口时才创建，见 get_client
+_client = None
+_client_lock = threading.Lock()
+MODEL_NAME = "deepseek-chat"
+# 提示词模板版本：修改任何提示词模板时需递增，使旧缓存自动失效
+PROMPT_VERSION = 1
+
+# LLM结果持久化缓存（默认保留7天、最多5万条），ESG_LLM_CACHE=0 可关闭
+LLM_CACHE_ENABLED = os.getenv("ESG_LLM_CACHE", "1") != "0"
+LLM_CACHE_TTL = float(os.getenv("ESG_LLM_CACHE_TTL", 7 * 24 * 3600))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("ESG_LLM_CACHE_MAX_ENTRIES", 50000))
+_llm_cache = None
+_llm_cache_lock = threading.Lock()
+
+# 评分提示词模板与回复本身约占用的token数，用于TPM限流估算
+PROMPT_OVERHEAD_TOKENS = 300
+
+# 接口调用统计（调用次数与token用量），用于比较不同评分模式的成本
+_stats_lock = threading.Lock()
+_api_stats = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+
+def get_api_stats() -> dict:
+    """返回当前累计的接口调用统计副本。"""
+    with _stats_lock:
+        return dict(_api_stats)
+
+def reset_api_stats():
+    """清零接口调用统计。"""
+    with _stats_lock:
+        for key in _api_stats:
+            _api_stats[key] = 0
+
+def get_client():
+    """首次使用时创建 DeepSeek 客户端，之后复用同一实例。"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            from openai import OpenAI
+            _client = OpenAI(
+                api_key=os.getenv("DEEPSEEK_API_KEY"),
+                base_url="https://api.deepseek.com"
+            )
+        return _client
+
+def estimate_request_tokens(text: str) -> int:
+    """估算一次评分请求（模板+披露文本+回复）消耗的token数。"""
+    return estimate_tokens(text) + PROMPT_OVERHEAD_TOKENS
+
+def get_llm_cache():
+    """首次使用时创建LLM结果缓存；缓存关闭时返回None。"""
+    global _llm_cache
+    if not LLM_CACHE_ENABLED:
+        return None
+    with _llm_cache_lock:
+        if _llm_cache is None:
+            _llm_cache = DiskCache(os.path.join(CACHE_DIR, "llm.sqlite3"),
+                                   ttl=LLM_CACHE_TTL, max_entries=LLM_CACHE_MAX_ENTRIES)
+        return _llm_cache
+
+def get_llm_cache_stats() -> dict:
+    """返回LLM缓存的命中/未命中计数；缓存关闭时返回空字典。"""
+    cache = get_llm_cache()
+    return cache.stats() if cache is not None else {}
+
+def _cached_call(kind: str, key_part, text: str, compute):
+    """
+    以 (模板版本, 模型名, 类型/维度, 文本) 的哈希为键查询缓存，未命中时调用compute并写入。
+    compute 抛出的异常不会被缓存。
+    """
+    cache = get_llm_cache()
+    if cache is None:
+        return compute()
+    key = make_key(PROMPT_VERSION, MODEL_NAME, kind, key_part, text)
+    value = cache.get(key)
+    if value is not None:
+        metrics.inc("esg_llm_cache_total", kind=kind, result="hit")
+        return value
+    metrics.inc("esg_llm_cache_total", kind=kind, result="miss")
+    value = compute()
+    cache.set(key, value)
+    return value
+
+def _create_completion(system: str, prompt: str) -> dict:
+    response = get_client().chat.completions.create(
+        model=MODEL_NAME,
+        messages=[
+            {"role": "system", "content": system},
+            {"role": "user", "content": prompt}
+        ],
+        stream=False
+    )
+    usage = getattr(response, "usage", None)
+    return {
+        "content": response.choices[0].message.content,
+        "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+        "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+    }
+
+def _chat_completion(system: str, prompt: str, kind: str = "chat") -> str:
+    """调用DeepSeek对话接口（可录制/回放）并记录用量，返回回复文本。kind 为指标中的调用类型标签。"""
+    # 在评分调度器中执行时，实际请求前才扣除RPM/TPM配额（缓存命中不会走到这里）
+    throttle()
+    with metrics.span("esg_llm_seconds", kind=kind):
+        result = replay.intercept("llm", (MODEL_NAME, system, prompt), lambda: _create_completion(system, prompt))
+    with _stats_lock:
+        _api_stats["calls"] += 1
+    _record_usage(kind, result["prompt_tokens"], result["completion_tokens"])
+    return result["content"].strip()
+
+def _record_usage(kind: str, prompt_tokens: int, completion_tokens: int):
+    """记录一次调用的token用量（指标与 _api_stats）。"""
+    metrics.inc("esg_llm_tokens_total", prompt_tokens, kind=kind, type="prompt")
+    metrics.inc("esg_llm_tokens_total", completion_tokens, kind=kind, type="completion")
+    with _stats_lock:
+        _api_stats["prompt_tokens"] += prompt_tokens
+        _api_stats["completion_tokens"] += completion_tokens
+
+def request_esg_score(text: str, dimension: str = "environment") -> float:
+    """获取单个维度的评分（带缓存），接口或解析失败时抛出异常。"""
+    return _cached_call("score", dimension, text, lambda: _request_esg_score(text, dimension))
+
+def _request_esg_score(text: str, dimension: str) -> float:
     prompt = f"""
 你是一个中国上市公司ESG分析专家。现在请你根据企业的披露内容，从“{dimension}”维度进行评分，参考评分标准如下：
 
@@ -21,29 +146,78 @@ def query_esg_score(text: str, dimension: str = "environment") -> float:
 {text}
     """.strip()
 
+    content = _chat_completion("你是一位专业的ESG评分专家。", prompt, kind="score")
+    # 提取第一个合法的浮点数（整数或小数）
+    match = re.search(r"\d+(\.\d+)?", content)
+    if match:
+        score = float(match.group())
+        return max(0.0, min(100.0, score))
+    else:
+        raise ValueError(f"未找到浮点数：{content}")
+
+def query_esg_score(text: str, dimension: str = "environment") -> float:
     try:
-        response = client.chat.completions.create(
-            model="deepseek-chat",
-            messages=[
-                {"role": "system", "content": "你是一位专业的ESG评分专家。"},
-                {"role": "user", "content": prompt}
-            ],
-            stream=False
-        )
-        content = response.choices[0].message.content.strip()
-        # 提取第一个合法的浮点数（整数或小数）
-        match = re.search(r"\d+(\.\d+)?", content)
-        if match:
-            score = float(match.group())
-            return max(0.0, min(100.0, score))
-        else:
-            raise ValueError(f"未找到浮点数：{content}")
+        return request_esg_score(text, dimension)
     except Exception as e:
         print(f"[DeepSeek ESG评分接口出错]：{e}")
+        metrics.inc("esg_score_fallbacks_total", dimension=dimension)
         return 50.0
 
-def generate_esg_commentary(disclosure_text: str, scores: dict) -> str:
+def query_esg_scores_batch(text: str, dimensions=("environment", "society", "governance")) -> dict:
+    """
+    一次请求同时获取多个维度的评分，要求模型以JSON返回。
+    返回 {维度: 分数}；若回复无法解析或缺少维度则抛出 ValueError，由调用方回退到逐维度评分。
+    """
+    dimensions = tuple(dimensions)
+    return _cached_call("batch", dimensions, text, lambda: _request_esg_scores_batch(text, dimensions))
+
+def _request_esg_scores_batch(text: str, dimensions: tuple) -> dict:
+    keys = "、".join(f"“{d}”" for d in dimensions)
+    example = json.dumps({d: 0.0 for d in dimensions}, ensure_ascii=False)
     prompt = f"""
+你是一个中国上市公司ESG分析专家。现在请你根据企业的披露内容，分别从{keys}维度进行评分，参考评分标准如下：
+
+1. ESG评分从 0 到 100 分，100 分为该维度最佳实践水平。
+2. 请参考企业在该维度的“主动管理水平”与“风险暴露程度”：
+   - 主动管理指标包括：管理制度、披露透明度、目标设定、执行成效等。
+   - 风险暴露指标包括：已发生或潜在ESG风险事件的严重程度。
+3. 请只返回一个JSON对象，键为维度名称，值为该维度的最终评分（浮点数，保留两位小数），不要输出其他内容，例如：
+{example}
+
+企业披露内容如下：
+{text}
+    """.strip()
+
+    content = _chat_completion("你是一位专业的ESG评分专家。", prompt, kind="batch")
+    # 兼容模型用代码块包裹JSON的情况，只截取第一个花括号对象
+    match = re.search(r"\{.*\}", content, re.S)
+    if not match:
+        raise ValueError(f"未找到JSON对象：{content}")
+    try:
+        data = json.loads(match.group())
+    except json.JSONDecodeError as e:
+        raise ValueError(f"JSON解析失败：{e}：{content}")
+    scores = {}
+    for dimension in dimensions:
+        value = data.get(dimension) if isinstance(data, dict) else None
+        if isinstance(value, str):
+            value = value.strip()
+        try:
+            score = float(value)
+        except (TypeError, ValueError):
+            score = float("nan")
+        if score != score:  # NaN
+            raise ValueError(f"维度“{dimension}”缺少有效评分：{content}")
+        scores[dimension] = max(0.0, min(100.0, score))
+    return scores
+
+COMMENTARY_SYSTEM = "你是一个负责任的 ESG 投资顾问"
+COMMENTARY_FALLBACK = "【ESG评价】：暂无评估。\n【投资建议】：建议谨慎评估后再做决策。"
+# 录制/回放模式下流式评价每段的字符数
+REPLAY_CHUNK_CHARS = 16
+
+def _commentary_prompt(disclosure_text: str, scores: dict) -> str:
+    return f"""
 你是一位专业的 ESG 投资顾问，请根据以下企业的 ESG 披露内容，以及其评分结果，对该企业进行如下输出：
 
 1. ESG 总结性评价（200 字以内）：简要说明该企业在环境、社会、治理方面的亮点与问题；
@@ -65,16 +239,81 @@ ESG 评分如下：
 ---
     """.strip()
 
+def generate_esg_commentary(disclosure_text: str, scores: dict) -> str:
+    prompt = _commentary_prompt(disclosure_text, scores)
+    try:
+        # 评分会影响提示词，因此以完整提示词作为缓存内容
+        return _cached_call("commentary", None, prompt, lambda: _chat_completion(COMMENTARY_SYSTEM, prompt, kind="commentary"))
+    except Exception as e:
+        print(f"[ESG评估总结生成失败]：{e}")
+        metrics.inc("esg_commentary_fallbacks_total")
+        return COMMENTARY_FALLBACK
+
+def stream_esg_commentary(disclosure_text: str, scores: dict):
+    """
+    流式生成ESG评价与投资建议，逐段产出模型返回的文本片段。
+    缓存命中时一次性产出完整文本；完整生成后写入缓存，与 generate_esg_commentary 共用缓存。
+    """
+    prompt = _commentary_prompt(disclosure_text, scores)
+    cache = get_llm_cache()
+    key = make_key(PROMPT_VERSION, MODEL_NAME, "commentary", None, prompt)
+    cached = cache.get(key) if cache is not None else None
+    if cached is not None:
+        metrics.inc("esg_llm_cache_total", kind="commentary", result="hit")
+        yield cached
+        return
+
+    if replay.enabled():
+        # 录制/回放以完整回复为单位，与非流式接口共用夹具，再分段产出
+        text = generate_esg_commentary(disclosure_text, scores)
+        for i in range(0, len(text), REPLAY_CHUNK_CHARS):
+            yield text[i:i + REPLAY_CHUNK_CHARS]
+        return
+    if cache is not None:
+        metrics.inc("esg_llm_cache_total", kind="commentary", result="miss")
+
+    parts = []
+    start = time.perf_counter()
     try:
-        response = client.chat.completions.create(
-            model="deepseek-chat",
+        stream = get_client().chat.completions.create(
+            model=MODEL_NAME,
             messages=[
-                {"role": "system", "content": "你是一个负责任的 ESG 投资顾问"},
+                {"role": "system", "content": COMMENTARY_SYSTEM},
                 {"role": "user", "content": prompt}
             ],
-            stream=False
+            stream=True,
+            # 最后一个数据块（choices 为空）附带本次调用的token用量
+            stream_options={"include_usage": True}
         )
-        return response.choices[0].message.content.strip()
+        with _stats_lock:
+            _api_stats["calls"] += 1
+        for chunk in stream:
+            usage = getattr(chunk, "usage", None)
+            if usage is not None:
+                _record_usage("commentary", getattr(usage, "prompt_tokens", 0) or 0,
+                              getattr(usage, "completion_tokens", 0) or 0)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            if not parts:
+                # 与非流式接口一致，去掉开头的空白
+                delta = delta.lstrip()
+                if not delta:
+                    continue
+                metrics.observe("esg_llm_first_token_seconds", time.perf_counter() - start, kind="commentary")
+            parts.append(delta)
+            yield delta
     except Exception as e:
         print(f"[ESG评估总结生成失败]：{e}")
-        return "【ESG评价】：暂无评估。\n【投资建议】：建议谨慎评估后再做决策。"
+        metrics.inc("esg_llm_errors_total", kind="commentary")
+        metrics.inc("esg_commentary_fallbacks_total")
+        if not parts:
+            yield COMMENTARY_FALLBACK
+        return
+    # 包含调用方处理各段文本的时间
+    metrics.observe("esg_llm_seconds", time.perf_counter() - start, kind="commentary")
+    text = "".join(parts).strip()
+    if cache is not None and text:
+        cache.set(key, text)
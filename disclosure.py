@@ -0,0 +1,156 @@
+import os
+import re
+import threading
+
+import metrics
+from deepseek_api import PROMPT_OVERHEAD_TOKENS
+from utils import estimate_tokens
+
+# 披露精简：去掉数据源失败/无数据时的占位句与重复内容，并按优先级把披露截断到提示词token预算以内。
+# 精简后的披露同时用于评分与评价提示词，每条提示词都因此变短。
+
+# 数据源失败或无数据时返回的占位文本特征（见 tools.py），含这些特征的句子不进入提示词
+PLACEHOLDER_MARKERS = ("获取失败", "暂无数据", "未找到", "暂无披露")
+# 截断优先级：数值越小越优先保留，超出预算时先截断、丢弃优先级低的部分
+SECTION_PRIORITY = {"base": 0, "sec": 1, "stock": 2, "air_quality": 3, "world_bank": 4, "wiki": 5}
+DEFAULT_PRIORITY = len(SECTION_PRIORITY)
+# 单条提示词（模板+披露+回复）的token预算，ESG_PROMPT_TOKEN_BUDGET=0 表示不限制
+PROMPT_TOKEN_BUDGET = int(os.getenv("ESG_PROMPT_TOKEN_BUDGET", 1200))
+# 截断处的省略标记
+ELLIPSIS = "…"
+
+# 按句切分（保留句末标点），换行也视为句子边界
+SENTENCE_ENDINGS = "。！？；"
+_SENTENCE_RE = re.compile(r"[^。！？；\n]+[。！？；]?")
+_SPACE_RE = re.compile(r"\s+")
+
+_stats_lock = threading.Lock()
+_stats = {"disclosures": 0, "raw_tokens": 0, "tokens": 0, "placeholders": 0, "duplicates": 0, "truncated": 0}
+
+
+def get_compaction_stats() -> dict:
+    """返回累计的精简统计：处理的披露数、精简前后的token数、节省的token数与删除/截断次数。"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["saved_tokens"] = stats["raw_tokens"] - stats["tokens"]
+    return stats
+
+
+def reset_compaction_stats():
+    with _stats_lock:
+        for key in _stats:
+            _stats[key] = 0
+
+
+def merge_compaction_stats(delta: dict):
+    """累加其他进程（分片模式的工作进程）的精简统计。"""
+    with _stats_lock:
+        for key in _stats:
+            _stats[key] += delta.get(key, 0)
+
+
+def is_placeholder(sentence: str) -> bool:
+    return any(marker in sentence for marker in PLACEHOLDER_MARKERS)
+
+
+def _separator(sentence: str) -> str:
+    # 以换行（或文本结尾）而非句末标点结束的片段，拼接时补回换行，避免与下一句粘连
+    return "" if sentence.endswith(tuple(SENTENCE_ENDINGS)) else "\n"
+
+
+def _join(sentences: list) -> str:
+    return "".join(sentence + _separator(sentence) for sentence in sentences).rstrip("\n")
+
+
+def _clean_section(text: str, seen: set, counts: dict) -> str:
+    """去掉占位句与已出现过的句子（按空白归一化比较），返回剩余文本。"""
+    kept = []
+    for match in _SENTENCE_RE.finditer(text):
+        sentence = match.group().strip()
+        if not sentence:
+            continue
+        if is_placeholder(sentence):
+            counts["placeholders"] += 1
+            continue
+        normalized = _SPACE_RE.sub(" ", sentence)
+        if normalized in seen:
+            counts["duplicates"] += 1
+            continue
+        seen.add(normalized)
+        kept.append(sentence)
+    return _join(kept)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """按句截断到 max_tokens 以内；第一句就超出时按字符截断并加省略标记，放不下时返回空串。"""
+    if max_tokens <= 0:
+        return ""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    kept, used = [], 0
+    for match in _SENTENCE_RE.finditer(text):
+        sentence = match.group().strip()
+        if not sentence:
+            continue
+        # 补回的换行按1个token计
+        cost = estimate_tokens(sentence) + len(_separator(sentence))
+        if used + cost > max_tokens:
+            break
+        kept.append(sentence)
+        used += cost
+    if kept:
+        return _join(kept)
+    # 估算每字符token数至多0.6，先按此取一个保守长度，再逐字收缩到预算以内
+    cut = text[:int(max_tokens / 0.6)]
+    while cut and estimate_tokens(cut + ELLIPSIS) > max_tokens:
+        cut = cut[:-1]
+    return cut + ELLIPSIS if cut else ""
+
+
+def compact_disclosure(sections: dict, budget: int = None) -> tuple:
+    """
+    由各部分文本 {部分名称: 文本}（顺序即披露顺序）生成精简后的披露文本，返回 (文本, 报告)。
+    budget 为提示词token预算（默认 PROMPT_TOKEN_BUDGET），扣除模板开销后即披露部分的预算。
+    报告含 raw_tokens / tokens / saved_tokens，以及被整体删除（removed）与截断（truncated）的部分名称。
+    """
+    budget = PROMPT_TOKEN_BUDGET if budget is None else budget
+    counts = {"placeholders": 0, "duplicates": 0}
+    seen = set()
+    parts = {}
+    for name, text in sections.items():
+        cleaned = _clean_section(text or "", seen, counts)
+        if cleaned:
+            parts[name] = cleaned
+    removed = [name for name in sections if name not in parts]
+
+    truncated = []
+    if budget > 0:
+        # 按优先级分配预算（每部分另计1个token的换行），超出的部分截断或丢弃
+        remaining = max(0, budget - PROMPT_OVERHEAD_TOKENS)
+        for name in sorted(parts, key=lambda n: SECTION_PRIORITY.get(n, DEFAULT_PRIORITY)):
+            cost = estimate_tokens(parts[name]) + 1
+            if cost <= remaining:
+                remaining -= cost
+                continue
+            cut = truncate_to_tokens(parts[name], remaining - 1)
+            if cut:
+                parts[name] = cut
+            else:
+                del parts[name]
+            truncated.append(name)
+            remaining = 0
+
+    text = "\n".join(parts[name] for name in sections if name in parts)
+    raw_tokens = estimate_tokens("\n".join(t for t in sections.values() if t))
+    tokens = estimate_tokens(text)
+    with _stats_lock:
+        _stats["disclosures"] += 1
+        _stats["raw_tokens"] += raw_tokens
+        _stats["tokens"] += tokens
+        _stats["placeholders"] += counts["placeholders"]
+        _stats["duplicates"] += counts["duplicates"]
+        _stats["truncated"] += len(truncated)
+    metrics.inc("esg_disclosure_tokens_total", raw_tokens, stage="raw")
+    metrics.inc("esg_disclosure_tokens_total", tokens, stage="compact")
+    return text, {"raw_tokens": raw_tokens, "tokens": tokens, "saved_tokens": raw_tokens - tokens,
+                  "removed": removed, "truncated": truncated}
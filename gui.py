@@ -1,41 +1,59 @@
 import sys
-import subprocess
-import re
 import os
+import threading
 from PyQt6.QtWidgets import (
-    QApplication, QWidget, QLabel, QLineEdit, QPushButton, QTextEdit,
+    QApplication, QWidget, QLabel, QLineEdit, QPushButton, QTextEdit, QCheckBox,
     QHBoxLayout, QVBoxLayout, QGridLayout
 )
 from PyQt6.QtGui import QPainter, QPixmap
 from PyQt6.QtCore import Qt, QThread, pyqtSignal
+from utils import split_commentary
 
 # -------------------------------
-# ⏱️ 后台线程类：运行 main.py
+# ⏱️ 常驻分析服务：进程内只创建一次，会话与缓存在多次查询间保持
+# -------------------------------
+_service = None
+_service_lock = threading.Lock()
+
+def get_service():
+    """首次调用时导入并创建分析服务（较重的依赖在后台线程中加载）。"""
+    global _service
+    with _service_lock:
+        if _service is None:
+            from service import AnalysisService
+            _service = AnalysisService()
+        return _service
+
+class WarmupWorker(QThread):
+    """程序启动后在后台预先加载分析服务，首次查询无需等待导入。"""
+    def run(self):
+        try:
+            get_service()
+        except Exception as e:
+            print(f"[警告] 分析服务预加载失败：{e}")
+
+# -------------------------------
+# ⏱️ 后台线程类：调用常驻分析服务
 # -------------------------------
 class AnalysisWorker(QThread):
-    finished = pyqtSignal(str)     # 分析成功后输出结果
+    scores_ready = pyqtSignal(dict)      # 评分完成（评价生成之前）
+    commentary_chunk = pyqtSignal(str)   # 评价文本流式片段
+    finished = pyqtSignal(dict)    # 分析成功后输出结构化结果
     error = pyqtSignal(str)        # 分析失败后输出错误
 
-    def __init__(self, company_name):
+    def __init__(self, company_name, preview=False):
         super().__init__()
         self.company_name = company_name
+        self.preview = preview
 
     def run(self):
         try:
-            python_exec = sys.executable
-            base_dir = os.path.dirname(os.path.abspath(__file__))
-            result = subprocess.run(
-                [python_exec, "main.py", self.company_name],
-                capture_output=True,
-                text=True,
-                check=True,
-                cwd=base_dir,
-            )
-            self.finished.emit(result.stdout)
-        except subprocess.CalledProcessError as e:
-            self.error.emit(f"执行失败：\n{e.stderr}")
-        except FileNotFoundError:
-            self.error.emit("未找到 main.py，请确保它与 gui.py 位于同一文件夹")
+            result = get_service().analyze(self.company_name, preview=self.preview,
+                                           on_scores=self.scores_ready.emit,
+                                           on_commentary=self.commentary_chunk.emit)
+            self.finished.emit(result)
+        except Exception as e:
+            self.error.emit(f"执行失败：\n{e}")
 
 # -------------------------------
 # 🎨 GUI 主界面类
@@ -46,9 +64,11 @@ class ESGApp(QWidget):
         self.setWindowTitle("ESG 智能分析平台")
         self.setFixedSize(900, 700)
         self.worker = None
+        self.warmup = WarmupWorker()
+        self.warmup.start()
 
         # 加载背景图
-        self.background = QPixmap("background.jpeg")
+        self.background = QPixmap(os.path.join(os.path.dirname(os.path.abspath(__file__)), "background.jpeg"))
 
         # 输入框和按钮
         self.input_line = QLineEdit()
@@ -60,8 +80,13 @@ class ESGApp(QWidget):
         self.button.setMinimumHeight(35)
         self.button.clicked.connect(self.run_analysis)
 
+        # 快速预览：只用本地预评分给出临时得分，不调用LLM
+        self.preview_box = QCheckBox("快速预览")
+        self.preview_box.setStyleSheet("font-size: 14px; color: white;")
+
         input_layout = QHBoxLayout()
         input_layout.addWidget(self.input_line)
+        input_layout.addWidget(self.preview_box)
         input_layout.addWidget(self.button)
 
         # 得分标签
@@ -121,37 +146,48 @@ class ESGApp(QWidget):
         self.eval_output.setPlainText("分析中，请稍候……")
         self.advice_output.clear()
 
-        self.worker = AnalysisWorker(company)
+        self._commentary = ""
+        self.worker = AnalysisWorker(company, preview=self.preview_box.isChecked())
+        self.worker.scores_ready.connect(self.show_scores)
+        self.worker.commentary_chunk.connect(self.on_commentary_chunk)
         self.worker.finished.connect(self.on_analysis_done)
         self.worker.error.connect(self.on_analysis_error)
         self.worker.start()
 
-    def on_analysis_done(self, output):
+    def on_analysis_done(self, result):
         self.button.setEnabled(True)
-        self.parse_output(output)
+        self.show_result(result)
 
     def on_analysis_error(self, error_msg):
         self.button.setEnabled(True)
         self.eval_output.setPlainText(error_msg)
         self.advice_output.clear()
 
-    def parse_output(self, text):
-        def extract(pattern, default="N/A"):
-            match = re.search(pattern, text, re.S)
-            return match.group(1).strip() if match else default
-
-        self.env_score.setText(f"环境得分: {extract(r'环境得分[:：]\s*([\d.]+)')}")
-        self.soc_score.setText(f"社会得分: {extract(r'社会得分[:：]\s*([\d.]+)')}")
-        self.gov_score.setText(f"治理得分: {extract(r'治理得分[:：]\s*([\d.]+)')}")
-        self.esg_score.setText(f"综合得分: {extract(r'综合ESG得分[:：]\s*([\d.]+)')}")
-        self.rating.setText(f"评级: {extract(r'评级[:：]?\s*([A-Z+-]+)')}")
-
-        esg_eval = extract(r"【ESG评价】[:：]?\s*\n?(.*?)(?=【投资建议】)", "未找到 ESG 评价内容")
-        advice = extract(r"【投资建议】[:：]?\s*\n?(.*)", "未找到投资建议内容")
-
-        self.eval_output.setPlainText(esg_eval)
+    def show_scores(self, result):
+        self.env_score.setText(f"环境得分: {result['env']:.2f}")
+        self.soc_score.setText(f"社会得分: {result['soc']:.2f}")
+        self.gov_score.setText(f"治理得分: {result['gov']:.2f}")
+        self.esg_score.setText(f"综合得分: {result['esg_score']:.2f}")
+        self.rating.setText(f"评级: {result['esg_rating']}")
+        self.eval_output.setPlainText("生成评价中……")
+
+    def on_commentary_chunk(self, chunk):
+        # 每收到一段文本，按【投资建议】标记重新拆分并刷新两个文本框
+        self._commentary += chunk
+        evaluation, advice = split_commentary(self._commentary)
+        self.eval_output.setPlainText(evaluation)
         self.advice_output.setPlainText(advice)
 
+    def show_result(self, result):
+        self.show_scores(result)
+        if result.get("preview"):
+            self.eval_output.setPlainText(f"预览：本地预评分的临时得分（置信度 {result['confidence']:.2f}），未调用LLM。\n"
+                                          "取消勾选“快速预览”后重新分析可获得完整评价。")
+            self.advice_output.clear()
+            return
+        self.eval_output.setPlainText(result["evaluation"] or "未找到 ESG 评价内容")
+        self.advice_output.setPlainText(result["advice"] or "未找到投资建议内容")
+
 # 程序入口
 if __name__ == "__main__":
     app = QApplication(sys.argv)
@@ -0,0 +1,193 @@
+import os
+import json
+import time
+import threading
+import weakref
+from functools import wraps
+from urllib.parse import urlencode, urlsplit
+
+import metrics
+import replay
+
+# 各端点的响应缓存时间（秒）：世界银行指标按天更新，SEC年报数据按小时，空气质量按分钟
+ENDPOINT_TTLS = {
+    "api.worldbank.org": 3 * 24 * 3600,
+    "data.sec.gov": 6 * 3600,
+    "api.openaq.org": 30 * 60,
+}
+DEFAULT_TTL = 60
+# 股价等行情数据的缓存时间（秒）
+QUOTE_TTL = 30
+# 可缓存的状态码：404 作为负缓存，避免对不存在的资源反复请求
+CACHEABLE_STATUS = (200, 404)
+
+# 连接池大小需覆盖并发抓取的线程数
+POOL_SIZE = 32
+# 429/5xx 自动重试参数（指数退避，遵循 Retry-After），首次创建会话时构造 urllib3 Retry
+RETRY_OPTIONS = dict(
+    total=3,
+    backoff_factor=0.5,
+    status_forcelist=(429, 500, 502, 503, 504),
+    allowed_methods=frozenset(["GET"]),
+    respect_retry_after_header=True,
+    raise_on_status=False,
+)
+
+_session = None
+_session_lock = threading.Lock()
+_ca_bundle_set = False
+
+
+def ensure_ca_bundle():
+    """设置证书路径（certifi），防止HTTPS证书错误；只在首次发起网络访问前执行一次。"""
+    global _ca_bundle_set
+    if _ca_bundle_set:
+        return
+    try:
+        import certifi
+        os.environ["SSL_CERT_FILE"] = certifi.where()
+    except ImportError:
+        pass
+    _ca_bundle_set = True
+
+
+def get_session() -> "requests.Session":
+    """
+    返回进程内共享的连接池会话（keep-alive，带重试策略），首次调用时才导入 requests。
+    录制/回放模式下返回 replay.ReplaySession。
+    """
+    if replay.enabled():
+        return replay.get_session(_get_real_session)
+    return _get_real_session()
+
+
+def _get_real_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+            ensure_ca_bundle()
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE,
+                                  max_retries=Retry(**RETRY_OPTIONS))
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+class CachedResponse:
+    """缓存中的响应快照，只保留状态码、头信息与正文。"""
+    def __init__(self, status_code: int, content: bytes, headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = dict(headers or {})
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class TTLCache:
+    """线程安全的内存TTL缓存，超出容量时淘汰最早写入的条目。"""
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                self._data.pop(key, None)
+                self.misses += 1
+                return None
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value, ttl: float):
+        with self._lock:
+            if len(self._data) >= self.max_entries:
+                self._data.pop(next(iter(self._data)))
+            self._data[key] = (time.monotonic() + ttl, value)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_response_cache = TTLCache()
+# 同一URL并发请求时只发一次（single-flight），其余线程等待结果；
+# 锁只被持有或等待它的线程引用，请求结束后条目自动移除
+_inflight_locks = weakref.WeakValueDictionary()
+_inflight_guard = threading.Lock()
+
+
+def _key_lock(key) -> threading.Lock:
+    with _inflight_guard:
+        lock = _inflight_locks.get(key)
+        if lock is None:
+            lock = _inflight_locks[key] = threading.Lock()
+        return lock
+
+
+def endpoint_ttl(url: str) -> float:
+    """根据主机名返回该端点的缓存时间。"""
+    return ENDPOINT_TTLS.get(urlsplit(url).hostname, DEFAULT_TTL)
+
+
+def cached_get(url: str, params=None, headers=None, timeout: float = 10, ttl: float = None) -> CachedResponse:
+    """
+    通过共享会话发送GET请求，200/404 响应按端点TTL缓存。
+    ttl 为 None 时按 ENDPOINT_TTLS 取值，为 0 时不缓存。
+    """
+    ttl = endpoint_ttl(url) if ttl is None else ttl
+    key = url + ("?" + urlencode(sorted((params or {}).items())) if params else "")
+    cached = _response_cache.get(key) if ttl else None
+    if cached is not None:
+        return cached
+    with _key_lock(key):
+        # 等待期间其他线程可能已经完成同一请求
+        cached = _response_cache.get(key) if ttl else None
+        if cached is not None:
+            return cached
+        resp = get_session().get(url, params=params, headers=headers, timeout=timeout)
+        metrics.inc("esg_http_requests_total", host=urlsplit(url).hostname, status=resp.status_code)
+        result = CachedResponse(resp.status_code, resp.content, resp.headers)
+        if ttl and resp.status_code in CACHEABLE_STATUS:
+            _response_cache.set(key, result, ttl)
+        return result
+
+
+def ttl_memoize(ttl: float):
+    """
+    按参数缓存函数返回值的装饰器，只缓存非空结果，用于行情等短时有效的数据。
+    """
+    def decorator(fn):
+        cache = TTLCache()
+
+        @wraps(fn)
+        def wrapper(*args):
+            value = cache.get(args)
+            if value is not None:
+                return value
+            value = fn(*args)
+            if value:
+                cache.set(args, value, ttl)
+            return value
+
+        wrapper.cache = cache
+        return wrapper
+    return decorator
+
+
+def cache_stats() -> dict:
+    """返回HTTP响应缓存的命中/未命中计数。"""
+    return {"hits": _response_cache.hits, "misses": _response_cache.misses}
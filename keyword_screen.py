@@ -0,0 +1,110 @@
+import json
+import hashlib
+import threading
+from collections import OrderedDict, deque
+
+
+class AhoCorasick:
+    """
+    Aho–Corasick 多模式匹配自动机：一次扫描文本即可找出所有出现的模式串。
+    模式与文本均按 casefold 处理，英文不区分大小写。
+    """
+    def __init__(self, patterns):
+        self.patterns = list(dict.fromkeys(p for p in patterns if p))
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [()]
+        for index, pattern in enumerate(self.patterns):
+            node = 0
+            for ch in pattern.casefold():
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(())
+                node = nxt
+            self._output[node] += (index,)
+        # 广度优先构建失败指针，并把失败链上的输出合并到当前节点
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._output[nxt] += self._output[self._fail[nxt]]
+
+    def find(self, text: str) -> set:
+        """返回文本中出现过的模式下标集合。"""
+        goto, fail, output = self._goto, self._fail, self._output
+        found = set()
+        node = 0
+        for ch in text.casefold():
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if output[node]:
+                found.update(output[node])
+        return found
+
+
+class KeywordScreen:
+    """
+    关键词筛选引擎：由多个筛选策略（如负面筛选、影响力投资）的关键词表编译成一个自动机，
+    每条披露只扫描一次；结果按披露内容哈希缓存，所有投资者共享。
+    """
+    def __init__(self, policies: dict, cache_size: int = 65536):
+        self.policies = {name: list(terms) for name, terms in policies.items()}
+        self._automaton = AhoCorasick(term for terms in self.policies.values() for term in terms)
+        # 模式下标 -> 所属策略列表（同一词可属于多个策略）
+        index = {term: i for i, term in enumerate(self._automaton.patterns)}
+        self._pattern_policies = [[] for _ in self._automaton.patterns]
+        for name, terms in self.policies.items():
+            for term in dict.fromkeys(terms):
+                if term:
+                    self._pattern_policies[index[term]].append(name)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def screen(self, text: str) -> dict:
+        """返回 {策略名称: 命中关键词元组}，未命中任何关键词的策略不出现在结果中。"""
+        key = hashlib.sha1(text.encode("utf-8")).digest()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+        hits = {}
+        for i in sorted(self._automaton.find(text)):
+            term = self._automaton.patterns[i]
+            for name in self._pattern_policies[i]:
+                hits.setdefault(name, []).append(term)
+        result = {name: tuple(terms) for name, terms in hits.items()}
+        with self._lock:
+            self._cache[key] = result
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def matched(self, text: str, policy: str) -> tuple:
+        """某一策略在文本中命中的关键词。"""
+        return self.screen(text).get(policy, ())
+
+
+def load_screening_policies(path: str) -> dict:
+    """读取筛选关键词配置（JSON：{策略名称: [关键词, ...]}）。"""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if not isinstance(data, dict) or not all(isinstance(v, list) for v in data.values()):
+        raise ValueError(f"筛选关键词配置格式应为 {{策略名称: [关键词, ...]}}：{path}")
+    return data
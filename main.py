@@ -1,100 +1,248 @@
+import os
 import sys
+import csv
+import json
 import argparse
-from model import ESGModel
-from deepseek_api import generate_esg_commentary
+from keyword_screen import load_screening_policies
+from resolver import load_sec_ticker_map, resolve_companies
+from scoring import SCORING_MODES
+# model/service 依赖 numpy 与数据源后端，在解析完命令行参数后才导入，使 --help 等操作快速返回
 
-def resolve_company(term: str):
+# 批量模式输出字段
+RESULT_FIELDS = ["id", "name", "ticker", "city", "country", "cik", "env", "soc", "gov", "esg_score", "esg_rating"]
+
+def load_portfolio(path: str) -> list:
     """
-    根据用户输入的名称或代码，推断股票代码和公司正式名称。
-    返回元组 (name, ticker, city, country, cik)。
+    读取投资组合文件（CSV、JSONL 或顶层为数组的 JSON），每家公司一行/一个对象，
+    字段：name/ticker/city/country/cik，可选 id。
     """
-    term = term.strip()
-    # 简单判断输入类型
-    is_ticker = term.isupper() and 1 <= len(term) <= 5  # 全大写且长度较短，视为股票代码
-    if is_ticker:
-        ticker = term
-        # 尝试通过Yahoo财经获取公司全称
-        try:
-            tk = __import__('yfinance').Ticker(ticker)
-            info = tk.info
-            name = info.get("longName") or term
-            country = info.get("country")
-            city = info.get("city")
-        except Exception:
-            name = term
-            country = None
-            city = None
-    else:
-        name = term
-        # 利用Yahoo财经搜索API查找股票代码
-        try:
-            import requests
-            resp = requests.get("https://query2.finance.yahoo.com/v1/finance/search", params={"q": term}, timeout=5)
-            data = resp.json()
-            # 提取第一个搜索结果的股票代码和名称
-            quotes = data.get("quotes")
-            if quotes:
-                ticker = quotes[0].get("symbol")
-                # 如果搜索结果有正式名称，使用它
-                if quotes[0].get("shortname"):
-                    name = quotes[0]["shortname"]
-                elif quotes[0].get("longname"):
-                    name = quotes[0]["longname"]
+    rows = []
+    with open(path, encoding="utf-8-sig") as f:
+        if path.lower().endswith((".jsonl", ".json")):
+            text = f.read()
+            if text.lstrip().startswith("["):
+                rows = json.loads(text)
             else:
-                ticker = term  # 未找到则直接用名称当作ticker尝试
-        except Exception:
-            ticker = term
-        country = None
-        city = None
-    # 返回解析结果
-    return name, ticker, city, country, None  # 由于CIK难以直接获取，这里返回None
+                rows = [json.loads(line) for line in text.splitlines() if line.strip()]
+        else:
+            rows = list(csv.DictReader(f))
+    # 去掉空白与空字段
+    cleaned = []
+    for row in rows:
+        row = {k.strip().lower(): (str(v).strip() if v is not None else "") for k, v in row.items() if k}
+        row = {k: v for k, v in row.items() if v}
+        if row.get("name") or row.get("ticker"):
+            cleaned.append(row)
+    return cleaned
+
+def record_key(row: dict) -> str:
+    """批量结果中标识一家公司的键：优先用id，其次ticker、name。"""
+    return str(row.get("id") or row.get("ticker") or row.get("name"))
+
+def drop_duplicates(rows: list) -> list:
+    """
+    去掉键（record_key）重复的行，只保留第一次出现的一行并打印警告；
+    ESGModel 要求企业ID唯一，重复的行（如同一代码出现两次）否则会使整个批量任务失败。
+    """
+    seen = {}
+    unique = []
+    for row in rows:
+        key = record_key(row)
+        if key in seen:
+            seen[key] += 1
+            continue
+        seen[key] = 0
+        unique.append(row)
+    for key, count in seen.items():
+        if count:
+            print(f"[警告] 投资组合中 {key} 重复出现 {count} 次，只评分第一行。")
+    return unique
+
+def load_completed(path: str) -> set:
+    """读取已有输出文件中完成的公司键，用于断点续跑。"""
+    if not os.path.exists(path):
+        return set()
+    with open(path, encoding="utf-8") as f:
+        if path.lower().endswith(".csv"):
+            return {row["id"] for row in csv.DictReader(f) if row.get("id")}
+        done = set()
+        for line in f:
+            try:
+                done.add(str(json.loads(line)["id"]))
+            except (ValueError, KeyError):
+                continue  # 中断时可能留下不完整的最后一行
+        return done
+
+def _truncate_partial_line(path: str):
+    """去掉上次中断时写了一半的最后一行，保证续写的文件格式完整。"""
+    with open(path, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+
+class ResultWriter:
+    """逐条写出评分结果（JSONL 或 CSV，按扩展名判断），每条写入后立即落盘。"""
+    def __init__(self, path: str, append: bool = False):
+        self.is_csv = path.lower().endswith(".csv")
+        exists = append and os.path.exists(path) and os.path.getsize(path) > 0
+        if exists:
+            _truncate_partial_line(path)
+        self.file = open(path, "a" if append else "w", encoding="utf-8", newline="")
+        if self.is_csv:
+            self.writer = csv.DictWriter(self.file, fieldnames=RESULT_FIELDS, extrasaction="ignore")
+            if not exists:
+                self.writer.writeheader()
+
+    def write(self, record: dict):
+        if self.is_csv:
+            self.writer.writerow(record)
+        else:
+            self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+def run_batch(args):
+    """批量模式：在同一进程、同一个ESGModel中对组合内全部公司评分，结果边算边写出。"""
+    from model import ESGModel
+    from disclosure import get_compaction_stats
+    rows = drop_duplicates(load_portfolio(args.batch))
+    output = args.output or os.path.splitext(args.batch)[0] + "_results.jsonl"
+    completed = load_completed(output) if args.resume else set()
+    pending = [row for row in rows if record_key(row) not in completed]
+    print(f"[批量] 共 {len(rows)} 家公司，已完成 {len(rows) - len(pending)} 家，待评分 {len(pending)} 家。")
+    if not pending:
+        return
+
+    # 同时提供名称与代码时无需再解析，其余一次性批量解析
+    resolved = resolve_companies(row.get("ticker") or row["name"] for row in pending
+                                 if not (row.get("name") and row.get("ticker")))
+    sec_map = load_sec_ticker_map()
+    firms_data = []
+    for row in pending:
+        if row.get("name") and row.get("ticker"):
+            name, ticker, city, country = row["name"], row["ticker"], None, None
+            cik = sec_map.get(ticker.upper())
+        else:
+            name, ticker, city, country, cik = resolved[(row.get("ticker") or row["name"]).strip()]
+        firms_data.append({
+            "id": record_key(row),
+            "name": name,
+            "ticker": ticker,
+            "city": row.get("city") or city,
+            "country": row.get("country") or country,
+            "cik": row.get("cik") or cik,
+        })
+
+    writer = ResultWriter(output, append=args.resume)
+    done = [0]
+    prescore_mode = "preview" if args.preview else "triage" if args.triage else None
+
+    def on_firm_scored(firm, record):
+        row = {
+            "id": firm.unique_id, "name": firm.firm_name, "ticker": firm.ticker,
+            "city": firm.city, "country": firm.country_code, "cik": firm.cik,
+            "env": round(record["env"], 2), "soc": round(record["soc"], 2), "gov": round(record["gov"], 2),
+            "esg_score": round(record["esg_score"], 2), "esg_rating": record["esg_rating"],
+        }
+        note = ""
+        if prescore_mode:
+            # 预评分的临时得分（未调用LLM）在JSONL结果中标记为 provisional
+            row["provisional"] = firm.unique_id in model.prescored_firms
+            if row["provisional"]:
+                note = f"，临时得分，置信度 {model.prescored_firms[firm.unique_id]:.2f}"
+        writer.write(row)
+        done[0] += 1
+        print(f"[批量] {done[0]}/{len(firms_data)} {firm.firm_name}：{record['esg_score']:.2f}（{record['esg_rating']}{note}）")
+
+    model = ESGModel(firms_data=firms_data, N_investors=args.investors, scoring_mode=args.scoring_mode,
+                     max_in_flight=args.max_in_flight, requests_per_minute=args.rpm,
+                     tokens_per_minute=args.tpm, on_firm_scored=on_firm_scored,
+                     incremental=bool(args.score_state), score_state_path=args.score_state,
+                     screening_policies=args.screening_policies, processes=args.processes,
+                     pipelined=args.pipelined, prescore_mode=prescore_mode)
+    try:
+        model.step()
+    finally:
+        writer.close()
+        model.close()
+    compaction = get_compaction_stats()
+    if compaction["disclosures"]:
+        print(f"[批量] 披露精简：{compaction['raw_tokens']} → {compaction['tokens']} token，"
+              f"每次评分调用平均节省 {compaction['saved_tokens'] / compaction['disclosures']:.0f} token。")
+    if prescore_mode:
+        print(f"[批量] 预评分：{len(model.prescored_firms)} 家使用临时得分，"
+              f"{len(model.rescored_firms)} 家调用LLM评分。")
+    if args.score_state:
+        print(f"[批量] 本次重新评分 {len(model.rescored_firms)} 家，沿用上次得分 {len(firms_data) - len(model.rescored_firms)} 家。")
+    print(f"[批量] 结果已写入：{output}")
 
 def main():
     # 设置命令行参数解析
     parser = argparse.ArgumentParser(description="ESG 多智能体分析系统")
-    parser.add_argument("company", help="公司名称或股票代码")
+    parser.add_argument("company", nargs="?", help="公司名称或股票代码")
     parser.add_argument("--city", help="公司所在城市（用于环境数据）", default=None)
     parser.add_argument("--country", help="公司所在国家的ISO代码（用于国家指标）", default=None)
     parser.add_argument("--cik", help="公司在SEC的CIK代码（用于美国年报数据）", default=None)
+    parser.add_argument("--scoring-mode", help="评分模式：separate 逐维度调用，batch 一次调用获取三个维度", choices=SCORING_MODES, default="separate")
+    parser.add_argument("--sec-tickers", help="SEC ticker→CIK 映射文件（company_tickers.json 或 ticker,cik 两列CSV）", default=None)
+    parser.add_argument("--screening-policies", default=None,
+                        help="筛选关键词配置文件（JSON：{\"exclusion\": [...], \"impact\": [...]}）")
+    parser.add_argument("--batch", help="批量模式：投资组合文件（CSV、JSONL或JSON数组，字段 name/ticker/city/country/cik）", default=None)
+    parser.add_argument("--output", help="批量模式结果文件（.jsonl 或 .csv），默认与输入同名加 _results.jsonl", default=None)
+    parser.add_argument("--resume", action="store_true", help="批量模式：跳过输出文件中已完成的公司，继续未完成的部分")
+    parser.add_argument("--score-state", default=None,
+                        help="批量模式：增量评分状态文件，披露未变化的公司沿用上次得分（适合每日刷新）")
+    parser.add_argument("--investors", type=int, default=1, help="批量模式：投资者Agent数量")
+    parser.add_argument("--processes", type=int, default=1, help="批量模式：分片评分的进程数（大于1时启用多进程）")
+    parser.add_argument("--pipelined", action="store_true",
+                        help="批量模式：流水线调度（企业披露就绪即评分、评分完成即执行投资决策）")
+    parser.add_argument("--triage", action="store_true",
+                        help="批量模式：本地预评分分流，只有置信度低或得分变化大的公司调用LLM")
+    parser.add_argument("--preview", action="store_true",
+                        help="预览模式：只用本地预评分给出临时得分与置信度，不调用LLM（单个公司与批量模式均可用）")
+    parser.add_argument("--max-in-flight", type=int, default=8, help="评分请求的最大并发数（分片模式下为每个进程）")
+    parser.add_argument("--rpm", type=float, default=None, help="每分钟评分请求数上限")
+    parser.add_argument("--tpm", type=float, default=None, help="每分钟token数上限")
     args = parser.parse_args()
+    if args.sec_tickers:
+        load_sec_ticker_map(args.sec_tickers)
+    if args.screening_policies:
+        args.screening_policies = load_screening_policies(args.screening_policies)
+
+    if args.batch:
+        run_batch(args)
+        return
+    if not args.company:
+        parser.error("请提供公司名称或股票代码，或使用 --batch 指定投资组合文件")
+
+    from service import AnalysisService, format_identifier
+
+    service = AnalysisService(scoring_mode=args.scoring_mode, max_in_flight=args.max_in_flight,
+                              requests_per_minute=args.rpm, tokens_per_minute=args.tpm,
+                              screening_policies=args.screening_policies)
+
+    def on_scores(result):
+        # 打印输出结果
+        print(f"\n分析对象：{format_identifier(result)}")
+        print(f"环境得分: {result['env']:.2f}")
+        print(f"社会得分: {result['soc']:.2f}")
+        print(f"治理得分: {result['gov']:.2f}")
+        print(f"综合ESG得分: {result['esg_score']:.2f}，评级: {result['esg_rating']}")
+        if result.get("preview"):
+            print(f"（预览：本地预评分的临时得分，置信度 {result['confidence']:.2f}，未调用LLM）")
+            return
+        print("ESG综合评价与投资建议：")
+
+    if args.preview:
+        service.analyze(args.company, city=args.city, country=args.country, cik=args.cik,
+                        preview=True, on_scores=on_scores)
+        return
+    # 评价文本边生成边输出
+    result = service.analyze(args.company, city=args.city, country=args.country, cik=args.cik,
+                             on_scores=on_scores, on_commentary=lambda chunk: print(chunk, end="", flush=True))
+    print("" if result["commentary"] else "无")
 
-    # 解析输入参数
-    user_input = args.company
-    # 通过辅助函数解析名称和代码
-    name, ticker, city, country, cik = resolve_company(user_input)
-    # 如果用户有显式提供city/country/cik参数则覆盖自动推断结果
-    if args.city: city = args.city
-    if args.country: country = args.country
-    if args.cik: cik = args.cik
-
-    # 构造公司数据字典并创建模型
-    firm_data = {
-        "id": 0,
-        "name": name,
-        "ticker": ticker,
-        "city": city,
-        "country": country,
-        "cik": cik
-    }
-    model = ESGModel(firms_data=[firm_data], N_investors=1)
-    model.step()  # 执行模型分析流程
-
-    # 获取结果并生成ESG评价与投资建议
-    results = model.get_firm_scores()
-    firm = model.firms[0]
-    scores = results.get(firm, {})
-    disclosure = model.current_disclosures.get(firm, "（暂无披露）")
-    commentary = generate_esg_commentary(disclosure, scores)
-
-    # 打印输出结果
-    comp_identifier = f"{name} ({ticker})" if ticker and name and ticker != name else (name or ticker)
-    print(f"\n分析对象：{comp_identifier}")
-    print(f"环境得分: {scores.get('env', 0):.2f}")
-    print(f"社会得分: {scores.get('soc', 0):.2f}")
-    print(f"治理得分: {scores.get('gov', 0):.2f}")
-    print(f"综合ESG得分: {scores.get('esg_score', 0):.2f}，评级: {scores.get('esg_rating', 'N/A')}")
-    print("ESG综合评价与投资建议：")
-    print(commentary if commentary else "无")
-    
 if __name__ == "__main__":
     main()
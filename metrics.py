@@ -0,0 +1,162 @@
+import os
+import json
+import time
+import atexit
+import bisect
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+# 进程内指标：计数器与耗时直方图，可导出为JSON或Prometheus文本格式。
+# ESG_METRICS=0 关闭采集；设置 ESG_METRICS_FILE 时在进程退出时写出（.prom/.txt 为Prometheus格式，其余为JSON）。
+ENABLED = os.getenv("ESG_METRICS", "1") != "0"
+METRICS_FILE = os.getenv("ESG_METRICS_FILE")
+
+# 直方图分桶上限（秒），覆盖本地计算到慢速外部接口
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_lock = threading.Lock()
+_counters = {}    # (名称, 标签元组) -> 数值
+_histograms = {}  # (名称, 标签元组) -> [次数, 总和, 最大值, 各桶计数]
+
+
+def _labels(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels):
+    """计数器加 value。"""
+    if not ENABLED:
+        return
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name: str, seconds: float, **labels):
+    """向耗时直方图记录一次观测值（秒）。"""
+    if not ENABLED:
+        return
+    key = (name, _labels(labels))
+    index = bisect.bisect_left(BUCKETS, seconds)
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = [0, 0.0, 0.0, [0] * (len(BUCKETS) + 1)]
+        hist[0] += 1
+        hist[1] += seconds
+        if seconds > hist[2]:
+            hist[2] = seconds
+        hist[3][index] += 1
+
+
+def _error_counter(name: str) -> str:
+    return (name[:-len("_seconds")] if name.endswith("_seconds") else name) + "_errors_total"
+
+
+@contextmanager
+def span(name: str, **labels):
+    """计时区间：耗时记入直方图 name；区间内抛出异常时另计错误数（esg_x_seconds -> esg_x_errors_total）。"""
+    if not ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        inc(_error_counter(name), **labels)
+        raise
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def timed(name: str, **labels):
+    """把函数的每次调用记为一个计时区间的装饰器。"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name, **labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def reset():
+    """清空全部指标。"""
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def snapshot() -> dict:
+    """返回 {"counters": [...], "histograms": [...]}，可直接序列化为JSON。"""
+    with _lock:
+        counters = [{"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(_counters.items())]
+        histograms = []
+        for (name, labels), (count, total, peak, buckets) in sorted(_histograms.items()):
+            histograms.append({
+                "name": name, "labels": dict(labels), "count": count, "sum": total, "max": peak,
+                "mean": total / count if count else 0.0,
+                "buckets": dict(zip([str(b) for b in BUCKETS] + ["+Inf"], buckets)),
+            })
+    return {"counters": counters, "histograms": histograms}
+
+
+def _format_labels(labels: dict, extra: dict = None) -> str:
+    items = list(labels.items()) + list((extra or {}).items())
+    if not items:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in items)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + "}"
+
+
+def to_prometheus() -> str:
+    """导出为Prometheus文本格式（直方图的桶为累计计数）。"""
+    data = snapshot()
+    lines = []
+    declared = set()
+    for item in data["counters"]:
+        name = item["name"]
+        if name not in declared:
+            lines.append(f"# TYPE {name} counter")
+            declared.add(name)
+        lines.append(f"{name}{_format_labels(item['labels'])} {item['value']}")
+    for item in data["histograms"]:
+        name = item["name"]
+        if name not in declared:
+            lines.append(f"# TYPE {name} histogram")
+            declared.add(name)
+        cumulative = 0
+        for bound, count in item["buckets"].items():
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(item['labels'], {'le': bound})} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(item['labels'])} {item['sum']}")
+        lines.append(f"{name}_count{_format_labels(item['labels'])} {item['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def write(path: str = None):
+    """把当前指标写入文件（原子替换）；path 默认为 ESG_METRICS_FILE。"""
+    path = path or METRICS_FILE
+    if not path:
+        return
+    if path.endswith((".prom", ".txt")):
+        text = to_prometheus()
+    else:
+        text = json.dumps(snapshot(), ensure_ascii=False, indent=2)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def _write_at_exit():
+    try:
+        write()
+    except OSError as e:
+        print(f"[警告] 指标文件写入失败（{METRICS_FILE}）：{e}")
+
+
+if ENABLED and METRICS_FILE:
+    atexit.register(_write_at_exit)
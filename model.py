@@ -1,12 +1,52 @@
-from agents import EnvironmentAgent, SocialAgent, GovernanceAgent, FirmAgent, InvestorAgent
+import os
+import json
+import time
+import hashlib
+from agents import (
+    EnvironmentAgent, SocialAgent, GovernanceAgent, BatchESGAgent, FirmAgent, InvestorAgent,
+    DEFAULT_SCREENING_POLICIES
+)
+from deepseek_api import get_api_stats
+from keyword_screen import KeywordScreen
+import metrics
+from score_table import SCORE_KEYS, ScoreStore, ScoreTable
+from scoring import SCORING_MODES, ScoringEngine
+from tools import fetch_shared_context
+from prescore import PRESCORE_MODES, get_prescorer, needs_llm
 from utils import map_score_to_rating
+from wiki import prefetch_summaries
 
 class ESGModel:
-    def __init__(self, firms_data=None, N_firms=3, N_investors=2):
+    def __init__(self, firms_data=None, N_firms=3, N_investors=2, scoring_mode="separate",
+                 max_in_flight=8, requests_per_minute=None, tokens_per_minute=None, on_firm_scored=None,
+                 incremental=False, score_state_path=None, verbose=True, screening_policies=None,
+                 scoring_engine=None, processes=1, pipelined=False,
+                 prescore_mode=None, prescorer=None):
         """
         初始化ESG模型，可传入firms_data列表以指定分析的公司。
         如果未提供firms_data，则默认创建 N_firms 个虚拟公司进行模拟。
+        scoring_mode: "separate" 为三个维度各调用一次评分接口；"batch" 为每个企业一次调用获取全部维度。
+        max_in_flight / requests_per_minute / tokens_per_minute: 评分请求的最大并发数与每分钟请求数、token数上限。
+        on_firm_scored: 可选回调 on_firm_scored(firm, record)，某企业三个维度全部评分完成时立即调用。
+        incremental: 增量模式，披露指纹与上次评分时一致的企业沿用上次得分，不再调用评分接口。
+        score_state_path: 增量模式下持久化指纹与得分的JSON文件，便于跨进程（如每日刷新）复用。
+        verbose: 是否逐条打印投资者的投资决策。
+        screening_policies: 筛选关键词表 {"exclusion": [...], "impact": [...]}，默认使用 DEFAULT_SCREENING_POLICIES；
+            也可直接传入已编译的 KeywordScreen 以便多个模型共享。
+        scoring_engine: 可选的共享 ScoringEngine（如常驻服务中多个模型共用），提供时忽略并发与限流参数。
+        processes: 大于1时启用分片模式，披露收集与评分分散到多个进程（见 sharding.py），
+            每个进程的并发数为 max_in_flight，RPM/TPM 上限在进程间平分。
+        pipelined: 流水线模式（见 scheduler.py），企业披露就绪后立即评分、三个维度并发评分、
+            评分完成的企业立即执行投资决策，披露抓取与LLM评分相互重叠。
+        prescore_mode: 本地预评分（见 prescore.py）。"triage" 时只有预评分置信度低或与上次得分差异大的企业
+            调用LLM，其余使用临时得分，并用LLM得分持续拟合预评分器；"preview" 时全部使用临时得分，不调用LLM。
+        prescorer: 可选的共享 PreScorer，默认使用全局预评分器。
         """
+        if scoring_mode not in SCORING_MODES:
+            raise ValueError(f"未知的评分模式：{scoring_mode}，可选：{SCORING_MODES}")
+        if prescore_mode is not None and prescore_mode not in PRESCORE_MODES:
+            raise ValueError(f"未知的预评分模式：{prescore_mode}，可选：{PRESCORE_MODES}")
+        self.scoring_mode = scoring_mode
         self.firms = []
         if firms_data:
             # 根据提供的数据创建对应的 FirmAgent 实例
@@ -21,6 +61,14 @@ class ESGModel:
         else:
             # 未提供特定公司时，创建虚拟公司
             self.firms = [FirmAgent(i, self) for i in range(N_firms)]
+        # 企业ID -> FirmAgent；披露与评分均以稳定的企业ID为键，便于跨进程合并结果
+        self.firm_index = {firm.unique_id: firm for firm in self.firms}
+        if len(self.firm_index) != len(self.firms):
+            raise ValueError("企业ID重复：firms_data 中每个企业的 id 必须唯一")
+        # 列式评分存储：行号与 self.firms 的顺序一致，企业Agent通过行号读取累计投资
+        self.score_store = ScoreStore(len(self.firms))
+        for row, firm in enumerate(self.firms):
+            firm._row = row
 
         # 创建投资者Agent列表
         self.investors = [InvestorAgent(100 + i, self) for i in range(N_investors)]
@@ -28,57 +76,314 @@ class ESGModel:
         self.env_agent = EnvironmentAgent(self)
         self.soc_agent = SocialAgent(self)
         self.gov_agent = GovernanceAgent(self)
-        # 字典用于暂存企业披露内容和评分结果
+        self.batch_agent = BatchESGAgent(self)
+        # 分片模式的进程数与工作进程使用的并发/限流参数
+        self.processes = max(1, int(processes))
+        self.max_in_flight = max_in_flight
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._process_pool = None
+        self.pipelined = pipelined
+        # 流水线模式下为下一轮推测预取的数据源 {企业ID: (提交时间, Future)}，及其线程池
+        self._next_sources = {}
+        self._prefetch_executor = None
+        self._owns_engine = scoring_engine is None
+        # 评分调度器：控制并发与限流，由各评分Agent共享
+        self.scoring_engine = scoring_engine or ScoringEngine(max_in_flight=max_in_flight,
+                                                              requests_per_minute=requests_per_minute,
+                                                              tokens_per_minute=tokens_per_minute)
+        # 暂存企业披露内容，键为企业ID（评分结果存于 score_store）
         self.current_disclosures = {}
-        self.scores = {}
+        # 多个企业共用的国家/城市背景数据 {("world_bank", 国家, 指标) 或 ("air_quality", 城市): 文本}
+        self.context = {}
+        # 最近一次评分阶段的调用次数、token用量与耗时，便于比较两种评分模式
+        self.scoring_stats = {}
+        # 最近一次迭代各阶段的耗时（秒）：disclosures、select、score_<维度>、score_table、investors 等
+        self.step_timings = {}
+        self.on_firm_scored = on_firm_scored
+        # 本轮需要评分的披露（非增量模式下即全部披露）
+        self.pending_disclosures = {}
+        # 增量评分状态：{企业ID: {"fingerprint", "sections", "scores"}}
+        self.incremental = incremental
+        self.score_state_path = score_state_path
+        self._score_state = self._load_score_state() if incremental else {}
+        # 最近一次迭代实际重新评分的企业ID，以及各企业发生变化的披露部分
+        self.rescored_firms = []
+        self.changed_sections = {}
+        # 预评分：最近一次迭代使用临时得分（未调用LLM）的企业 {企业ID: 置信度}
+        self.prescore_mode = prescore_mode
+        self.prescorer = (prescorer or get_prescorer()) if prescore_mode else None
+        self.prescored_firms = {}
+        self.verbose = verbose
+        # 关键词筛选自动机只编译一次，匹配结果按披露哈希缓存
+        if isinstance(screening_policies, KeywordScreen):
+            self.keyword_screen = screening_policies
+        else:
+            self.keyword_screen = KeywordScreen(screening_policies or DEFAULT_SCREENING_POLICIES)
+        # 列式评分表，每轮评分后首次使用时构建，评分或披露变化时失效
+        self._score_table = None
 
     def submit_disclosure(self, firm, disclosure: str):
         """由FirmAgent调用，将企业披露内容提交给模型暂存。"""
-        self.current_disclosures[firm] = disclosure
+        self.current_disclosures[firm.unique_id] = disclosure
+        self._score_table = None
+
+    def assign_score(self, firm_id, dimension: str, score: float, fallback: bool = False):
+        """由ESG评分Agent调用，记录某企业（按企业ID）某维度的得分；fallback表示接口失败时的默认分。"""
+        store = self.score_store
+        row = self.firm_index[firm_id]._row
+        store.set(row, dimension, score)
+        self._score_table = None
+        if fallback:
+            store.fallback[row] = True
+        if self.on_firm_scored and store.is_complete(row):
+            firm = self.firm_index[firm_id]
+            self.on_firm_scored(firm, self.firm_score_record(firm))
+
+    def firm_score_record(self, firm) -> dict:
+        """计算单个企业的各维度得分、综合分与评级。"""
+        # 获取各维度得分，没有则按0计
+        sc = self.score_store.get(firm._row)
+        env_score = sc.get("env", 0.0)
+        soc_score = sc.get("soc", 0.0)
+        gov_score = sc.get("gov", 0.0)
+        # 计算综合ESG分（加权平均，可根据需要调整权重）
+        total = 0.33 * env_score + 0.33 * soc_score + 0.34 * gov_score
+        rating = map_score_to_rating(total)
+        return {
+            "env": env_score,
+            "soc": soc_score,
+            "gov": gov_score,
+            "esg_score": total,
+            "esg_rating": rating,
+            "investment_return": 1.0 + firm.investment_received / 1000.0  # 简单收益模拟
+        }
 
-    def assign_score(self, firm, dimension: str, score: float):
-        """由ESG评分Agent调用，记录某企业某维度的得分。"""
-        if firm not in self.scores:
-            self.scores[firm] = {}
-        self.scores[firm][dimension] = score
+    def get_score_table(self) -> ScoreTable:
+        """返回本轮的列式评分表（综合分、评级与投资策略判定），按需构建一次后复用。"""
+        if self._score_table is None:
+            self._score_table = ScoreTable(self.score_store, self.firms, self.current_disclosures,
+                                           self.keyword_screen)
+        return self._score_table
+
+    def get_screening_hits(self) -> dict:
+        """返回各企业的关键词命中情况 {企业ID: {策略名称: 命中关键词元组}}，用于审计筛选结果。"""
+        table = self.get_score_table()
+        return {self.firms[i].unique_id: hits for i, hits in table.screening_hits.items()}
 
     def get_firm_scores(self) -> dict:
         """
-        汇总每个企业的ESG得分，计算综合分和评级，返回结果字典。
+        汇总每个企业的ESG得分，计算综合分和评级，返回 {企业ID: 结果字典}。
         """
-        result = {}
-        for firm in self.firms:
-            # 获取各维度得分，没有则按0计
-            sc = self.scores.get(firm, {})
-            env_score = sc.get("env", 0.0)
-            soc_score = sc.get("soc", 0.0)
-            gov_score = sc.get("gov", 0.0)
-            # 计算综合ESG分（加权平均，可根据需要调整权重）
-            total = 0.33 * env_score + 0.33 * soc_score + 0.34 * gov_score
-            rating = map_score_to_rating(total)
-            result[firm] = {
-                "env": env_score,
-                "soc": soc_score,
-                "gov": gov_score,
-                "esg_score": total,
-                "esg_rating": rating,
-                "investment_return": 1.0 + firm.investment_received / 1000.0  # 简单收益模拟
+        table = self.get_score_table()
+        return {firm.unique_id: table.record(i) for i, firm in enumerate(self.firms)}
+
+    def _load_score_state(self) -> dict:
+        if not self.score_state_path or not os.path.exists(self.score_state_path):
+            return {}
+        try:
+            with open(self.score_state_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[警告] 增量评分状态读取失败（{self.score_state_path}）：{e}")
+            return {}
+
+    def _save_score_state(self):
+        if not self.score_state_path:
+            return
+        tmp_path = self.score_state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._score_state, f, ensure_ascii=False)
+        os.replace(tmp_path, self.score_state_path)
+
+    def select_disclosures_to_score(self):
+        """
+        确定本轮需要评分的披露。增量模式下比较披露指纹，未变化的企业直接沿用上次得分。
+        """
+        self.reset_selection()
+        for firm_id, disclosure in self.current_disclosures.items():
+            self.select_disclosure(firm_id, disclosure)
+
+    def reset_selection(self):
+        self.pending_disclosures = {}
+        self.rescored_firms = []
+        self.changed_sections = {}
+        self.prescored_firms = {}
+
+    def select_disclosure(self, firm_id, disclosure: str) -> bool:
+        """
+        判断单个企业的披露是否需要评分：需要时加入 pending_disclosures 并返回 True；
+        增量模式下披露指纹未变化时沿用上次得分、预评分模式下采用临时得分时返回 False（流水线模式下逐个企业调用）。
+        """
+        previous = None
+        if self.incremental:
+            key = str(firm_id)
+            fingerprint = hashlib.sha256(disclosure.encode("utf-8")).hexdigest()
+            previous = self._score_state.get(key)
+            if previous and previous["fingerprint"] == fingerprint:
+                # 披露未变化：沿用上次得分
+                for dimension, score in previous["scores"].items():
+                    self.assign_score(firm_id, dimension, score)
+                return False
+            sections = self.firm_index[firm_id].disclosure_fingerprint()
+            old_sections = previous["sections"] if previous else {}
+            self.changed_sections[firm_id] = sorted(
+                name for name in set(sections) | set(old_sections) if sections.get(name) != old_sections.get(name)
+            )
+        if self.prescore_mode and self._accept_prescore(firm_id, disclosure, previous):
+            return False
+        self.pending_disclosures[firm_id] = disclosure
+        self.rescored_firms.append(firm_id)
+        return True
+
+    def _accept_prescore(self, firm_id, disclosure: str, previous: dict = None) -> bool:
+        """
+        计算预评分；preview 模式或 triage 判定无需调用LLM时写入临时得分并返回 True。
+        披露没有实际内容但有上次的LLM得分时沿用上次得分。
+        """
+        result = self.prescorer.prescore(disclosure)
+        previous_scores = previous["scores"] if previous else None
+        if self.prescore_mode == "triage" and needs_llm(result, previous_scores):
+            metrics.inc("esg_prescore_total", outcome="llm")
+            return False
+        metrics.inc("esg_prescore_total", outcome="provisional")
+        scores = result["scores"] if result["informative"] or not previous_scores else previous_scores
+        self.prescored_firms[firm_id] = result["confidence"]
+        for dimension, score in scores.items():
+            self.assign_score(firm_id, dimension, score)
+        return True
+
+    def _update_prescorer(self):
+        """triage 模式：把本轮LLM得分（不含默认分与临时得分）加入预评分器的拟合样本。"""
+        store = self.score_store
+        samples = []
+        for firm_id, disclosure in self.current_disclosures.items():
+            row = self.firm_index[firm_id]._row
+            if firm_id in self.prescored_firms or store.fallback[row] or not store.is_complete(row):
+                continue
+            samples.append((disclosure, store.get(row)))
+        self.prescorer.observe(samples)
+
+    def _record_score_state(self):
+        """评分完成后记录新的指纹与得分；使用默认分的企业不记录，下轮重新评分。"""
+        if not self.incremental:
+            return
+        store = self.score_store
+        for firm_id, disclosure in self.pending_disclosures.items():
+            row = self.firm_index[firm_id]._row
+            if store.fallback[row]:
+                self._score_state.pop(str(firm_id), None)
+                continue
+            scores = store.get(row)
+            self._score_state[str(firm_id)] = {
+                "fingerprint": hashlib.sha256(disclosure.encode("utf-8")).hexdigest(),
+                "sections": self.firm_index[firm_id].disclosure_fingerprint(),
+                "scores": {key: scores.get(key, 0.0) for key in SCORE_KEYS},
             }
-        return result
+        self._save_score_state()
+
+    def score_disclosures(self):
+        """按评分模式对当前披露打分，并记录本阶段的调用统计。"""
+        before = get_api_stats()
+        start = time.perf_counter()
+        if self.scoring_mode == "batch":
+            self._timed("score_batch", self.batch_agent.step)
+        else:
+            for agent in (self.env_agent, self.soc_agent, self.gov_agent):
+                self._timed(f"score_{agent.dimension}", agent.step)
+        after = get_api_stats()
+        self.scoring_stats = {key: after[key] - before[key] for key in after}
+        self.scoring_stats["mode"] = self.scoring_mode
+        self.scoring_stats["firms"] = len(self.pending_disclosures)
+        self.scoring_stats["elapsed"] = time.perf_counter() - start
 
-    def step(self):
-        """运行模型一次迭代：收集披露、计算评分、执行投资决策。"""
+    def _timed(self, phase: str, fn, *args):
+        """执行 fn 并把耗时累加到 step_timings[phase]。"""
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.step_timings[phase] = self.step_timings.get(phase, 0.0) + elapsed
+            metrics.observe("esg_step_phase_seconds", elapsed, phase=phase)
+
+    def step(self, refresh: bool = False, prefetch_next: bool = False):
+        """
+        运行模型一次迭代：收集披露、计算评分、执行投资决策。
+        refresh 为 True 时清除企业披露缓存，重新抓取各数据源。
+        prefetch_next: 流水线模式下，本轮披露收集完成后即在后台预取下一轮（refresh=True）的数据源，与本轮评分重叠。
+        """
         # 重置上一轮数据
         self.current_disclosures.clear()
-        self.scores.clear()
-        # 1. 获取每个企业的披露内容
+        self.score_store.clear()
+        self.score_store.received.fill(0)  # 重置投资金额
+        self._score_table = None
+        self.step_timings = {}
+        start = time.perf_counter()
+        if self.processes > 1:
+            # 1-2. 分片模式：各工作进程收集披露并评分，结果按企业ID合并
+            from sharding import run_sharded
+            self._timed("sharded", run_sharded, self, refresh)
+        elif self.pipelined:
+            # 1-3. 流水线模式：抓取、评分与各企业的投资决策相互重叠
+            from scheduler import run_pipelined
+            self._timed("pipeline", run_pipelined, self, refresh, prefetch_next)
+            if self.prescore_mode == "triage":
+                self._timed("prescore_fit", self._update_prescorer)
+            self._timed("score_table", self.get_score_table)
+            self.step_timings["total"] = time.perf_counter() - start
+            metrics.observe("esg_step_seconds", self.step_timings["total"])
+            return
+        else:
+            # 1. 获取每个企业的披露内容
+            self._timed("disclosures", self._gather_disclosures, refresh)
+            # 2. 由各ESG维度Agent对（发生变化的）披露打分
+            self.score_collected()
+        if self.prescore_mode == "triage":
+            self._timed("prescore_fit", self._update_prescorer)
+        # 3. 投资者Agent根据评分决策投资（评分表在此构建一次，由所有投资者共享）
+        self._timed("score_table", self.get_score_table)
+        for investor in self.investors:
+            self._timed("investors", investor.step)
+        self.step_timings["total"] = time.perf_counter() - start
+        metrics.observe("esg_step_seconds", self.step_timings["total"])
+
+    def score_collected(self):
+        """对已提交的披露执行增量筛选、评分并记录评分状态（分片模式下由工作进程调用）。"""
+        self._timed("select", self.select_disclosures_to_score)
+        self.score_disclosures()
+        self._timed("record_state", self._record_score_state)
+
+    def close(self):
+        """释放分片模式的进程池与评分线程池（共享的评分调度器由其创建者关闭）。"""
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=True)
+            self._process_pool = None
+        if self._prefetch_executor is not None:
+            self._prefetch_executor.shutdown(wait=True, cancel_futures=True)
+            self._prefetch_executor = None
+            self._next_sources = {}
+        if self._owns_engine:
+            self.scoring_engine.shutdown()
+
+    def prefetch_shared(self, firms):
+        """需要重新抓取的企业先批量预取维基百科摘要与共享背景数据，逐个企业抓取时直接使用。"""
+        if firms:
+            self._timed("wiki_prefetch", prefetch_summaries, [firm.firm_name for firm in firms])
+            self._timed("context_prefetch", self.prefetch_context, firms)
+
+    def prefetch_context(self, firms):
+        """
+        预处理：收集各企业的不同国家与城市，每个 (国家, 指标) 与城市只请求一次（世界银行指标合并为批量请求），
+        结果存入 self.context，由各 FirmAgent 共用。
+        """
+        self.context = fetch_shared_context([firm.country_code for firm in firms], [firm.city for firm in firms],
+                                            FirmAgent.WORLD_BANK_INDICATORS)
+
+    def _gather_disclosures(self, refresh: bool):
+        for firm in self.firms:
+            if refresh:
+                firm.invalidate_disclosure()
+        self.prefetch_shared([firm for firm in self.firms if not firm._cached_disclosure])
         for firm in self.firms:
-            firm.investment_received = 0  # 重置投资金额
             firm.step()  # 会调用submit_disclosure提交披露文本
-        # 2. 由各ESG维度Agent对披露打分
-        self.env_agent.step()
-        self.soc_agent.step()
-        self.gov_agent.step()
-        # 3. 投资者Agent根据评分决策投资
-        for investor in self.investors:
-            investor.step()
\ No newline at end of file
@@ -0,0 +1,243 @@
+import os
+import json
+import math
+import hashlib
+import threading
+
+import numpy as np
+
+import metrics
+from cache import CACHE_DIR
+from disclosure import is_placeholder
+from keyword_screen import AhoCorasick
+from utils import estimate_tokens
+
+# 本地预评分：按ESG词表统计披露中各维度的正面/负面信号，立即给出临时得分与置信度，不调用LLM。
+# 积累了LLM评分之后，可用最小二乘拟合词表特征到LLM得分的线性映射，拟合误差越小置信度越高。
+# triage 模式下只有置信度低、与上次得分差异大的企业才调用LLM；preview 模式下全部使用临时得分。
+
+PRESCORE_MODES = ("triage", "preview")
+SCORE_KEYS = ("env", "soc", "gov")
+
+# 各维度的正面/负面信号词（中英文，英文不区分大小写）
+LEXICON = {
+    "env": {
+        "positive": ["可再生能源", "清洁能源", "碳中和", "减排", "节能", "循环经济", "绿色", "光伏", "风电", "环保",
+                     "renewable", "clean energy", "carbon neutral", "net zero", "emission reduction", "recycling",
+                     "energy efficiency", "solar", "wind power"],
+        "negative": ["环境污染", "污染", "高碳排放", "排放超标", "泄漏", "生态破坏", "煤炭",
+                     "pollution", "spill", "contamination", "coal", "deforestation", "toxic waste"],
+    },
+    "soc": {
+        "positive": ["员工培训", "员工福利", "安全生产", "公益", "慈善", "乡村振兴", "教育普惠", "多元化", "社区",
+                     "employee training", "diversity", "inclusion", "community", "philanthropy", "health and safety"],
+        "negative": ["强迫劳动", "童工", "安全事故", "伤亡", "歧视", "罢工", "裁员", "产品召回",
+                     "forced labor", "child labor", "fatality", "discrimination", "strike", "layoff", "recall"],
+    },
+    "gov": {
+        "positive": ["独立董事", "内部控制", "审计委员会", "合规", "信息披露", "透明", "股东权益",
+                     "independent director", "audit committee", "internal control", "compliance", "transparency"],
+        "negative": ["贿赂", "腐败", "欺诈", "违规", "处罚", "财务造假", "内幕交易", "道德风险",
+                     "bribery", "corruption", "fraud", "misconduct", "insider trading", "restatement", "sanction"],
+    },
+}
+# 基础披露模板中的句子（FirmAgent.fetch_base_disclosure），不含企业的实际信息
+BOILERPLATE_MARKERS = ("的最新ESG披露概况",)
+# 去掉模板句与占位句后至少保留这么多token，才认为披露含有实际信息
+MIN_CONTENT_TOKENS = 8
+# 词表得分：50 ± LEXICON_SPAN，净信号数为 LEXICON_SCALE 时约达到跨度的76%
+LEXICON_SPAN = 40.0
+LEXICON_SCALE = 3.0
+# 置信度 = 信号强度 × 模型质量；信号强度在 0.5（没有信号词）到 1 之间，命中 SIGNAL_HALF 个信号词时为0.75
+SIGNAL_HALF = 2.0
+# 仅用词表（未拟合）时的模型质量；拟合后为 1 - 均方根误差 / RMSE_SCALE
+LEXICON_QUALITY = 0.5
+RMSE_SCALE = 25.0
+# 拟合所需的最少样本数、样本上限与岭回归正则系数
+MIN_FIT_SAMPLES = 30
+MAX_SAMPLES = 5000
+RIDGE = 1.0
+# triage：置信度低于阈值、或临时得分与上次得分相差超过阈值时调用LLM
+CONFIDENCE_THRESHOLD = float(os.getenv("ESG_PRESCORE_CONFIDENCE", 0.7))
+CHANGE_THRESHOLD = float(os.getenv("ESG_PRESCORE_CHANGE", 15.0))
+# 拟合参数与样本的持久化文件
+PRESCORE_MODEL_PATH = os.getenv("ESG_PRESCORE_MODEL", os.path.join(CACHE_DIR, "prescore.json"))
+
+_prescorer = None
+_prescorer_lock = threading.Lock()
+
+
+def get_prescorer():
+    """首次使用时创建全局预评分器（读取已保存的拟合参数）。"""
+    global _prescorer
+    with _prescorer_lock:
+        if _prescorer is None:
+            _prescorer = PreScorer(path=PRESCORE_MODEL_PATH)
+        return _prescorer
+
+
+class PreScorer:
+    """
+    词表预评分器：一个 Aho–Corasick 自动机扫描披露一次，统计各维度正面/负面信号词的个数作为特征。
+    特征向量为 [1, 各维度正面数, 各维度负面数, log(1+有效token数)]；拟合后每个维度一组线性权重。
+    """
+    def __init__(self, lexicon: dict = None, path: str = None):
+        self.lexicon = lexicon or LEXICON
+        self.path = path
+        # 特征列：("env", "positive"), ("env", "negative"), ...
+        self.columns = [(key, polarity) for key in SCORE_KEYS for polarity in ("positive", "negative")]
+        terms = [term for key, polarity in self.columns for term in self.lexicon[key][polarity]]
+        self._automaton = AhoCorasick(terms)
+        index = {term: i for i, term in enumerate(self._automaton.patterns)}
+        # 模式下标 -> 所属特征列（同一词可属于多个列）
+        self._pattern_columns = [[] for _ in self._automaton.patterns]
+        for column, (key, polarity) in enumerate(self.columns):
+            for term in dict.fromkeys(self.lexicon[key][polarity]):
+                self._pattern_columns[index[term]].append(column)
+        self.weights = None   # (特征数, 3) 的拟合权重，未拟合时为 None
+        self.rmse = None      # 各维度的拟合误差
+        self._samples = {}    # 披露哈希 -> (特征, 得分)
+        self._lock = threading.Lock()
+        if path:
+            self._load()
+
+    def features(self, text: str) -> tuple:
+        """返回 (特征向量, 有效token数)；有效内容不含模板句与占位句。"""
+        content = "\n".join(line for line in (text or "").splitlines()
+                            if line.strip() and not is_placeholder(line)
+                            and not any(marker in line for marker in BOILERPLATE_MARKERS))
+        counts = np.zeros(len(self.columns))
+        for i in self._automaton.find(content):
+            for column in self._pattern_columns[i]:
+                counts[column] += 1
+        tokens = estimate_tokens(content)
+        return np.concatenate(([1.0], counts, [math.log1p(tokens)])), tokens
+
+    def prescore(self, text: str) -> dict:
+        """
+        返回 {"scores": {"env", "soc", "gov"}, "confidence", "informative", "signals", "fitted"}。
+        informative 为 False 表示去掉模板句与占位句后没有实际内容（数据源均未取到），此时置信度为0，
+        LLM 同样只能猜测，得分为词表中性分（或拟合的截距）。
+        """
+        x, tokens = self.features(text)
+        counts = x[1:-1]
+        with self._lock:
+            weights, rmse = self.weights, self.rmse
+        if weights is not None:
+            values = np.clip(x @ weights, 0.0, 100.0)
+            quality = max(0.0, 1.0 - float(np.mean(rmse)) / RMSE_SCALE)
+        else:
+            net = counts[0::2] - counts[1::2]
+            values = 50.0 + LEXICON_SPAN * np.tanh(net / LEXICON_SCALE)
+            quality = LEXICON_QUALITY
+        signals = int(counts.sum())
+        informative = tokens >= MIN_CONTENT_TOKENS
+        strength = 0.5 + 0.5 * signals / (signals + SIGNAL_HALF)
+        confidence = strength * quality if informative else 0.0
+        return {
+            "scores": {key: round(float(v), 2) for key, v in zip(SCORE_KEYS, values)},
+            "confidence": round(confidence, 3),
+            "informative": informative,
+            "signals": signals,
+            "fitted": weights is not None,
+        }
+
+    def observe(self, samples) -> bool:
+        """
+        记录LLM评分样本 [(披露, {"env", "soc", "gov"}), ...]（同一披露只保留最新得分），
+        有新样本且样本数达到 MIN_FIT_SAMPLES 时重新拟合并保存。返回是否重新拟合。
+        """
+        added = 0
+        with self._lock:
+            for text, scores in samples:
+                key = hashlib.sha1(text.encode("utf-8")).hexdigest()
+                y = [scores[k] for k in SCORE_KEYS]
+                if self._samples.get(key, (None, None))[1] == y:
+                    continue
+                self._samples.pop(key, None)
+                self._samples[key] = (self.features(text)[0].tolist(), y)
+                added += 1
+            while len(self._samples) > MAX_SAMPLES:
+                self._samples.pop(next(iter(self._samples)))
+            if not added or len(self._samples) < MIN_FIT_SAMPLES:
+                return False
+            self._fit()
+        self.save()
+        metrics.inc("esg_prescore_fits_total")
+        return True
+
+    def _fit(self):
+        # 岭回归（截距不加正则）：(XᵀX + λI) W = XᵀY，误差按自由度修正
+        X = np.array([x for x, _ in self._samples.values()])
+        Y = np.array([y for _, y in self._samples.values()])
+        penalty = RIDGE * np.eye(X.shape[1])
+        penalty[0, 0] = 0.0
+        weights = np.linalg.solve(X.T @ X + penalty, X.T @ Y)
+        residual = Y - np.clip(X @ weights, 0.0, 100.0)
+        dof = max(1, len(X) - X.shape[1])
+        self.weights = weights
+        self.rmse = np.sqrt((residual ** 2).sum(axis=0) / dof)
+
+    def fitted_state(self) -> dict:
+        """当前的拟合参数（可序列化），用于分片模式把主进程的拟合结果传给工作进程。"""
+        with self._lock:
+            return {
+                "weights": self.weights.tolist() if self.weights is not None else None,
+                "rmse": self.rmse.tolist() if self.rmse is not None else None,
+            }
+
+    def set_fitted_state(self, state: dict):
+        with self._lock:
+            if state.get("weights") is None:
+                self.weights = self.rmse = None
+            else:
+                self.weights = np.array(state["weights"])
+                self.rmse = np.array(state["rmse"])
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            state = {
+                "columns": [f"{key}:{polarity}" for key, polarity in self.columns],
+                "weights": self.weights.tolist() if self.weights is not None else None,
+                "rmse": self.rmse.tolist() if self.rmse is not None else None,
+                "samples": [[key, x, y] for key, (x, y) in self._samples.items()],
+            }
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[警告] 预评分模型读取失败（{self.path}）：{e}")
+            return
+        if state.get("columns") != [f"{key}:{polarity}" for key, polarity in self.columns]:
+            # 词表结构已变化，旧的权重与特征不再适用
+            return
+        self._samples = {key: (x, y) for key, x, y in state.get("samples", [])}
+        if state.get("weights") is not None:
+            self.weights = np.array(state["weights"])
+            self.rmse = np.array(state["rmse"])
+
+
+def needs_llm(result: dict, previous_scores: dict = None) -> bool:
+    """
+    triage 判定：没有实际内容的披露不调用LLM（只能猜测）；否则置信度低于 CONFIDENCE_THRESHOLD、
+    或临时得分与上次LLM得分的差异超过 CHANGE_THRESHOLD 时调用LLM。
+    """
+    if not result["informative"]:
+        return False
+    if result["confidence"] < CONFIDENCE_THRESHOLD:
+        return True
+    if previous_scores:
+        return any(abs(result["scores"][key] - previous_scores.get(key, 50.0)) > CHANGE_THRESHOLD
+                   for key in SCORE_KEYS)
+    return False
@@ -0,0 +1,295 @@
+import os
+import json
+import time
+import base64
+import random
+import threading
+from urllib.parse import urlencode
+
+from cache import CACHE_DIR, DiskCache, make_key
+
+# 外部接口的录制/回放：
+#   off     直接访问真实接口（默认）
+#   record  访问真实接口，并把响应写入夹具库
+#   replay  只从夹具库读取响应，不访问网络；可注入延迟、错误与限流
+MODES = ("off", "record", "replay")
+FIXTURE_PATH = os.getenv("ESG_FIXTURE_PATH", os.path.join(CACHE_DIR, "fixtures.sqlite3"))
+# 提供 install(replay, seed) 的合成数据源模块名，首次查找夹具时自动安装；
+# 经环境变量传递，分片模式的工作进程也能使用同样的合成数据源
+SYNTHESIZER_MODULE = os.getenv("ESG_REPLAY_SYNTHESIZERS")
+
+
+class ReplayError(Exception):
+    """回放模式下没有对应夹具，或注入的接口错误。"""
+
+
+class RateLimitError(ReplayError):
+    """注入的限流错误（与 openai.RateLimitError 同名，可被 scoring.is_rate_limit_error 识别）。"""
+    status_code = 429
+
+
+def parse_latency(text: str) -> dict:
+    """解析延迟配置："0.05" 或 "llm=0.8,http=0.05,default=0.02"（秒）。"""
+    latency = {}
+    for part in filter(None, (p.strip() for p in (text or "").split(","))):
+        kind, _, value = part.rpartition("=")
+        latency[kind or "default"] = float(value)
+    return latency
+
+
+class ReplayConfig:
+    """回放参数：延迟为各类接口的平均延迟（秒），error_rate / rate_limit_rate 为每次调用的注入概率。"""
+    def __init__(self, mode: str = "off", path: str = FIXTURE_PATH, latency: dict = None,
+                 error_rate: float = 0.0, rate_limit_rate: float = 0.0, seed: int = 0):
+        if mode not in MODES:
+            raise ValueError(f"未知的回放模式：{mode}，可选：{MODES}")
+        self.mode = mode
+        self.path = path
+        self.latency = dict(latency or {})
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.seed = seed
+
+    @classmethod
+    def from_env(cls):
+        return cls(mode=os.getenv("ESG_REPLAY_MODE", "off"),
+                   latency=parse_latency(os.getenv("ESG_REPLAY_LATENCY", "")),
+                   error_rate=float(os.getenv("ESG_REPLAY_ERROR_RATE", 0)),
+                   rate_limit_rate=float(os.getenv("ESG_REPLAY_RATE_LIMIT", 0)),
+                   seed=int(os.getenv("ESG_REPLAY_SEED", 0)))
+
+
+_config = ReplayConfig.from_env()
+_store = None
+_session = None
+_lock = threading.Lock()
+# 各夹具键被调用的次数：注入结果由 (seed, 类型, 键, 次数) 决定，与线程调度顺序无关
+_call_counts = {}
+# 夹具缺失时的合成函数 {类型: fn(key) -> 夹具值}，供基准测试生成任意规模的模拟数据
+_synthesizers = {}
+_synthesizers_installed = False
+_stats = {"served": 0, "recorded": 0, "missing": 0, "synthesized": 0, "errors": 0, "rate_limited": 0}
+
+
+def configure(mode: str = None, path: str = None, latency: dict = None, error_rate: float = None,
+              rate_limit_rate: float = None, seed: int = None) -> ReplayConfig:
+    """在代码中修改回放参数（未提供的参数保持不变），并重置调用计数与统计。"""
+    global _config, _store, _session
+    with _lock:
+        old = _config
+        _config = ReplayConfig(
+            mode=old.mode if mode is None else mode,
+            path=old.path if path is None else path,
+            latency=old.latency if latency is None else latency,
+            error_rate=old.error_rate if error_rate is None else error_rate,
+            rate_limit_rate=old.rate_limit_rate if rate_limit_rate is None else rate_limit_rate,
+            seed=old.seed if seed is None else seed,
+        )
+        if _config.path != old.path:
+            _store = None
+        _session = None
+        _call_counts.clear()
+        for key in _stats:
+            _stats[key] = 0
+    return _config
+
+
+def enabled() -> bool:
+    return _config.mode != "off"
+
+
+def register_synthesizer(kind: str, fn):
+    """回放模式下夹具缺失时，改由 fn(key) 生成该类接口的响应（fn 为 None 时取消）。"""
+    with _lock:
+        if fn is None:
+            _synthesizers.pop(kind, None)
+        else:
+            _synthesizers[kind] = fn
+
+
+def replay_stats() -> dict:
+    """返回回放统计：命中夹具、录制、缺失、合成以及注入的错误与限流次数。"""
+    with _lock:
+        return dict(_stats)
+
+
+def get_store() -> DiskCache:
+    global _store
+    with _lock:
+        if _store is None:
+            _store = DiskCache(_config.path, ttl=None, max_entries=None)
+        return _store
+
+
+def _count(name: str):
+    with _lock:
+        _stats[name] += 1
+
+
+def _inject(kind: str, digest: str):
+    """回放模式：按配置模拟延迟，并返回需要注入的故障（None、"error" 或 "rate_limit"）。"""
+    config = _config
+    with _lock:
+        n = _call_counts[digest] = _call_counts.get(digest, 0) + 1
+    rng = random.Random(f"{config.seed}|{digest}|{n}")
+    mean = config.latency.get(kind, config.latency.get("default", 0.0))
+    if mean > 0:
+        time.sleep(mean * rng.uniform(0.5, 1.5))
+    roll = rng.random()
+    if roll < config.rate_limit_rate:
+        _count("rate_limited")
+        return "rate_limit"
+    if roll < config.rate_limit_rate + config.error_rate:
+        _count("errors")
+        return "error"
+    return None
+
+
+def _describe(key) -> str:
+    text = str(key)
+    return text if len(text) <= 80 else text[:77] + "..."
+
+
+def _install_env_synthesizers():
+    global _synthesizers_installed
+    with _lock:
+        if _synthesizers_installed:
+            return
+        _synthesizers_installed = True
+    import sys
+    import importlib
+    importlib.import_module(SYNTHESIZER_MODULE).install(sys.modules[__name__], _config.seed)
+
+
+def _lookup(kind: str, key, digest: str):
+    fixture = get_store().get(digest)
+    if fixture is not None:
+        _count("served")
+        return fixture
+    if SYNTHESIZER_MODULE and not _synthesizers_installed:
+        _install_env_synthesizers()
+    synthesize = _synthesizers.get(kind)
+    if synthesize is None:
+        _count("missing")
+        raise ReplayError(f"缺少回放夹具：{kind} {_describe(key)}")
+    _count("synthesized")
+    return {"value": synthesize(key)}
+
+
+def _unwrap(fixture: dict):
+    if "error" in fixture:
+        raise ReplayError(fixture["error"])
+    return fixture["value"]
+
+
+def intercept(kind: str, key, fn):
+    """
+    外部调用的录制/回放入口：off 模式直接返回 fn()；record 模式调用 fn 并把结果（或异常信息）写入夹具库；
+    replay 模式不调用 fn，直接返回夹具中的结果。结果需可JSON序列化。
+    """
+    mode = _config.mode
+    if mode == "off":
+        return fn()
+    digest = make_key("replay", kind, key)
+    if mode == "record":
+        try:
+            value = fn()
+        except Exception as e:
+            get_store().set(digest, {"error": f"{type(e).__name__}: {e}"})
+            _count("recorded")
+            raise
+        get_store().set(digest, {"value": value})
+        _count("recorded")
+        return value
+    fault = _inject(kind, digest)
+    if fault == "rate_limit":
+        raise RateLimitError(f"注入的限流错误：{kind} {_describe(key)}")
+    if fault == "error":
+        raise ReplayError(f"注入的接口错误：{kind} {_describe(key)}")
+    return _unwrap(_lookup(kind, key, digest))
+
+
+class ReplayResponse:
+    """回放的HTTP响应，提供调用方用到的 requests.Response 接口子集。"""
+    def __init__(self, status_code: int, content: bytes, headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = dict(headers or {})
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def iter_content(self, chunk_size: int = 1):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _encode_response(resp) -> dict:
+    # 正文已解压，去掉与原始传输相关的头信息
+    headers = {k: v for k, v in resp.headers.items()
+               if k.lower() not in ("content-encoding", "transfer-encoding", "content-length")}
+    return {"status": resp.status_code, "headers": headers,
+            "body": base64.b64encode(resp.content).decode("ascii")}
+
+
+def _decode_response(value: dict) -> ReplayResponse:
+    if "json" in value:
+        content = json.dumps(value["json"], ensure_ascii=False).encode("utf-8")
+    else:
+        content = base64.b64decode(value.get("body", ""))
+    return ReplayResponse(value.get("status", 200), content, value.get("headers"))
+
+
+class ReplaySession:
+    """
+    替代共享 requests.Session 的录制/回放传输层：以 URL+查询参数 为夹具键。
+    record 模式经真实会话发出请求；replay 模式不导入 requests，也不访问网络。
+    夹具或合成函数可用 {"status", "json"} 代替 base64 正文。
+    """
+    def __init__(self, real_session_factory):
+        self._factory = real_session_factory
+        self._real = None
+
+    def get(self, url: str, params=None, headers=None, timeout: float = None, stream: bool = False):
+        key = url + ("?" + urlencode(sorted((params or {}).items())) if params else "")
+        if _config.mode == "record":
+            if self._real is None:
+                self._real = self._factory()
+
+            def fetch():
+                resp = self._real.get(url, params=params, headers=headers, timeout=timeout)
+                return _encode_response(resp)
+            return _decode_response(intercept("http", key, fetch))
+        digest = make_key("replay", "http", key)
+        fault = _inject("http", digest)
+        if fault == "rate_limit":
+            return ReplayResponse(429, b"", {"Retry-After": "1"})
+        if fault == "error":
+            return ReplayResponse(503, b"")
+        try:
+            return _decode_response(_unwrap(_lookup("http", key, digest)))
+        except ReplayError as e:
+            # 与离线时的网络异常一致，由各数据源按获取失败处理
+            raise ConnectionError(str(e))
+
+
+def get_session(real_session_factory) -> ReplaySession:
+    """http_client.get_session 在录制/回放模式下返回的共享会话。"""
+    global _session
+    with _lock:
+        if _session is None:
+            _session = ReplaySession(real_session_factory)
+        return _session
@@ -0,0 +1,149 @@
+import os
+import csv
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import CACHE_DIR, DiskCache
+from http_client import cached_get
+from sec_facts import format_cik
+from tools import prime_yahoo_quote, yahoo_info
+
+# 名称/代码解析结果的持久化缓存时间（秒），公司名称与注册地很少变化
+RESOLVER_TTL = float(os.getenv("ESG_RESOLVER_TTL", 30 * 24 * 3600))
+# Yahoo财经查不到的代码（.info 为空或没有名称）作为未命中缓存的时间（秒），过期后重新查询
+RESOLVER_NEGATIVE_TTL = float(os.getenv("ESG_RESOLVER_NEGATIVE_TTL", 3600))
+# 可选的SEC ticker→CIK映射文件（SEC 发布的 company_tickers.json 或 ticker,cik 两列CSV）
+SEC_TICKERS_FILE = os.getenv("SEC_TICKERS_FILE")
+
+_index = None
+_index_lock = threading.Lock()
+_sec_map = None
+_sec_map_path = None
+_sec_map_lock = threading.Lock()
+
+
+def _get_index() -> DiskCache:
+    """首次使用时打开解析索引。"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = DiskCache(os.path.join(CACHE_DIR, "resolver.sqlite3"), ttl=RESOLVER_TTL, max_entries=200000)
+        return _index
+
+
+def load_sec_ticker_map(path: str = None) -> dict:
+    """
+    读取SEC ticker→CIK映射文件，返回 {TICKER: "CIK##########"}。
+    支持 company_tickers.json、company_tickers_exchange.json 以及 ticker,cik 两列CSV。
+    未指定路径时使用环境变量 SEC_TICKERS_FILE，均未提供时返回空字典。
+    """
+    global _sec_map, _sec_map_path
+    with _sec_map_lock:
+        path = path or _sec_map_path or SEC_TICKERS_FILE
+        if _sec_map is not None and path == _sec_map_path:
+            return _sec_map
+        mapping = {}
+        if path:
+            try:
+                with open(path, encoding="utf-8") as f:
+                    if path.lower().endswith(".csv"):
+                        for row in csv.DictReader(f):
+                            row = {k.strip().lower(): v for k, v in row.items() if k}
+                            if row.get("ticker") and row.get("cik"):
+                                mapping[row["ticker"].strip().upper()] = format_cik(row["cik"])
+                    else:
+                        data = json.load(f)
+                        if "fields" in data and "data" in data:
+                            fields = data["fields"]
+                            for values in data["data"]:
+                                entry = dict(zip(fields, values))
+                                mapping[str(entry["ticker"]).upper()] = format_cik(entry["cik"])
+                        else:
+                            for entry in data.values():
+                                mapping[str(entry["ticker"]).upper()] = format_cik(entry["cik_str"])
+            except (OSError, ValueError, KeyError) as e:
+                print(f"[警告] SEC ticker→CIK映射文件读取失败（{path}）：{e}")
+        _sec_map, _sec_map_path = mapping, path
+        return mapping
+
+
+def _lookup_ticker(term: str):
+    """
+    输入为股票代码：通过Yahoo财经 .info 获取全称与注册地，并预填行情缓存。
+    最后一项为查询状态："ok"、"missing"（.info 为空或没有名称）或 "failed"（网络失败）。
+    """
+    ticker = term
+    try:
+        info = yahoo_info(ticker)
+    except Exception:
+        return term, ticker, None, None, "failed"
+    name = (info or {}).get("longName") or (info or {}).get("shortName")
+    if not name:
+        return term, ticker, None, None, "missing"
+    # 同一份 .info 中已包含股价与市盈率，供后续 yahoo_finance 直接复用
+    prime_yahoo_quote(ticker, info)
+    return name, ticker, info.get("city"), info.get("country"), "ok"
+
+
+def _lookup_name(term: str):
+    """输入为公司名称：利用Yahoo财经搜索API查找股票代码。"""
+    name = term
+    try:
+        resp = cached_get("https://query2.finance.yahoo.com/v1/finance/search", params={"q": term}, timeout=5, ttl=0)
+        data = resp.json()
+        # 提取第一个搜索结果的股票代码和名称
+        quotes = data.get("quotes")
+        if quotes:
+            ticker = quotes[0].get("symbol")
+            # 如果搜索结果有正式名称，使用它
+            if quotes[0].get("shortname"):
+                name = quotes[0]["shortname"]
+            elif quotes[0].get("longname"):
+                name = quotes[0]["longname"]
+        else:
+            ticker = term  # 未找到则直接用名称当作ticker尝试
+    except Exception:
+        return name, term, None, None, "failed"
+    return name, ticker, None, None, "ok"
+
+
+def resolve_company(term: str):
+    """
+    根据用户输入的名称或代码，推断股票代码和公司正式名称。
+    返回元组 (name, ticker, city, country, cik)；结果写入持久化索引，TTL内不再请求网络。
+    """
+    term = term.strip()
+    # 简单判断输入类型
+    is_ticker = term.isupper() and 1 <= len(term) <= 5  # 全大写且长度较短，视为股票代码
+    index = _get_index()
+    key = ("ticker:" if is_ticker else "name:") + term
+    cached = index.get(key)
+    if isinstance(cached, dict) and time.time() - cached["checked"] > RESOLVER_NEGATIVE_TTL:
+        cached = None
+    if isinstance(cached, dict):
+        # 未过期的未命中：按查询失败处理，不再请求网络
+        name, ticker, city, country, cik = term, term, None, None, None
+    elif cached is not None:
+        name, ticker, city, country, cik = cached
+    else:
+        name, ticker, city, country, status = _lookup_ticker(term) if is_ticker else _lookup_name(term)
+        cik = None
+        # 网络失败的结果不写入索引，下次再试；查不到的代码只短期缓存
+        if status == "ok":
+            index.set(key, [name, ticker, city, country, cik])
+        elif status == "missing":
+            index.set(key, {"checked": time.time()})
+    # CIK 由SEC映射文件补全，不再固定为None
+    cik = cik or load_sec_ticker_map().get((ticker or "").upper())
+    return name, ticker, city, country, cik
+
+
+def resolve_companies(terms, max_workers: int = 8) -> dict:
+    """批量解析多个名称/代码（去重后并发），返回 {去除首尾空白的输入: (name, ticker, city, country, cik)}。"""
+    unique = list(dict.fromkeys(term.strip() for term in terms if term and term.strip()))
+    if not unique:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(unique))) as executor:
+        return dict(zip(unique, executor.map(resolve_company, unique)))
@@ -0,0 +1,171 @@
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import metrics
+from deepseek_api import estimate_request_tokens, request_esg_score, query_esg_scores_batch, get_api_stats
+from score_table import decide_row
+
+# 流水线调度：分阶段模式要等全部企业抓取完才开始评分、全部评分完才开始投资决策。
+# 流水线模式下某企业的披露就绪后立即提交三个维度（或批量）评分，三个维度并发；
+# 某企业评分完成后立即执行该企业的投资决策。多期模拟时，本轮披露全部收集完成后
+# 即在后台推测性地预取下一轮的数据源，与本轮的LLM评分重叠；下一轮刷新时直接使用。
+
+# 同时抓取披露的企业数（每个企业内部的数据源另有各自的并发）
+FETCH_WORKERS = 16
+# 推测预取结果的最长有效期（秒），超过后丢弃并重新抓取
+PREFETCH_MAX_AGE = 120.0
+SCORE_DIMENSIONS = {"environment": "env", "society": "soc", "governance": "gov"}
+
+
+def _refresh_shared(model):
+    """预取下一轮的维基百科摘要与共享背景数据（在后台线程中执行，不计入本轮耗时）。"""
+    from wiki import prefetch_summaries
+    try:
+        prefetch_summaries([firm.firm_name for firm in model.firms])
+        model.prefetch_context(model.firms)
+    except Exception as e:
+        print(f"[警告] 预取下一轮共享背景数据失败：{e}")
+
+
+def _fetch_after(shared, firm) -> dict:
+    # 共享背景数据就绪后再抓取企业的各数据源，使其直接使用新的背景数据
+    wait([shared])
+    return firm.fetch_sources()
+
+
+def prefetch_next_sources(model):
+    """推测性地在后台抓取下一轮（刷新）各企业的数据源，结果存入 model._next_sources。"""
+    if model._prefetch_executor is None:
+        model._prefetch_executor = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix="prefetch")
+    executor = model._prefetch_executor
+    submitted = time.monotonic()
+    shared = executor.submit(_refresh_shared, model)
+    model._next_sources = {firm.unique_id: (submitted, executor.submit(_fetch_after, shared, firm))
+                           for firm in model.firms}
+    metrics.inc("esg_prefetch_total", len(model.firms), outcome="submitted")
+
+
+def _take_prefetched(model) -> dict:
+    """
+    取出上一轮推测预取的数据源 {企业ID: Future}。预取已过期或未覆盖全部企业时全部丢弃，
+    以免与本轮重新预取的共享背景数据混用。
+    """
+    prefetched, model._next_sources = model._next_sources, {}
+    if not prefetched:
+        return {}
+    now = time.monotonic()
+    if len(prefetched) != len(model.firms) or any(now - ts > PREFETCH_MAX_AGE for ts, _ in prefetched.values()):
+        for _, future in prefetched.values():
+            future.cancel()
+        metrics.inc("esg_prefetch_total", len(prefetched), outcome="discarded")
+        return {}
+    metrics.inc("esg_prefetch_total", len(prefetched), outcome="used")
+    return {firm_id: future for firm_id, (_, future) in prefetched.items()}
+
+
+def _disclosure_from(firm, sources) -> str:
+    return firm.restore_disclosure({"base": firm.fetch_base_disclosure(), **sources.result()})
+
+
+def run_pipelined(model, refresh: bool = False, prefetch_next: bool = False):
+    """
+    以流水线方式完成一轮的披露收集、评分与投资决策（由 ESGModel.step 在 pipelined 模式下调用）。
+    结果与分阶段模式一致：评分写入 score_store，增量评分状态与 scoring_stats 同样更新；
+    step_timings 中 disclosures 为最后一个企业披露就绪的时间（与评分重叠），pipeline 为整轮耗时。
+    """
+    start = time.perf_counter()
+    before = get_api_stats()
+    engine = model.scoring_engine
+    model.reset_selection()
+
+    prefetched = {}
+    if refresh:
+        prefetched = _take_prefetched(model)
+        for firm in model.firms:
+            firm.invalidate_disclosure()
+    else:
+        # 不刷新时上一轮的推测预取用不上
+        for _, future in model._next_sources.values():
+            future.cancel()
+        model._next_sources = {}
+    if not prefetched:
+        model.prefetch_shared([firm for firm in model.firms if not firm._cached_disclosure])
+
+    # 进行中的任务：Future -> (类型, 企业, 附加信息)
+    pending = {}
+    fetch_executor = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix="fetch")
+    for firm in model.firms:
+        if firm._cached_disclosure:
+            future = Future()
+            future.set_result(firm._cached_disclosure)
+        elif firm.unique_id in prefetched:
+            future = fetch_executor.submit(_disclosure_from, firm, prefetched[firm.unique_id])
+        else:
+            future = fetch_executor.submit(firm.generate_disclosure)
+        pending[future] = ("disclosure", firm, None)
+    fetching = len(model.firms)
+    fetch_executor.shutdown(wait=False)
+
+    def score(firm, disclosure):
+        tokens = estimate_request_tokens(disclosure)
+        if model.scoring_mode == "batch":
+            future = engine.submit(query_esg_scores_batch, disclosure, tuple(SCORE_DIMENSIONS), tokens=tokens)
+            pending[future] = ("batch", firm, disclosure)
+            return
+        for dimension in SCORE_DIMENSIONS:
+            future = engine.submit(request_esg_score, disclosure, dimension, tokens=tokens)
+            pending[future] = ("score", firm, dimension)
+
+    def invest(firm):
+        hits = model.keyword_screen.screen(firm.screening_text(model.current_disclosures[firm.unique_id]))
+        strategy = decide_row(model.score_store, firm._row, hits)
+        for investor in model.investors:
+            investor.invest(firm, strategy, hits)
+
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            kind, firm, extra = pending.pop(future)
+            if kind == "disclosure":
+                fetching -= 1
+                disclosure = future.result()
+                model.submit_disclosure(firm, disclosure)
+                if model.select_disclosure(firm.unique_id, disclosure):
+                    score(firm, disclosure)
+                else:
+                    # 增量模式下披露未变化，已沿用上次得分
+                    invest(firm)
+                if fetching == 0:
+                    model.step_timings["disclosures"] = time.perf_counter() - start
+                    if prefetch_next:
+                        prefetch_next_sources(model)
+            elif kind == "batch":
+                try:
+                    scores = future.result()
+                except Exception as e:
+                    print(f"[警告] 批量ESG评分失败，回退到逐维度评分：{e}")
+                    metrics.inc("esg_batch_fallbacks_total")
+                    tokens = estimate_request_tokens(extra)
+                    for dimension in SCORE_DIMENSIONS:
+                        retry = engine.submit(request_esg_score, extra, dimension, tokens=tokens)
+                        pending[retry] = ("score", firm, dimension)
+                    continue
+                for dimension, score_key in SCORE_DIMENSIONS.items():
+                    model.assign_score(firm.unique_id, score_key, scores[dimension])
+                invest(firm)
+            else:
+                error = future.exception()
+                value = future.result() if error is None else 50.0  # 出现异常时给一个中等默认分
+                if error is not None:
+                    print(f"[警告] ESG评分接口异常(维度: {extra}):{error}")
+                    metrics.inc("esg_score_fallbacks_total", dimension=extra)
+                model.assign_score(firm.unique_id, SCORE_DIMENSIONS[extra], value, fallback=error is not None)
+                if model.score_store.is_complete(firm._row):
+                    invest(firm)
+
+    model._timed("record_state", model._record_score_state)
+    after = get_api_stats()
+    model.scoring_stats = {key: after[key] - before[key] for key in after}
+    model.scoring_stats["mode"] = model.scoring_mode
+    model.scoring_stats["firms"] = len(model.pending_disclosures)
+    model.scoring_stats["elapsed"] = time.perf_counter() - start
@@ -0,0 +1,173 @@
+import numpy as np
+
+from utils import RATING_LABELS, RATING_THRESHOLDS
+
+# 综合ESG分权重（环境、社会、治理）
+COMPOSITE_WEIGHTS = np.array([0.33, 0.33, 0.34])
+# ESG整合策略权重（环境、社会、治理）
+INTEGRATION_WEIGHTS = np.array([0.4, 0.3, 0.3])
+
+_THRESHOLDS = np.asarray(RATING_THRESHOLDS, dtype=float)
+_LABELS = np.asarray(RATING_LABELS, dtype=object)
+
+# 投资策略编码（按判断优先级排列）
+NONE, EXCLUDED, POSITIVE, INTEGRATED, IMPACT = 0, 1, 2, 3, 4
+STRATEGY_AMOUNTS = {POSITIVE: 100.0, INTEGRATED: 50.0, IMPACT: 30.0}
+
+
+def rating_codes(scores) -> np.ndarray:
+    """将分数数组映射为评级编码（RATING_LABELS 的下标）。"""
+    return np.searchsorted(_THRESHOLDS, np.asarray(scores, dtype=float), side="right")
+
+
+def rating_labels(codes) -> np.ndarray:
+    return _LABELS[np.asarray(codes)]
+
+
+def decide_row(store, row: int, hits: dict) -> int:
+    """
+    单个企业的综合分、评级与投资策略判定（与 ScoreTable 的向量化计算一致），结果写入 store，返回策略编码。
+    用于流水线模式下企业评分完成后立即执行投资决策。
+    """
+    dims = np.nan_to_num(np.array([store.env[row], store.soc[row], store.gov[row]], dtype=np.float64))
+    composite = float(dims @ COMPOSITE_WEIGHTS)
+    integrated = float(dims @ INTEGRATION_WEIGHTS)
+    if "exclusion" in hits:
+        strategy = EXCLUDED
+    elif composite > 75:
+        strategy = POSITIVE
+    elif integrated >= 65:
+        strategy = INTEGRATED
+    elif "impact" in hits:
+        strategy = IMPACT
+    else:
+        strategy = NONE
+    store.composite[row] = composite
+    store.integrated[row] = integrated
+    store.rating_code[row] = rating_codes(composite)
+    store.strategy[row] = strategy
+    store.investment[row] = STRATEGY_AMOUNTS.get(strategy, 0.0)
+    return strategy
+
+
+# 评分存储中的维度列
+SCORE_KEYS = ("env", "soc", "gov")
+
+
+def _py(value) -> float:
+    """float32 数值转为Python浮点数，去掉单精度带来的多余尾数（评分保留两位小数）。"""
+    return round(float(value), 4)
+
+
+class ScoreStore:
+    """
+    按企业行号（与 model.firms 顺序一致）存放评分的列式存储：维度得分与综合分为 float32，
+    评级与策略为 int8，未评分的维度为 NaN。每个企业只占若干字节，替代按企业的嵌套字典。
+    企业ID到行号的映射由模型维护（FirmAgent._row），存储本身只按行号访问。
+    """
+    __slots__ = ("size", "env", "soc", "gov", "composite", "integrated", "rating_code", "strategy",
+                 "investment", "received", "fallback")
+
+    def __init__(self, n: int):
+        self.size = n
+        self.env = np.full(n, np.nan, dtype=np.float32)
+        self.soc = np.full(n, np.nan, dtype=np.float32)
+        self.gov = np.full(n, np.nan, dtype=np.float32)
+        self.composite = np.zeros(n, dtype=np.float32)
+        self.integrated = np.zeros(n, dtype=np.float32)
+        self.rating_code = np.zeros(n, dtype=np.int8)
+        self.strategy = np.zeros(n, dtype=np.int8)
+        # 每个投资者对各企业的投资额（本轮策略决定），以及各企业本轮累计获得的投资
+        self.investment = np.zeros(n, dtype=np.float32)
+        self.received = np.zeros(n, dtype=np.float32)
+        # 使用了默认分（接口失败）的企业
+        self.fallback = np.zeros(n, dtype=bool)
+
+    def __len__(self):
+        return self.size
+
+    def set(self, row: int, key: str, score: float):
+        getattr(self, key)[row] = score
+
+    def is_complete(self, row: int) -> bool:
+        """三个维度是否都已评分。"""
+        return not (np.isnan(self.env[row]) or np.isnan(self.soc[row]) or np.isnan(self.gov[row]))
+
+    def get(self, row: int) -> dict:
+        """某行企业已评分的维度 {"env": 分数, ...}（兼容原先按企业的字典格式）。"""
+        return {key: _py(value) for key in SCORE_KEYS if not np.isnan(value := getattr(self, key)[row])}
+
+    def clear(self):
+        """清空本轮评分（不影响累计投资）。"""
+        for key in SCORE_KEYS:
+            getattr(self, key).fill(np.nan)
+        self.fallback.fill(False)
+
+
+class ScoreTable:
+    """
+    列式评分表：每轮评分结束后构建一次，把综合分、评级编码以及四种投资策略的判定结果
+    写入 ScoreStore 预分配的数组，自身只持有这些数组的引用（零拷贝），供所有投资者共享。
+    disclosures 以企业ID为键；关键词筛选使用企业的原始披露全文（FirmAgent.screening_text），
+    而不是提交评分的精简披露。env/soc/gov 中未评分的维度为 NaN，计算时按0计。
+    """
+    def __init__(self, store: ScoreStore, firms, disclosures: dict, screen):
+        self.firms = firms
+        self.store = store
+        n = len(firms)
+        self.env, self.soc, self.gov = store.env, store.soc, store.gov
+        # 以双精度计算综合分与策略判定，只把结果存为单精度，避免阈值附近的判定受精度影响
+        dims = np.nan_to_num(np.stack((store.env, store.soc, store.gov), axis=1).astype(np.float64))
+        composite = dims @ COMPOSITE_WEIGHTS
+        integrated = dims @ INTEGRATION_WEIGHTS
+        store.composite[:] = composite
+        store.integrated[:] = integrated
+        store.rating_code[:] = rating_codes(composite)
+        self.composite, self.integrated, self.rating_code = store.composite, store.integrated, store.rating_code
+
+        # 关键词筛选：每条披露单次扫描，只保留有命中的企业 {行号: 命中词}，用于审计
+        self.screening_hits = {}
+        for i, firm in enumerate(firms):
+            hits = screen.screen(firm.screening_text(disclosures.get(firm.unique_id, "")))
+            if hits:
+                self.screening_hits[i] = hits
+        self.excluded = np.zeros(n, dtype=bool)
+        self.impact = np.zeros(n, dtype=bool)
+        for i, hits in self.screening_hits.items():
+            self.excluded[i] = "exclusion" in hits
+            self.impact[i] = "impact" in hits
+
+        # 按优先级判定策略：负面筛选 > 正面筛选 > ESG整合 > 影响力投资
+        store.strategy[:] = np.select(
+            [self.excluded, composite > 75, integrated >= 65, self.impact],
+            [EXCLUDED, POSITIVE, INTEGRATED, IMPACT],
+            default=NONE,
+        )
+        self.strategy = store.strategy
+        store.investment.fill(0)
+        for code, amount in STRATEGY_AMOUNTS.items():
+            store.investment[store.strategy == code] = amount
+        self.investment = store.investment
+
+    def __len__(self):
+        return len(self.firms)
+
+    @property
+    def ratings(self) -> np.ndarray:
+        return rating_labels(self.rating_code)
+
+    def mask(self, strategy: int) -> np.ndarray:
+        """某一投资策略命中的企业掩码。"""
+        return self.strategy == strategy
+
+    def record(self, i: int) -> dict:
+        """第 i 个企业的结果字典（与 ESGModel.get_firm_scores 的格式一致）。"""
+        env, soc, gov = (0.0 if np.isnan(v) else _py(v) for v in (self.env[i], self.soc[i], self.gov[i]))
+        return {
+            "env": env,
+            "soc": soc,
+            "gov": gov,
+            "esg_score": _py(self.composite[i]),
+            "esg_rating": RATING_LABELS[self.rating_code[i]],
+            "investment_return": 1.0 + float(self.store.received[i]) / 1000.0  # 简单收益模拟
+        }
@@ -0,0 +1,136 @@
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import metrics
+
+# 评分模式：separate 逐维度调用，batch 一次调用获取三个维度
+SCORING_MODES = ("separate", "batch")
+
+# 当前线程正在执行的调度器任务（调度器与该任务估算的token数），供 throttle 使用
+_local = threading.local()
+
+
+class TokenBucket:
+    """
+    令牌桶：容量为每分钟配额，按匀速补充。acquire 在令牌不足时阻塞等待。
+    """
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1.0):
+        # 单次请求超过桶容量时按容量计，避免永远等不到
+        amount = min(float(amount), self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """判断异常是否为限流错误（HTTP 429 或 openai.RateLimitError）。"""
+    if type(error).__name__ == "RateLimitError":
+        return True
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return status == 429
+
+
+def throttle():
+    """
+    在真正发起LLM请求之前调用（见 deepseek_api._chat_completion）：按当前线程所属调度器的
+    RPM/TPM 配额等待。LLM缓存命中不经过这里，因此不占用配额；不在调度器中执行时直接返回。
+    """
+    engine = getattr(_local, "engine", None)
+    if engine is not None:
+        engine.acquire(_local.tokens)
+
+
+class ScoringEngine:
+    """
+    LLM评分调度器：线程池控制最大并发请求数，令牌桶限制每分钟请求数(RPM)与token数(TPM)，
+    遇到限流错误时按指数退避加随机抖动重试。令牌在实际调用接口时才扣除（throttle），缓存命中不受限流。
+    """
+    def __init__(self, max_in_flight: int = 8, requests_per_minute: float = None, tokens_per_minute: float = None,
+                 max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 30.0):
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = 0
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="esg-scoring")
+            return self._executor
+
+    def acquire(self, tokens: int = 0):
+        """等待一次请求的RPM配额与 tokens 个TPM配额。"""
+        if self.request_bucket:
+            self.request_bucket.acquire(1)
+        if self.token_bucket and tokens:
+            self.token_bucket.acquire(tokens)
+
+    def call(self, fn, *args, tokens: int = 0):
+        """
+        调用 fn(*args)，其中实际发起的接口请求受限流约束（见 throttle），
+        限流错误自动重试，其他异常直接抛出。
+        """
+        previous = getattr(_local, "engine", None), getattr(_local, "tokens", 0)
+        _local.engine, _local.tokens = self, tokens
+        try:
+            attempt = 0
+            while True:
+                try:
+                    return fn(*args)
+                except Exception as e:
+                    if not is_rate_limit_error(e) or attempt >= self.max_retries:
+                        raise
+                    # 指数退避 + 全抖动，避免多个线程同时重试
+                    delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+                    attempt += 1
+                    with self._lock:
+                        self.retries += 1
+                    metrics.inc("esg_llm_retries_total")
+                    time.sleep(delay)
+        finally:
+            _local.engine, _local.tokens = previous
+
+    def submit(self, fn, *args, tokens: int = 0):
+        """在线程池中以 call 的限流与重试规则执行 fn(*args)，返回 Future。"""
+        return self._get_executor().submit(self.call, fn, *args, tokens=tokens)
+
+    def map(self, jobs):
+        """
+        并发执行一组任务，jobs 为 (key, fn, args, tokens) 的可迭代对象。
+        按完成顺序产出 (key, result, error)，error 为 None 表示成功。
+        """
+        futures = {self.submit(fn, *args, tokens=tokens): key for key, fn, args, tokens in jobs}
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                yield key, future.result(), None
+            except Exception as e:
+                yield key, None, e
+
+    def shutdown(self):
+        """关闭线程池（可重复调用，之后再次使用会重新创建）。"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
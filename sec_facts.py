@@ -0,0 +1,186 @@
+import os
+import re
+import json
+import time
+import codecs
+import threading
+
+from cache import CACHE_DIR, DiskCache
+from http_client import ENDPOINT_TTLS, get_session
+
+COMPANY_FACTS_URL = "https://data.sec.gov/api/xbrl/companyfacts/{cik}.json"
+SEC_HEADERS = {"User-Agent": "example@domain.com"}  # 提供联系人以符合SEC要求
+
+# 默认提取的XBRL事实：名称 -> (taxonomy, concept, 中文标签)
+DEFAULT_FACTS = {
+    "board_size": ("dei", "BoardOfDirectorsMemberCount", "董事会成员数"),
+    "employees": ("dei", "EntityNumberOfEmployees", "员工人数"),
+    "environmental_remediation": ("us-gaap", "EnvironmentalRemediationExpense", "环境修复支出"),
+    "environmental_accrual": ("us-gaap", "AccrualForEnvironmentalLossContingencies", "环境或有损失计提"),
+    "asset_retirement_obligation": ("us-gaap", "AssetRetirementObligation", "资产弃置义务"),
+}
+
+CHUNK_SIZE = 64 * 1024
+# 单个概念对象的最大字节数，超出则放弃该概念（防止异常文件撑爆内存）
+MAX_CONCEPT_CHARS = 32 * 1024 * 1024
+# 缓存结果的重新确认间隔（秒），与HTTP层SEC端点TTL一致
+LATEST_TTL = ENDPOINT_TTLS.get("data.sec.gov", 6 * 3600)
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def format_cik(cik) -> str:
+    """将数字形式的CIK统一为SEC接口使用的 CIK########## 格式。"""
+    if cik is None or cik == "":
+        return None
+    text = str(cik).strip().upper()
+    if text.startswith("CIK"):
+        text = text[3:]
+    return f"CIK{int(text):010d}" if text.isdigit() else str(cik)
+
+
+class CompanyFactsExtractor:
+    """
+    companyfacts JSON 的增量提取器：逐块喂入文本，只解析目标概念对应的子对象，
+    其余内容扫描后即丢弃，因此内存占用与文件大小无关。
+    """
+    def __init__(self, facts: dict):
+        self.facts = facts
+        self.results = {}
+        self._wanted = {(taxonomy, concept): name for name, (taxonomy, concept, _) in facts.items()}
+        concepts = sorted({concept for _, concept, _ in facts.values()})
+        taxonomies = sorted({taxonomy for taxonomy, _, _ in facts.values()})
+        # 同时匹配分类（taxonomy）键与概念键，用于确定概念所在的分类
+        self._pattern = re.compile(
+            r'"(?:(?P<taxonomy>' + "|".join(map(re.escape, taxonomies)) + r')|(?P<concept>'
+            + "|".join(map(re.escape, concepts)) + r'))"\s*:\s*\{'
+        )
+        self._keep = max(len(key) for key in concepts + taxonomies) + 16
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._taxonomy = None
+        self._pending = None  # 正在等待完整内容的 (概念名称, 对象起始位置)
+
+    def feed(self, text: str):
+        self._buffer += text
+        pos = 0
+        while True:
+            if self._pending is not None:
+                name, start = self._pending
+                try:
+                    obj, end = self._decoder.raw_decode(self._buffer, start)
+                except ValueError:
+                    if len(self._buffer) - start > MAX_CONCEPT_CHARS:
+                        self._pending = None
+                        pos = len(self._buffer)
+                        continue
+                    # 对象尚未完整，保留从对象开始处的内容等待后续数据
+                    self._buffer = self._buffer[start:]
+                    self._pending = (name, 0)
+                    return
+                self._pending = None
+                latest = _latest_fact(obj)
+                if latest is not None:
+                    self.results[name] = latest
+                pos = end
+                continue
+            match = self._pattern.search(self._buffer, pos)
+            if match is None:
+                # 只保留末尾可能被截断的键
+                self._buffer = self._buffer[max(pos, len(self._buffer) - self._keep):]
+                return
+            if match.group("taxonomy"):
+                self._taxonomy = match.group("taxonomy")
+                pos = match.end()
+                continue
+            name = self._wanted.get((self._taxonomy, match.group("concept")))
+            if name is None:
+                pos = match.end()
+                continue
+            self._pending = (name, match.end() - 1)
+
+    def close(self) -> dict:
+        """数据结束，返回 {名称: {"value", "unit", "end", "filed"}}。"""
+        self._buffer = ""
+        self._pending = None
+        return self.results
+
+
+def _latest_fact(concept: dict):
+    """从概念对象的各单位事实中选取期末日期与申报日期最新的一条。"""
+    best = None
+    for unit, entries in (concept.get("units") or {}).items():
+        for entry in entries or []:
+            value = entry.get("val", entry.get("value"))
+            if value is None:
+                continue
+            rank = (entry.get("end") or "", entry.get("filed") or "")
+            if best is None or rank > best[0]:
+                best = (rank, {"value": value, "unit": unit, "end": entry.get("end"), "filed": entry.get("filed")})
+    return best[1] if best else None
+
+
+def _get_store() -> DiskCache:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = DiskCache(os.path.join(CACHE_DIR, "sec_facts.sqlite3"), ttl=None, max_entries=100000)
+        return _store
+
+
+def stream_company_facts(cik: str, facts: dict = None, timeout: float = 10) -> dict:
+    """流式下载并提取 companyfacts 中的目标事实，不缓存。"""
+    return _fetch_company_facts(cik, facts or DEFAULT_FACTS, timeout=timeout)[0]
+
+
+def _fetch_company_facts(cik: str, facts: dict, validators: dict = None, timeout: float = 10) -> tuple:
+    """
+    返回 (提取结果, 响应的 ETag/Last-Modified)。提供 validators 时发送条件请求，
+    服务器返回 304（文件未变化）时提取结果为 None，不下载正文。
+    """
+    headers = dict(SEC_HEADERS)
+    if validators:
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+    extractor = CompanyFactsExtractor(facts)
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    url = COMPANY_FACTS_URL.format(cik=format_cik(cik))
+    with get_session().get(url, headers=headers, timeout=timeout, stream=True) as resp:
+        if resp.status_code == 304 and validators:
+            return None, validators
+        if resp.status_code != 200:
+            raise Exception(f"HTTP {resp.status_code}")
+        returned = {"etag": resp.headers.get("ETag"), "last_modified": resp.headers.get("Last-Modified")}
+        for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+            extractor.feed(decoder.decode(chunk))
+        extractor.feed(decoder.decode(b"", final=True))
+    return extractor.close(), returned
+
+
+def get_company_facts(cik: str, facts: dict = None) -> dict:
+    """
+    获取某公司的目标XBRL事实，结果连同响应的 ETag/Last-Modified 持久化缓存；
+    超过 LATEST_TTL 秒后以条件请求确认文件是否变化，未变化（304）时不重新下载。
+    """
+    facts = facts or DEFAULT_FACTS
+    cik = format_cik(cik)
+    key = f"{cik}|{','.join(sorted(facts))}"
+    store = _get_store()
+    cached = store.get(key)
+    if cached is not None and time.time() - cached["checked"] < LATEST_TTL:
+        return cached["facts"]
+    extracted, validators = _fetch_company_facts(cik, facts, cached and cached["validators"])
+    if extracted is None:
+        extracted = cached["facts"]
+    store.set(key, {"facts": extracted, "validators": validators, "checked": time.time()})
+    return extracted
+
+
+def format_value(value) -> str:
+    """整数型数值去掉多余的小数位。"""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return f"{value:,}" if isinstance(value, int) and abs(value) >= 10000 else str(value)
@@ -0,0 +1,125 @@
+import time
+import threading
+
+from agents import DEFAULT_SCREENING_POLICIES
+from deepseek_api import generate_esg_commentary, stream_esg_commentary
+from keyword_screen import KeywordScreen
+from model import ESGModel
+from resolver import resolve_company
+from scoring import ScoringEngine
+from utils import split_commentary
+
+# 同一查询的结果在内存中保留的时间（秒）
+RESULT_TTL = 10 * 60
+
+
+class AnalysisService:
+    """
+    常驻分析服务：在同一进程内保持HTTP会话、LLM缓存、解析索引、评分调度器与关键词自动机，
+    按查询返回结构化结果字典；相同查询在 result_ttl 内直接返回内存中的结果。
+    """
+    def __init__(self, result_ttl: float = RESULT_TTL, scoring_mode: str = "separate", max_in_flight: int = 8,
+                 requests_per_minute: float = None, tokens_per_minute: float = None, screening_policies=None):
+        self.result_ttl = result_ttl
+        self.scoring_mode = scoring_mode
+        self.scoring_engine = ScoringEngine(max_in_flight=max_in_flight,
+                                            requests_per_minute=requests_per_minute,
+                                            tokens_per_minute=tokens_per_minute)
+        self.keyword_screen = KeywordScreen(screening_policies or DEFAULT_SCREENING_POLICIES)
+        self._results = {}
+        self._lock = threading.Lock()
+
+    def _cached_result(self, key):
+        with self._lock:
+            item = self._results.get(key)
+            if item and time.monotonic() - item[0] < self.result_ttl:
+                return dict(item[1], cached=True)
+            return None
+
+    def analyze(self, term: str, city: str = None, country: str = None, cik: str = None,
+                refresh: bool = False, preview: bool = False, on_scores=None, on_commentary=None) -> dict:
+        """
+        分析一家公司，返回结构化结果：名称、代码、各维度得分、综合分、评级、披露文本、评价与投资建议。
+        city/country/cik 显式提供时覆盖自动解析结果；refresh 为 True 时忽略内存中的结果重新分析。
+        on_scores(result): 评分完成、生成评价之前调用，result 中尚无评价字段。
+        on_commentary(chunk): 提供时以流式方式生成评价，每收到一段文本调用一次。
+        preview: 预览模式，只用本地预评分给出临时得分与置信度（confidence），不调用LLM评分，也不生成评价。
+        """
+        key = (term.strip(), city, country, cik, preview)
+        if not refresh:
+            cached = self._cached_result(key)
+            if cached is not None:
+                if on_scores:
+                    on_scores(cached)
+                if on_commentary:
+                    on_commentary(cached["commentary"])
+                return cached
+
+        start = time.perf_counter()
+        # 通过辅助函数解析名称和代码
+        name, ticker, resolved_city, resolved_country, resolved_cik = resolve_company(term)
+        # 如果用户有显式提供city/country/cik参数则覆盖自动推断结果
+        firm_data = {
+            "id": 0,
+            "name": name,
+            "ticker": ticker,
+            "city": city or resolved_city,
+            "country": country or resolved_country,
+            "cik": cik or resolved_cik,
+        }
+        model = ESGModel(firms_data=[firm_data], N_investors=1, scoring_mode=self.scoring_mode,
+                         screening_policies=self.keyword_screen, scoring_engine=self.scoring_engine,
+                         prescore_mode="preview" if preview else None)
+        model.step()  # 执行模型分析流程
+
+        # 获取结果并生成ESG评价与投资建议
+        firm = model.firms[0]
+        scores = model.get_firm_scores().get(firm.unique_id, {})
+        disclosure = model.current_disclosures.get(firm.unique_id, "（暂无披露）")
+        result = {
+            "query": term,
+            "name": name,
+            "ticker": ticker,
+            "city": firm.city,
+            "country": firm.country_code,
+            "cik": firm.cik,
+            "env": scores.get("env", 0.0),
+            "soc": scores.get("soc", 0.0),
+            "gov": scores.get("gov", 0.0),
+            "esg_score": scores.get("esg_score", 0.0),
+            "esg_rating": scores.get("esg_rating", "N/A"),
+            "disclosure": disclosure,
+            "cached": False,
+            "preview": preview,
+        }
+        if preview:
+            result["confidence"] = model.prescored_firms.get(firm.unique_id, 0.0)
+        if on_scores:
+            on_scores(dict(result))
+
+        if preview:
+            result.update(commentary="", evaluation="", advice="", elapsed=time.perf_counter() - start)
+            with self._lock:
+                self._results[key] = (time.monotonic(), result)
+            return dict(result)
+
+        if on_commentary:
+            parts = []
+            for chunk in stream_esg_commentary(disclosure, scores):
+                parts.append(chunk)
+                on_commentary(chunk)
+            commentary = "".join(parts).strip()
+        else:
+            commentary = generate_esg_commentary(disclosure, scores)
+        result["commentary"] = commentary
+        result["evaluation"], result["advice"] = split_commentary(commentary)
+        result["elapsed"] = time.perf_counter() - start
+        with self._lock:
+            self._results[key] = (time.monotonic(), result)
+        return dict(result)
+
+
+def format_identifier(result: dict) -> str:
+    """分析对象的显示名称，如 "Apple Inc. (AAPL)"。"""
+    name, ticker = result.get("name"), result.get("ticker")
+    return f"{name} ({ticker})" if ticker and name and ticker != name else (name or ticker)
@@ -0,0 +1,161 @@
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# 每个工作进程分到的分片数：分片越小负载越均衡，但每个分片都有建模与进程间传输的固定开销
+CHUNKS_PER_WORKER = 4
+SCORE_KEYS = ("env", "soc", "gov")
+
+# 工作进程内复用的评分调度器（线程池与令牌桶），在同一进程处理的多个分片间共享
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def split_firms(firms: list, chunks: int) -> list:
+    """把企业列表按顺序切成至多 chunks 个大小相近的连续分片。"""
+    chunks = max(1, min(chunks, len(firms)))
+    size, extra = divmod(len(firms), chunks)
+    shards, start = [], 0
+    for i in range(chunks):
+        end = start + size + (1 if i < extra else 0)
+        shards.append(firms[start:end])
+        start = end
+    return shards
+
+
+def _worker_engine(config: dict):
+    global _engine
+    from scoring import ScoringEngine
+    with _engine_lock:
+        if _engine is None:
+            _engine = ScoringEngine(max_in_flight=config["max_in_flight"],
+                                    requests_per_minute=config["requests_per_minute"],
+                                    tokens_per_minute=config["tokens_per_minute"])
+        return _engine
+
+
+def score_shard(task: dict) -> dict:
+    """
+    工作进程入口：为一个分片的企业收集披露并评分，返回可序列化的紧凑结果：
+    records 为 (企业ID, 披露各部分, 精简后的披露, env, soc, gov, 是否默认分) 元组列表。
+    """
+    from model import ESGModel
+    from disclosure import get_compaction_stats
+    before = get_compaction_stats()
+    model = ESGModel(firms_data=task["firms"], N_investors=0, scoring_mode=task["scoring_mode"],
+                     incremental=task["incremental"], prescore_mode=task["prescore_mode"], verbose=False,
+                     scoring_engine=_worker_engine(task))
+    model._score_state = task["state"]
+    if task["prescore_fit"] is not None:
+        model.prescorer.set_fitted_state(task["prescore_fit"])
+    for firm, fdata in zip(model.firms, task["firms"]):
+        if fdata.get("sections"):
+            # 主进程已有的披露直接复用，不再抓取
+            firm.restore_disclosure(fdata["sections"], fdata["disclosure"])
+    model._timed("disclosures", model._gather_disclosures, False)
+    model.score_collected()
+
+    after = get_compaction_stats()
+    records = []
+    store = model.score_store
+    for row, firm in enumerate(model.firms):
+        scores = store.get(row)
+        records.append((firm.unique_id, firm.sections, firm._cached_disclosure,
+                        *(scores.get(key) for key in SCORE_KEYS),
+                        bool(store.fallback[row])))
+    return {
+        "records": records,
+        "rescored": model.rescored_firms,
+        "changed_sections": model.changed_sections,
+        "prescored": model.prescored_firms,
+        "state": {str(firm.unique_id): model._score_state[str(firm.unique_id)]
+                  for firm in model.firms if str(firm.unique_id) in model._score_state},
+        "stats": model.scoring_stats,
+        "timings": model.step_timings,
+        "compaction": {key: after[key] - before[key] for key in after},
+    }
+
+
+def _get_pool(model) -> ProcessPoolExecutor:
+    if model._process_pool is None:
+        # spawn 方式启动，避免 fork 时复制主进程中的线程、连接池与SQLite连接
+        model._process_pool = ProcessPoolExecutor(max_workers=model.processes,
+                                                  mp_context=multiprocessing.get_context("spawn"))
+    return model._process_pool
+
+
+def _shard_task(model, firms: list) -> dict:
+    per_worker = lambda limit: limit / model.processes if limit else None
+    return {
+        "firms": [{
+            "id": firm.unique_id, "name": firm.firm_name, "ticker": firm.ticker, "cik": firm.cik,
+            "city": firm.city, "country": firm.country_code,
+            "sections": firm.sections if firm._cached_disclosure else None,
+            "disclosure": firm._cached_disclosure,
+        } for firm in firms],
+        "state": {key: model._score_state[key] for key in (str(firm.unique_id) for firm in firms)
+                  if key in model._score_state},
+        "scoring_mode": model.scoring_mode,
+        "incremental": model.incremental,
+        "prescore_mode": model.prescore_mode,
+        # 工作进程与进程池跨轮复用，每轮随任务传入主进程最新的预评分拟合参数
+        "prescore_fit": model.prescorer.fitted_state() if model.prescorer else None,
+        "max_in_flight": model.max_in_flight,
+        "requests_per_minute": per_worker(model.requests_per_minute),
+        "tokens_per_minute": per_worker(model.tokens_per_minute),
+    }
+
+
+def run_sharded(model, refresh: bool = False):
+    """
+    分片模式的披露收集与评分：企业按顺序切片分发到进程池，各分片完成后立即按企业ID合并到主进程模型
+    （触发 on_firm_scored），随后由主进程统一执行投资者阶段。
+    """
+    from disclosure import merge_compaction_stats
+    start = time.perf_counter()
+    for firm in model.firms:
+        if refresh:
+            firm.invalidate_disclosure()
+    model.reset_selection()
+    stats = {}
+
+    pool = _get_pool(model)
+    shards = split_firms(model.firms, model.processes * CHUNKS_PER_WORKER)
+    futures = {pool.submit(score_shard, _shard_task(model, shard)): shard for shard in shards}
+    for future in as_completed(futures):
+        result = future.result()
+        rescored = set(result["rescored"])
+        # 先合并临时得分的企业，on_firm_scored 回调中即可区分
+        model.prescored_firms.update(result["prescored"])
+        for firm_id, sections, disclosure, env, soc, gov, fallback in result["records"]:
+            firm = model.firm_index[firm_id]
+            model.submit_disclosure(firm, firm.restore_disclosure(sections, disclosure))
+            if firm_id in rescored:
+                model.pending_disclosures[firm_id] = firm._cached_disclosure
+            for key, score in zip(SCORE_KEYS, (env, soc, gov)):
+                if score is not None:
+                    model.assign_score(firm_id, key, score, fallback=fallback)
+        merge_compaction_stats(result["compaction"])
+        model.rescored_firms.extend(result["rescored"])
+        model.changed_sections.update(result["changed_sections"])
+        if model.incremental:
+            # 使用默认分的企业在工作进程中已移出状态，合并时同样移除
+            for firm in futures[future]:
+                key = str(firm.unique_id)
+                if key in result["state"]:
+                    model._score_state[key] = result["state"][key]
+                else:
+                    model._score_state.pop(key, None)
+        for key, value in result["stats"].items():
+            if isinstance(value, (int, float)) and key != "elapsed":
+                stats[key] = stats.get(key, 0) + value
+        for phase, seconds in result["timings"].items():
+            phase = f"worker_{phase}"
+            model.step_timings[phase] = model.step_timings.get(phase, 0.0) + seconds
+    if model.incremental:
+        model._save_score_state()
+    stats["mode"] = model.scoring_mode
+    stats["firms"] = len(model.pending_disclosures)
+    stats["elapsed"] = time.perf_counter() - start
+    model.scoring_stats = stats
@@ -0,0 +1,214 @@
+import os
+import json
+import time
+
+import numpy as np
+
+from score_table import NONE, EXCLUDED, POSITIVE, INTEGRATED, IMPACT
+from utils import RATING_LABELS
+
+# 多期模拟：SimulationRunner 连续执行 K 次 ESGModel.step，每步把各企业的评分、综合分、评级、
+# 投资策略与获得的投资写入预分配的 (步, 企业) 历史数组。指定目录时历史数组为内存映射的 .npy 文件，
+# 已写入的步由操作系统换出到磁盘，常驻内存与步数无关；并可定期保存检查点，中断后从检查点继续。
+
+# 每个 (步, 企业) 的历史记录
+HISTORY_DTYPE = np.dtype([
+    ("env", np.float32),
+    ("soc", np.float32),
+    ("gov", np.float32),
+    ("composite", np.float32),
+    ("rating_code", np.int8),
+    ("strategy", np.int8),
+    ("investment", np.float32),
+    ("fallback", np.bool_),
+])
+HISTORY_FILE = "history.npy"
+CHECKPOINT_FILE = "checkpoint.json"
+CHECKPOINT_VERSION = 1
+STRATEGY_CODES = (NONE, EXCLUDED, POSITIVE, INTEGRATED, IMPACT)
+
+
+class SimulationHistory:
+    """
+    (步, 企业) 的历史数组及向量化分析。path 为 None 时保存在内存中，否则为内存映射的 .npy 文件。
+    只有前 steps_done 步是有效数据；field() 等方法返回的都是这部分的视图或由其计算的数组。
+    """
+    def __init__(self, steps: int, firms: int, path: str = None, data=None, steps_done: int = 0):
+        self.path = path
+        if data is not None:
+            self.data = data
+        elif path:
+            self.data = np.lib.format.open_memmap(path, mode="w+", dtype=HISTORY_DTYPE, shape=(steps, firms))
+        else:
+            self.data = np.zeros((steps, firms), dtype=HISTORY_DTYPE)
+        self.steps_done = steps_done
+
+    @classmethod
+    def open(cls, path: str, steps_done: int):
+        """以读写方式重新打开已有的历史文件（用于从检查点恢复）。"""
+        return cls(0, 0, path=path, data=np.lib.format.open_memmap(path, mode="r+"), steps_done=steps_done)
+
+    @property
+    def capacity(self) -> int:
+        return self.data.shape[0]
+
+    @property
+    def firms(self) -> int:
+        return self.data.shape[1]
+
+    def record(self, store):
+        """把模型评分存储（ScoreStore）中本步的结果写入下一行。"""
+        if self.steps_done >= self.capacity:
+            raise ValueError(f"历史数组已满（{self.capacity} 步）")
+        row = self.data[self.steps_done]
+        for name in ("env", "soc", "gov", "composite", "rating_code", "strategy"):
+            row[name] = getattr(store, name)
+        row["investment"] = store.received
+        row["fallback"] = store.fallback
+        self.steps_done += 1
+
+    def flush(self):
+        if isinstance(self.data, np.memmap):
+            self.data.flush()
+
+    def field(self, name: str) -> np.ndarray:
+        """某字段的 (已完成步数, 企业数) 视图（不复制）。"""
+        return self.data[name][:self.steps_done]
+
+    def change(self, name: str = "composite") -> np.ndarray:
+        """逐期变化量 (步数-1, 企业数)。"""
+        return np.diff(self.field(name).astype(np.float64), axis=0)
+
+    def pct_change(self, name: str = "composite") -> np.ndarray:
+        """逐期变化率；上期为0或缺失时为 NaN。"""
+        values = self.field(name).astype(np.float64)
+        previous = values[:-1]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(previous != 0, (values[1:] - previous) / previous, np.nan)
+
+    def returns(self) -> np.ndarray:
+        """各期收益（与 get_firm_scores 的 investment_return 相同：1 + 本期获得投资 / 1000）。"""
+        return 1.0 + self.field("investment").astype(np.float64) / 1000.0
+
+    def cumulative_returns(self) -> np.ndarray:
+        """各企业的累计收益（逐期收益连乘）。"""
+        return np.cumprod(self.returns(), axis=0)
+
+    def cumulative_investment(self) -> np.ndarray:
+        return np.cumsum(self.field("investment").astype(np.float64), axis=0)
+
+    def strategy_counts(self) -> np.ndarray:
+        """每期各投资策略命中的企业数 (步数, 策略数)，列顺序同 STRATEGY_CODES。"""
+        strategy = self.field("strategy")
+        return (strategy[:, :, None] == np.asarray(STRATEGY_CODES, dtype=np.int8)).sum(axis=1)
+
+    def rating_migrations(self) -> np.ndarray:
+        """相邻两期之间的评级迁移次数矩阵 (评级数, 评级数)：[i, j] 为从 RATING_LABELS[i] 变为 [j] 的次数。"""
+        codes = self.field("rating_code").astype(np.intp)
+        n = len(RATING_LABELS)
+        return np.bincount((codes[:-1] * n + codes[1:]).ravel(), minlength=n * n).reshape(n, n)
+
+    def summary(self) -> dict:
+        """每期的综合分均值/标准差、总投资额与各策略企业数。"""
+        composite = self.field("composite").astype(np.float64)
+        investment = self.field("investment").astype(np.float64)
+        counts = self.strategy_counts()
+        return {
+            "composite_mean": composite.mean(axis=1).tolist(),
+            "composite_std": composite.std(axis=1).tolist(),
+            "investment_total": investment.sum(axis=1).tolist(),
+            "strategy_counts": {int(code): counts[:, i].tolist() for i, code in enumerate(STRATEGY_CODES)},
+        }
+
+
+class SimulationRunner:
+    """
+    连续运行 ESGModel 多期，并把每期结果写入 SimulationHistory。
+    directory: 历史文件与检查点所在目录；为 None 时历史保存在内存中，且不能保存检查点。
+    refresh: 每期是否重新抓取数据源（每期代表一个新的观测期，默认重新抓取）。
+    checkpoint_every: 每完成多少期保存一次检查点，0 表示只在运行结束时保存。
+    on_step: 可选回调 on_step(step, model)，每期结束后调用。
+    """
+    def __init__(self, model, steps: int, directory: str = None, refresh: bool = True,
+                 checkpoint_every: int = 0, on_step=None, history: SimulationHistory = None):
+        self.model = model
+        self.steps = steps
+        self.directory = directory
+        self.refresh = refresh
+        self.checkpoint_every = checkpoint_every
+        self.on_step = on_step
+        if history is None:
+            path = None
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+                path = os.path.join(directory, HISTORY_FILE)
+            history = SimulationHistory(steps, len(model.firms), path=path)
+        self.history = history
+        # 每期耗时（秒）
+        self.step_seconds = []
+
+    @property
+    def step(self) -> int:
+        """已完成的期数。"""
+        return self.history.steps_done
+
+    def run(self, steps: int = None) -> SimulationHistory:
+        """运行到第 steps 期（默认运行全部期数）；从检查点恢复后继续未完成的期。"""
+        target = min(self.steps, steps if steps is not None else self.steps)
+        while self.step < target:
+            start = time.perf_counter()
+            # 第一期直接使用已有的披露缓存，之后每期重新抓取；
+            # 流水线模式下本期披露收集完成后即预取下一期的数据源（最后一期不预取）
+            prefetch_next = self.model.pipelined and self.refresh and self.step + 1 < target
+            self.model.step(refresh=self.refresh and self.step > 0, prefetch_next=prefetch_next)
+            self.history.record(self.model.score_store)
+            self.step_seconds.append(time.perf_counter() - start)
+            if self.on_step:
+                self.on_step(self.step - 1, self.model)
+            if self.directory and self.checkpoint_every and self.step % self.checkpoint_every == 0:
+                self.checkpoint()
+        if self.directory:
+            self.checkpoint()
+        return self.history
+
+    def checkpoint(self):
+        """把已写入的历史刷新到磁盘，并原子地写入检查点（已完成期数、企业ID、披露各部分与增量评分状态）。"""
+        if not self.directory:
+            raise ValueError("历史保存在内存中，无法保存检查点（请指定 directory）")
+        self.history.flush()
+        state = {
+            "version": CHECKPOINT_VERSION,
+            "steps": self.steps,
+            "steps_done": self.step,
+            "refresh": self.refresh,
+            "firm_ids": [firm.unique_id for firm in self.model.firms],
+            "sections": {str(firm.unique_id): firm.sections for firm in self.model.firms if firm.sections},
+            "score_state": self.model._score_state if self.model.incremental else None,
+        }
+        path = os.path.join(self.directory, CHECKPOINT_FILE)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def restore(cls, model, directory: str, checkpoint_every: int = 0, on_step=None):
+        """
+        从目录中的检查点恢复：企业ID必须与 model 一致；恢复各企业的披露与增量评分状态，
+        历史文件以读写方式重新打开，run() 从下一期继续。
+        """
+        with open(os.path.join(directory, CHECKPOINT_FILE), encoding="utf-8") as f:
+            state = json.load(f)
+        if state.get("version") != CHECKPOINT_VERSION:
+            raise ValueError(f"不支持的检查点版本：{state.get('version')}")
+        if state["firm_ids"] != [firm.unique_id for firm in model.firms]:
+            raise ValueError("检查点中的企业与当前模型不一致")
+        for firm in model.firms:
+            sections = state["sections"].get(str(firm.unique_id))
+            if sections:
+                firm.restore_disclosure(sections)
+        if model.incremental and state.get("score_state") is not None:
+            model._score_state = state["score_state"]
+        history = SimulationHistory.open(os.path.join(directory, HISTORY_FILE), state["steps_done"])
+        return cls(model, state["steps"], directory=directory, refresh=state["refresh"],
+                   checkpoint_every=checkpoint_every, on_step=on_step, history=history)
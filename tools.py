@@ -1,48 +1,96 @@
 import os
-import requests
-import certifi
-import wikipedia
-import yfinance as yf
-from alpha_vantage.timeseries import TimeSeries
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+import replay
+from http_client import QUOTE_TTL, cached_get, ensure_ca_bundle, ttl_memoize
+from sec_facts import DEFAULT_FACTS, format_value, get_company_facts
+from wiki import get_summary
 
 
-# 设置证书路径，防止HTTPS证书错误
-os.environ['SSL_CERT_FILE'] = certifi.where()
-
-# 初始化 Alpha Vantage API
+# Alpha Vantage API密钥
 ALPHA_KEY = os.getenv("ALPHA_VANTAGE_KEY", "E0IPPXV9QP4PJSHF")  # 建议将API密钥设为环境变量
-_ts = TimeSeries(key=ALPHA_KEY, output_format="json")
 
+# 各数据源的第三方库在首次使用时才导入，避免 main.py --help 等场景承担全部导入开销
+_backends = {}
+_backend_lock = threading.Lock()
+
+def _backend(name: str, factory):
+    """返回进程内共享的数据源后端，首次调用时由 factory 创建。"""
+    backend = _backends.get(name)
+    if backend is None:
+        with _backend_lock:
+            backend = _backends.get(name)
+            if backend is None:
+                ensure_ca_bundle()
+                backend = _backends[name] = factory()
+    return backend
+
+def get_yfinance():
+    return _backend("yfinance", lambda: __import__("yfinance"))
+
+def _alpha_vantage_client():
+    from alpha_vantage.timeseries import TimeSeries
+    return TimeSeries(key=ALPHA_KEY, output_format="json")
+
+def get_alpha_vantage():
+    """Alpha Vantage 行情客户端（首次使用时创建）。"""
+    return _backend("alpha_vantage", _alpha_vantage_client)
+
+def yahoo_info(ticker: str) -> dict:
+    """Yahoo财经 .info 数据（名称、注册地、行情等），可录制/回放。"""
+    ticker = ticker.upper()
+    return replay.intercept("yahoo", ticker, lambda: get_yfinance().Ticker(ticker).info)
+
+# 名称解析阶段已取得的 .info 行情在本次运行内复用的时间（秒）
+PRIMED_QUOTE_TTL = 15 * 60
+
+def _format_yahoo_quote(ticker: str, info: dict) -> str:
+    """由Yahoo财经 .info 数据生成股价/市盈率文本，数据不完整时返回空串。"""
+    price = info.get("regularMarketPrice")
+    pe = info.get("trailingPE")
+    if price is None or pe is None:
+        return ""
+    return f"{ticker.upper()} 当前股价：{price}；市盈率PE(TTM)：{pe}"
+
+@ttl_memoize(QUOTE_TTL)
+@metrics.timed("esg_source_seconds", source="yahoo")
 def yahoo_finance(ticker: str) -> str:
     """获取股票当前价格和市盈率（来自Yahoo财经）。"""
     try:
-        ticker = ticker.upper()
-        tk = yf.Ticker(ticker)
-        info = tk.info
-        price = info.get("regularMarketPrice")
-        pe = info.get("trailingPE")
-        if price is None or pe is None:
-            # 如未能获取完整数据，则触发异常以使用后备方案
-            raise ValueError("Ticker data not available")
-        return f"{ticker} 当前股价：{price}；市盈率PE(TTM)：{pe}"
+        # 如未能获取完整数据则返回空串，以使用后备方案
+        return _format_yahoo_quote(ticker, yahoo_info(ticker))
     except Exception as e:
+        metrics.inc("esg_source_failures_total", source="yahoo")
         return ""  # 返回空串用于后续备用处理
 
+def prime_yahoo_quote(ticker: str, info: dict):
+    """用已获取的 .info 数据预填 yahoo_finance 的缓存，避免对同一代码再次请求。"""
+    line = _format_yahoo_quote(ticker, info or {})
+    if line:
+        yahoo_finance.cache.set((ticker,), line, PRIMED_QUOTE_TTL)
+
+@ttl_memoize(QUOTE_TTL)
+@metrics.timed("esg_source_seconds", source="alpha_vantage")
 def alpha_vantage_price(ticker: str) -> str:
     """获取股票最新收盘价（来自Alpha Vantage）。"""
     try:
         ticker = ticker.upper()
-        data, _ = _ts.get_daily(symbol=ticker, outputsize="compact")
+        data, _ = replay.intercept("alpha_vantage", ticker,
+                                   lambda: get_alpha_vantage().get_daily(symbol=ticker, outputsize="compact"))
         latest_date = sorted(data.keys(), reverse=True)[0]
         close_price = data[latest_date]["4. close"]
         return f"{ticker} {latest_date} 收盘价：{close_price}"
     except Exception as e:
+        metrics.inc("esg_source_failures_total", source="alpha_vantage")
         return ""  # 获取失败返回空，后续可以选择忽略
 
+@metrics.timed("esg_source_seconds", source="openaq")
 def openaq_pm25(city: str) -> str:
     """获取指定城市的PM2.5空气质量指标（来自OpenAQ）。"""
     try:
-        resp = requests.get(
+        resp = cached_get(
             "https://api.openaq.org/v2/latest",
             params={"city": city, "parameter": "pm25", "limit": 1},
             timeout=5
@@ -55,49 +103,127 @@ def openaq_pm25(city: str) -> str:
         value = data[0]["measurements"][0]["value"]
         return f"{city} PM2.5：{value} µg/m³"
     except Exception as e:
+        metrics.inc("esg_source_failures_total", source="openaq")
         return f"{city} 空气质量获取失败。"
 
+@metrics.timed("esg_source_seconds", source="wikipedia")
 def wiki_summary(term: str) -> str:
-    """获取维基百科词条摘要（优先中文，可备用英文）。"""
-    try:
-        wikipedia.set_lang("zh")
-        return wikipedia.summary(term, sentences=2)
-    except Exception as e:
+    """获取维基百科词条摘要（优先中文，可备用英文），结果按语言与词条缓存（见 wiki.py）。"""
+    # 中文维基未找到或请求失败时，尝试英文维基
+    for lang in ("zh", "en"):
         try:
-            # 若中文维基未找到，则尝试英文维基
-            wikipedia.set_lang("en")
-            return wikipedia.summary(term, sentences=2)
+            summary = get_summary(term, lang)
         except Exception:
-            return f"未找到“{term}”的百科信息。"
+            continue
+        if summary:
+            return summary
+    metrics.inc("esg_source_failures_total", source="wikipedia")
+    return f"未找到“{term}”的百科信息。"
 
+@metrics.timed("esg_source_seconds", source="sec")
 def sec_edgar_10k(cik: str) -> str:
-    """获取美国SEC EDGAR公司年报信息（示例：董事会成员数）。"""
+    """获取美国SEC EDGAR公司年报信息（董事会成员数、员工人数、环境相关支出等XBRL事实）。"""
     try:
-        url = f"https://data.sec.gov/api/xbrl/companyfacts/{cik}.json"
-        headers = {"User-Agent": "example@domain.com"}  # 提供联系人以符合SEC要求
-        resp = requests.get(url, headers=headers, timeout=10)
-        if resp.status_code != 200:
-            raise Exception(f"HTTP {resp.status_code}")
-        facts = resp.json().get("facts", {})
-        # 提取董事会成员数量
-        board_count = facts["dei"]["BoardOfDirectorsMemberCount"]["units"]["numeric"][0]["value"]
-        return f"董事会成员数：{board_count}"
+        facts = get_company_facts(cik)
+        parts = []
+        for name, (_, _, label) in DEFAULT_FACTS.items():
+            fact = facts.get(name)
+            if fact is None:
+                continue
+            unit = "" if fact["unit"] in ("pure", "numeric", "number") else f" {fact['unit']}"
+            parts.append(f"{label}：{format_value(fact['value'])}{unit}")
+        if not parts:
+            raise ValueError("未提取到目标XBRL事实")
+        return "；".join(parts)
     except Exception as e:
+        metrics.inc("esg_source_failures_total", source="sec")
         return "董事会成员数信息获取失败。"
 
+# 世界银行批量请求：每次最多合并的国家数，以及每个国家/指标保留的最近年份数
+WORLD_BANK_BATCH = 50
+WORLD_BANK_YEARS = 5
+# 预取共享背景数据（世界银行批量请求、各城市空气质量）的并发数
+CONTEXT_WORKERS = 8
+_COUNTRY_CODE_RE = re.compile(r"^[A-Za-z]{2,3}$")
+
+def _world_bank_text(country_code: str, indicator: str, rows: list) -> str:
+    entries = [f"{row['date']}年: {row['value']}" for row in rows if row.get("value") is not None]
+    if not entries:
+        return f"{country_code} 指标{indicator}暂无数据。"
+    return f"{country_code} {indicator} 数据：" + "；".join(entries)
+
+@metrics.timed("esg_source_seconds", source="world_bank")
 def world_bank_indicator(country_code: str, indicator: str) -> str:
     """获取世界银行指定指标数据（如人均GDP），国家代码为ISO两位代码。"""
     try:
         url = f"https://api.worldbank.org/v2/country/{country_code}/indicator/{indicator}"
-        resp = requests.get(url, params={"format": "json", "per_page": 5}, timeout=5)
+        resp = cached_get(url, params={"format": "json", "per_page": WORLD_BANK_YEARS}, timeout=5)
         if resp.status_code != 200:
             raise Exception(f"HTTP {resp.status_code}")
         data = resp.json()
-        if len(data) < 2 or not data[1]:
-            return f"{country_code} 指标{indicator}暂无数据。"
-        entries = [f"{entry['date']}年: {entry['value']}" for entry in data[1] if entry.get("value") is not None]
-        if not entries:
-            return f"{country_code} 指标{indicator}暂无数据。"
-        return f"{country_code} {indicator} 数据：" + "；".join(entries)
+        return _world_bank_text(country_code, indicator, data[1] if len(data) >= 2 and data[1] else [])
     except Exception as e:
-        return f"{country_code} {indicator} 数据获取失败。"
\ No newline at end of file
+        metrics.inc("esg_source_failures_total", source="world_bank")
+        return f"{country_code} {indicator} 数据获取失败。"
+
+@metrics.timed("esg_source_seconds", source="world_bank_bulk")
+def world_bank_indicators(country_codes, indicators) -> dict:
+    """
+    一次请求获取多个国家、多个指标最近 WORLD_BANK_YEARS 年的数据（国家与指标均以 ; 分隔，多指标时需 source=2），
+    返回 {(国家代码, 指标): 文本}，文本与 world_bank_indicator 一致。请求失败时抛出异常。
+    """
+    codes = {code.upper(): code for code in country_codes}
+    indicators = list(dict.fromkeys(indicators))
+    url = f"https://api.worldbank.org/v2/country/{';'.join(codes)}/indicator/{';'.join(indicators)}"
+    params = {"format": "json", "mrv": WORLD_BANK_YEARS, "per_page": len(codes) * len(indicators) * WORLD_BANK_YEARS}
+    if len(indicators) > 1:
+        params["source"] = 2
+    resp = cached_get(url, params=params, timeout=10)
+    if resp.status_code != 200:
+        raise Exception(f"HTTP {resp.status_code}")
+    data = resp.json()
+    if len(data) < 2:
+        # 参数错误时接口返回 [{"message": [...]}]
+        raise Exception(f"世界银行接口错误：{data[0].get('message') if data else data}")
+    rows = {}
+    for row in data[1] or []:
+        # 返回的 country.id 为两位代码，countryiso3code 为三位代码，两者都可能是请求时使用的代码
+        for code in (row["country"]["id"], row.get("countryiso3code")):
+            if code and code.upper() in codes:
+                rows.setdefault((code.upper(), row["indicator"]["id"]), []).append(row)
+    return {(code, indicator): _world_bank_text(code, indicator, rows.get((upper, indicator), []))
+            for upper, code in codes.items() for indicator in indicators}
+
+def fetch_shared_context(country_codes, cities, indicators) -> dict:
+    """
+    并发预取多个企业共用的背景数据，每个不同的 (国家, 指标) 与城市只请求一次：
+    世界银行指标按 WORLD_BANK_BATCH 个国家合并为一次请求，批量请求失败时逐个国家请求。
+    返回 {("world_bank", 国家代码, 指标): 文本, ("air_quality", 城市): 文本}。
+    """
+    countries = list(dict.fromkeys(code for code in country_codes if code))
+    cities = list(dict.fromkeys(city for city in cities if city))
+    # 代码格式不合法时整批请求都会失败，这类国家单独请求
+    valid = [code for code in countries if _COUNTRY_CODE_RE.match(code)]
+    single = [(code, indicator) for code in countries if code not in valid for indicator in indicators]
+    context = {}
+    if not (countries and indicators) and not cities:
+        return context
+    with ThreadPoolExecutor(max_workers=CONTEXT_WORKERS, thread_name_prefix="shared-context") as executor:
+        bulk = [(chunk, executor.submit(world_bank_indicators, chunk, indicators))
+                for chunk in (valid[i:i + WORLD_BANK_BATCH] for i in range(0, len(valid), WORLD_BANK_BATCH))
+                if indicators]
+        air = [(city, executor.submit(openaq_pm25, city)) for city in cities]
+        for chunk, future in bulk:
+            try:
+                for (code, indicator), text in future.result().items():
+                    context[("world_bank", code, indicator)] = text
+            except Exception as e:
+                print(f"[警告] 世界银行批量请求失败，改为逐个国家请求（{len(chunk)} 个国家）：{e}")
+                metrics.inc("esg_source_failures_total", source="world_bank_bulk")
+                single.extend((code, indicator) for code in chunk for indicator in indicators)
+        singles = [(key, executor.submit(world_bank_indicator, *key)) for key in single]
+        for (code, indicator), future in singles:
+            context[("world_bank", code, indicator)] = future.result()
+        for city, future in air:
+            context[("air_quality", city)] = future.result()
+    return context
\ No newline at end of file
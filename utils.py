@@ -1,11 +1,31 @@
+import bisect
+import math
+import re
+
+# 评级分档：分数 >= 阈值[i] 时评级为 RATING_LABELS[i + 1]，低于最低阈值为 "D"
+RATING_THRESHOLDS = (40, 50, 60, 65, 70, 75, 80, 85, 90)
+RATING_LABELS = ("D", "C-", "C", "C+", "B-", "B", "B+", "A-", "A", "A+")
+
 def map_score_to_rating(score: float) -> str:
-    if score >= 90: return "A+"
-    elif score >= 85: return "A"
-    elif score >= 80: return "A-"
-    elif score >= 75: return "B+"
-    elif score >= 70: return "B"
-    elif score >= 65: return "B-"
-    elif score >= 60: return "C+"
-    elif score >= 50: return "C"
-    elif score >= 40: return "C-"
-    else: return "D"
+    return RATING_LABELS[bisect.bisect_right(RATING_THRESHOLDS, score)]
+
+_CJK_RE = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+
+def estimate_tokens(text: str) -> int:
+    """
+    本地粗略估算文本的token数：中文字符约0.6个token，其他字符约0.3个token。
+    用于限流与提示词预算，不追求与服务端分词完全一致。
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return int(math.ceil(cjk * 0.6 + (len(text) - cjk) * 0.3))
+
+def split_commentary(text: str) -> tuple:
+    """将评价文本拆分为（ESG评价, 投资建议）两部分，去掉标记与分隔线。"""
+    text = (text or "").replace("---", "").strip()
+    match = re.search(r"【投资建议】[:：]?", text)
+    evaluation = text[:match.start()] if match else text
+    advice = text[match.end():] if match else ""
+    evaluation = re.sub(r"^\s*【ESG评价】[:：]?", "", evaluation)
+    return evaluation.strip(), advice.strip()
@@ -0,0 +1,184 @@
+import os
+import re
+import time
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import CACHE_DIR, DiskCache
+from http_client import cached_get
+
+# 维基百科摘要：直接调用 MediaWiki API（共享HTTP会话，可录制/回放），不依赖 wikipedia 库的全局语言设置，
+# 可在多线程中并发查询。结果按 (语言, 词条) 持久化缓存，未找到的词条也会缓存（负缓存），
+# prefetch_summaries 可为整个企业列表批量预取（每次请求最多 BATCH_SIZE 个标题）。
+
+API_URL = "https://{lang}.wikipedia.org/w/api.php"
+WIKI_HEADERS = {"User-Agent": "ESG-Analyst-Agents/1.0 (example@domain.com)"}  # 维基百科要求提供联系方式
+# 摘要保留的句数（与原先 wikipedia.summary(sentences=2) 一致）
+SENTENCES = 2
+# 单次请求的标题数上限（TextExtracts 只取导言时每次最多返回20条）
+BATCH_SIZE = 20
+# 批量预取的并发请求数
+PREFETCH_WORKERS = 4
+# 摘要的持久化缓存时间（秒），未找到的词条单独使用较短的时间，以便新建词条能被发现
+WIKI_TTL = float(os.getenv("ESG_WIKI_TTL", 30 * 24 * 3600))
+WIKI_NEGATIVE_TTL = float(os.getenv("ESG_WIKI_NEGATIVE_TTL", 24 * 3600))
+REQUEST_TIMEOUT = 8
+
+_store = None
+_store_lock = threading.Lock()
+# 同一 (语言, 词条) 并发查询时只请求一次，其余线程等待结果（弱引用，查询结束后条目自动移除）
+_inflight_locks = weakref.WeakValueDictionary()
+_inflight_guard = threading.Lock()
+
+# 句点不表示句末的英文缩写（公司后缀、称谓等）；单个大写字母加句点（U.S.、J. P.）同样不断句
+ABBREVIATIONS = ("Inc", "Co", "Corp", "Ltd", "Bros", "Mr", "Mrs", "Ms", "Dr", "St", "Jr", "Sr", "No", "vs", "etc")
+# 按句切分摘要：中文句号等，或英文句末标点后跟空白与大写字母/汉字（或位于末尾），缩写后的句点除外
+_SENTENCE_RE = re.compile(
+    r".+?(?:[。！？]|" + "".join(rf"(?<!\b{re.escape(a)})" for a in ABBREVIATIONS)
+    + r"(?<!\b[A-Z])[.!?](?=\s+[A-Z\u4e00-\u9fff]|\s*$)|$)", re.S)
+
+
+def _get_store() -> DiskCache:
+    """首次使用时打开摘要缓存。"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = DiskCache(os.path.join(CACHE_DIR, "wiki.sqlite3"), ttl=WIKI_TTL, max_entries=200000)
+        return _store
+
+
+def _key(lang: str, term: str) -> str:
+    return f"{lang}:{term.strip()}"
+
+
+def _key_lock(key: str) -> threading.Lock:
+    with _inflight_guard:
+        lock = _inflight_locks.get(key)
+        if lock is None:
+            lock = _inflight_locks[key] = threading.Lock()
+        return lock
+
+
+def _cached(lang: str, term: str):
+    """返回缓存的条目 {"title", "summary"}（未找到时 summary 为 None）；没有或负缓存已过期时返回 None。"""
+    entry = _get_store().get(_key(lang, term))
+    if entry is None:
+        return None
+    if entry["summary"] is None and time.time() - entry["checked"] > WIKI_NEGATIVE_TTL:
+        return None
+    return entry
+
+
+def _remember(lang: str, term: str, title: str = None, summary: str = None):
+    _get_store().set(_key(lang, term), {"title": title, "summary": summary, "checked": time.time()})
+
+
+def _first_sentences(text: str, count: int = SENTENCES) -> str:
+    text = text.strip()
+    end = 0
+    for i, match in enumerate(_SENTENCE_RE.finditer(text)):
+        if i == count:
+            break
+        end = match.end()
+    return text[:end].strip()
+
+
+def _api(lang: str, params: dict) -> dict:
+    """调用 MediaWiki API（formatversion=2），HTTP错误时抛出异常。"""
+    resp = cached_get(API_URL.format(lang=lang), params={**params, "format": "json", "formatversion": 2},
+                      headers=WIKI_HEADERS, timeout=REQUEST_TIMEOUT, ttl=0)
+    if resp.status_code != 200:
+        raise Exception(f"HTTP {resp.status_code}")
+    return resp.json()
+
+
+def _fetch_extracts(lang: str, titles: list) -> dict:
+    """
+    批量获取词条导言，返回 {输入标题: (页面标题, 摘要)}；
+    不存在或为消歧义页的词条摘要为 None。标题按接口返回的规范化与重定向关系映射回输入。
+    """
+    data = _api(lang, {"action": "query", "prop": "extracts|pageprops", "exintro": 1, "explaintext": 1,
+                       "ppprop": "disambiguation", "redirects": 1, "titles": "|".join(titles)})
+    query = data.get("query", {})
+    normalized = {item["from"]: item["to"] for item in query.get("normalized", [])}
+    redirects = {item["from"]: item["to"] for item in query.get("redirects", [])}
+    pages = {page["title"]: page for page in query.get("pages", [])}
+    results = {}
+    for title in titles:
+        resolved = normalized.get(title, title)
+        resolved = redirects.get(resolved, resolved)
+        page = pages.get(resolved)
+        if page is None or page.get("missing") or "disambiguation" in page.get("pageprops", {}):
+            results[title] = (resolved, None)
+        else:
+            results[title] = (page["title"], _first_sentences(page.get("extract", "")) or None)
+    return results
+
+
+def _search_title(lang: str, term: str):
+    """直接查标题未命中时，按搜索结果的第一条确定词条标题（与 wikipedia 库的自动建议一致）。"""
+    data = _api(lang, {"action": "query", "list": "search", "srsearch": term, "srlimit": 1, "srprop": ""})
+    results = data.get("query", {}).get("search", [])
+    return results[0]["title"] if results else None
+
+
+def _resolve(lang: str, terms: list) -> dict:
+    """查询一批未缓存的词条并写入缓存（含负缓存），返回 {词条: 摘要或None}。"""
+    found = {}
+    for term, (title, summary) in _fetch_extracts(lang, terms).items():
+        if summary is not None:
+            _remember(lang, term, title, summary)
+            found[term] = summary
+            continue
+        # 标题未直接命中：通过搜索确定词条后再取导言
+        searched = _search_title(lang, term)
+        if searched and searched != title:
+            title, summary = _fetch_extracts(lang, [searched])[searched]
+        _remember(lang, term, title, summary)
+        found[term] = summary
+    return found
+
+
+def get_summary(term: str, lang: str = "zh"):
+    """返回某语言维基百科中词条的摘要（前 SENTENCES 句），不存在时返回 None；网络错误时抛出异常。"""
+    term = term.strip()
+    entry = _cached(lang, term)
+    if entry is not None:
+        return entry["summary"]
+    with _key_lock(_key(lang, term)):
+        # 等待期间其他线程可能已经完成同一查询
+        entry = _cached(lang, term)
+        if entry is not None:
+            return entry["summary"]
+        return _resolve(lang, [term])[term]
+
+
+def prefetch_summaries(terms, langs=("zh", "en")) -> dict:
+    """
+    为一批词条批量预取摘要并写入缓存：每种语言只查询前一语言未找到的词条，
+    每次请求最多 BATCH_SIZE 个标题，多个批次并发执行。返回 {词条: 摘要或None}。
+    单个批次失败时只打印警告，相应词条留待 get_summary 逐个查询。
+    """
+    pending = list(dict.fromkeys(term.strip() for term in terms if term and term.strip()))
+    summaries = {}
+    for lang in langs:
+        missing = []
+        for term in pending:
+            entry = _cached(lang, term)
+            if entry is None:
+                missing.append(term)
+            elif entry["summary"] is not None:
+                summaries[term] = entry["summary"]
+        batches = [missing[i:i + BATCH_SIZE] for i in range(0, len(missing), BATCH_SIZE)]
+        if batches:
+            with ThreadPoolExecutor(max_workers=min(PREFETCH_WORKERS, len(batches)),
+                                    thread_name_prefix="wiki-prefetch") as executor:
+                for batch, future in [(batch, executor.submit(_resolve, lang, batch)) for batch in batches]:
+                    try:
+                        summaries.update((t, s) for t, s in future.result().items() if s is not None)
+                    except Exception as e:
+                        print(f"[警告] 维基百科批量预取失败（{lang}，{len(batch)} 个词条）：{e}")
+        pending = [term for term in pending if term not in summaries]
+    summaries.update((term, None) for term in pending)
+    return summaries